@@ -0,0 +1,227 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Run the tasks on synthetic data against the stand-in backends, output the timings as JSON.
+
+""" Benchmark the tasks on synthetic lots, offline, and output the timings as JSON.
+Run it from the repository root with python -m benchmarks.
+
+Usage:
+    benchmarks [<benchmark>...] [--repeat=<n>] [--lots=<n>] [--picture-width=<px>] [--pano-width=<px>] [--latency=<s>] [--output=<file>] [--debug]
+    benchmarks (-h | --help)
+
+Options:
+    -h --help               Show this screen.
+    --repeat=<n>            Runs of each benchmark [default: 3].
+    --lots=<n>              Lots of the synthetic campaigns [default: 20].
+    --picture-width=<px>    Width of the synthetic lot pictures (landscape, 4:3) [default: 1440].
+    --pano-width=<px>       Width of the synthetic equirectangular panoramas [default: 4000].
+    --latency=<s>           Latency in seconds added to each stand-in REST request [default: 0].
+    --output=<file>         Write the JSON results in a file instead of the standard output.
+    --debug                 Show the tasks logs.
+
+Benchmarks : rotate, stitchable, injectcpapn, tiling, photosphere, osfmsave, pathfinder, webgen (all by default).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import importlib
+import statistics
+import subprocess
+from collections import OrderedDict
+
+from docopt import docopt
+from path import Path
+
+from opv_tasks.task import TASKS, taskClassName
+from benchmarks import datasets
+from benchmarks.standins import FakeRestClient, FakeDirectoryManagerClient
+
+
+def lotId(lot):
+    return {"id_lot": lot.id_lot, "id_malette": lot.id_malette}
+
+
+def panoramaOfLot(lot):
+    panorama = lot.cps[0].panorama[0]
+    return {"id_panorama": panorama.id_panorama, "id_malette": panorama.id_malette}
+
+
+def setupRotate(db, dm, data, options):
+    return lotId(db.add("Lot", pictures_path=dm.add(data["pictures"])))
+
+
+def setupStitchable(db, dm, data, options):
+    cp = db.add("Cp", pto_dir=dm.add(data["pto"]))
+    return {"id_cp": cp.id_cp, "id_malette": cp.id_malette}
+
+
+def setupInjectcpapn(db, dm, data, options):
+    cpFrom = db.add("Cp", pto_dir=dm.add(data["pto"]))
+    cpTo = db.add("Cp", pto_dir=dm.add(data["pto_no_apn0"]))
+    return {"idCpFrom": {"id_cp": cpFrom.id_cp, "id_malette": cpFrom.id_malette},
+            "idCpTo": {"id_cp": cpTo.id_cp, "id_malette": cpTo.id_malette},
+            "apnList": [0]}
+
+
+def setupLotPanorama(db, dm, data, options):
+    campaign = datasets.buildCampaign(db, dm, 1, data)
+    return panoramaOfLot(campaign.lots[0])
+
+
+def setupOsfmsave(db, dm, data, options):
+    campaign = datasets.buildCampaign(db, dm, options["lots"], data)
+    panoramaIds = [panoramaOfLot(lot)["id_panorama"] for lot in campaign.lots]
+    with dm.Open() as (_, osfmDir):
+        datasets.makeReconstruction(osfmDir, panoramaIds)
+    return {"id_malette": campaign.id_malette, "osfm_dir": osfmDir}
+
+
+def setupCampaign(db, dm, data, options):
+    campaign = datasets.buildCampaign(db, dm, options["lots"], data)
+    return {"id_campaign": campaign.id_campaign, "id_malette": campaign.id_malette}
+
+
+# Benchmark name -> (task name, external commands needed, setup(db, dm, data, options) -> task input data)
+BENCHMARKS = OrderedDict([
+    ("rotate", ("rotate", ["mogrify"], setupRotate)),
+    ("stitchable", ("stitchable", [], setupStitchable)),
+    ("injectcpapn", ("injectcpapn", [], setupInjectcpapn)),
+    ("tiling", ("tiling", ["nona"], setupLotPanorama)),
+    ("photosphere", ("photosphere", [], setupLotPanorama)),
+    ("osfmsave", ("osfmsave", [], setupOsfmsave)),
+    ("pathfinder", ("pathfinder", [], setupCampaign)),
+    ("webgen", ("webgen", [], setupCampaign)),
+])
+
+
+def loadTask(taskName):
+    """Return (task class, None) or (None, reason) when the task can't be imported."""
+    try:
+        module = importlib.import_module(TASKS[taskName])
+    except ImportError as e:
+        return None, "missing dependency : {}".format(e)
+    return getattr(module, taskClassName(taskName)), None
+
+
+def makeData(directory, options):
+    """Generate the synthetic files shared by the benchmarks (they are copied in each run)."""
+    directory = Path(directory)
+    width = options["picture_width"]
+    data = {}
+    for name in ["pictures", "pto", "pto_no_apn0", "panorama"]:
+        (directory / name).makedirs_p()
+    data["pictures"] = datasets.makeLotPictures(directory / "pictures", width, width * 3 // 4)
+    data["pto"] = datasets.makePto(directory / "pto")
+    data["pto_no_apn0"] = datasets.makePto(directory / "pto_no_apn0", skipApn=0, seed=1)
+    data["panorama"] = datasets.makePanorama(directory / "panorama", options["pano_width"])
+    return data
+
+
+def runBenchmark(name, data, options, logger):
+    """Run a benchmark options["repeat"] times, return it's result dict."""
+    taskName, tools, setup = BENCHMARKS[name]
+
+    Task, reason = loadTask(taskName)
+    missingTools = [tool for tool in tools if shutil.which(tool) is None]
+    if Task is None or missingTools:
+        reason = reason or "missing command : {}".format(", ".join(missingTools))
+        logger.warning("Benchmark %s skipped, %s" % (name, reason))
+        return OrderedDict([("status", "skipped"), ("reason", reason)])
+
+    result = OrderedDict([("status", "ok"), ("times", [])])
+    for run in range(options["repeat"]):
+        db = FakeRestClient(latency=options["latency"])
+        dm = FakeDirectoryManagerClient()
+        try:
+            inputData = setup(db, dm, data, options)
+            task = Task(client_requestor=db, opv_directorymanager_client=dm)
+            db.requests.clear()     # only count the task requests
+
+            start = time.perf_counter()
+            taskReturn = task.run(options=inputData)
+            duration = time.perf_counter() - start
+        finally:
+            dm.cleanup()
+
+        if not taskReturn.isSuccess():
+            logger.error("Benchmark %s failed : %s" % (name, taskReturn.error))
+            return OrderedDict([("status", "failed"), ("reason", taskReturn.error)])
+
+        logger.info("Benchmark %s run %s : %.3fs" % (name, run + 1, duration))
+        result["times"].append(duration)
+        result["requests"] = dict(db.requests)
+        result["metrics"] = taskReturn.metrics
+
+    result["min"] = min(result["times"])
+    result["median"] = statistics.median(result["times"])
+    return result
+
+
+def environment():
+    """Where the benchmark ran, to compare results between commits."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(Path(__file__).abspath().dirname()),
+                                         stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([
+        ("commit", commit),
+        ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("cpus", os.cpu_count())
+    ])
+
+
+def main():
+    arguments = docopt(__doc__)
+    logging.basicConfig(level=logging.DEBUG if arguments["--debug"] else logging.WARNING, stream=sys.stderr)
+    logger = logging.getLogger("opv_task.benchmarks")
+    logger.setLevel(logging.INFO)
+
+    names = arguments["<benchmark>"] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit("Unknown benchmarks : {}".format(", ".join(unknown)))
+
+    options = {
+        "repeat": int(arguments["--repeat"]),
+        "lots": int(arguments["--lots"]),
+        "picture_width": int(arguments["--picture-width"]),
+        "pano_width": int(arguments["--pano-width"]),
+        "latency": float(arguments["--latency"])
+    }
+
+    with tempfile.TemporaryDirectory(prefix="opv_bench_") as directory:
+        data = makeData(directory, options)
+        results = OrderedDict((name, runBenchmark(name, data, options, logger)) for name in names)
+
+    output = json.dumps(OrderedDict([("environment", environment()), ("options", options), ("results", results)]), indent=4)
+    if arguments["--output"]:
+        with open(arguments["--output"], "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Synthetic lots, panoramas and campaigns for the benchmarks.
+
+import json
+import math
+import random
+
+import numpy as np
+from PIL import Image
+from path import Path
+
+from opv_tasks.const import Const
+
+BASE_PTO = Path(__file__).abspath().dirname().parent / "opv_tasks" / "ressources" / "base.pto"
+
+# Campaign origin, lots are placed every LOT_SPACING meters along a random walk
+ORIGIN = (48.3833, -4.4833, 50.0)
+LOT_SPACING = 5.0
+
+
+def makeJpeg(path, width, height, seed=0, quality=90):
+    """
+    Write a synthetic JPEG, gradients and noise so that it compresses like a photo.
+
+    :param path: Output path.
+    :param width: Picture width.
+    :param height: Picture height.
+    :param seed: Random seed, pictures with the same seed are identical.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 4 * math.pi, width, dtype=np.float32)
+    y = np.linspace(0, 4 * math.pi, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        phase = rng.uniform(0, 2 * math.pi)
+        pixels[:, :, channel] = 127 + 60 * np.sin(x + phase) * np.cos(y * (channel + 1) / 2)
+    pixels += rng.normal(0, 12, size=(height, width, 1)).astype(np.float32)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=quality)
+    return path
+
+
+def makeLotPictures(directory, width, height, seed=0):
+    """
+    Write the 6 pictures APN0.JPG ... APN5.JPG of a lot, in landscape (as taken by the cameras).
+
+    :return: dict file name -> path.
+    """
+    pictures = {}
+    for apnNo in range(6):
+        name = "APN{}.JPG".format(apnNo)
+        pictures[name] = makeJpeg(Path(directory) / name, width, height, seed=seed * 6 + apnNo)
+    return pictures
+
+
+def makePanorama(directory, width, seed=0):
+    """Write an equirectangular panorama (width x width / 2), return dict file name -> path."""
+    path = makeJpeg(Path(directory) / Const.PANO_FILENAME, width, width // 2, seed=seed)
+    return {Const.PANO_FILENAME: path}
+
+
+def makePto(directory, pointsPerPair=20, skipApn=None, seed=0):
+    """
+    Write a project file with control points between neighbour pictures.
+
+    :param pointsPerPair: Control points between two neighbour pictures.
+    :param skipApn: Optional APN number without any control point (ie not stitchable).
+    :return: dict file name -> path.
+    """
+    rng = random.Random(seed)
+    lines = [BASE_PTO.text().rstrip("\n"), "", "# control points"]
+    nbImages = len(Const.CP_HUGIN_IMGID_2_APNID)
+    for image in range(nbImages):
+        neighbour = (image + 1) % nbImages
+        if skipApn is not None and skipApn in (Const.CP_HUGIN_IMGID_2_APNID[image], Const.CP_HUGIN_IMGID_2_APNID[neighbour]):
+            continue
+        for _ in range(pointsPerPair):
+            lines.append("c n{} N{} x{:.2f} y{:.2f} X{:.2f} Y{:.2f} t0".format(
+                image, neighbour, rng.uniform(0, 2880), rng.uniform(0, 3840), rng.uniform(0, 2880), rng.uniform(0, 3840)))
+    path = Path(directory) / Const.CP_PTO_FILENAME
+    path.write_text("\n".join(lines) + "\n")
+    return {Const.CP_PTO_FILENAME: path}
+
+
+def lotPositions(nbLots, seed=0):
+    """GPS positions [lat, lon, alt] of nbLots lots along a random walk."""
+    rng = random.Random(seed)
+    lat, lon, alt = ORIGIN
+    heading = 0.0
+    positions = []
+    for _ in range(nbLots):
+        positions.append([lat, lon, alt])
+        heading += rng.uniform(-0.5, 0.5)
+        lat += LOT_SPACING * math.cos(heading) / 111320.0
+        lon += LOT_SPACING * math.sin(heading) / (111320.0 * math.cos(math.radians(lat)))
+        alt += rng.uniform(-0.2, 0.2)
+    return positions
+
+
+def buildLot(db, dm, campaign, position, files):
+    """
+    Create a complete lot (sensors, lot, cp, panorama, tile) in the stand-ins.
+
+    :param db: FakeRestClient.
+    :param dm: FakeDirectoryManagerClient.
+    :param campaign: Campaign ressource.
+    :param position: [lat, lon, alt].
+    :param files: dict with "pictures", "pto" and "panorama" entries, file name -> path.
+    :return: The lot ressource.
+    """
+    sensors = db.add("Sensors", gps_pos={"type": "Point", "coordinates": position}, degrees=0, minutes=0)
+    lot = db.add("Lot", campaign=campaign, sensors=sensors, pictures_path=dm.add(files["pictures"]))
+    cp = db.add("Cp", lot=lot, pto_dir=dm.add(files["pto"]), stichable=True, optimized=True, nb_cp=120)
+    panorama = db.add("Panorama", cp=cp, equirectangular_path=dm.add(files["panorama"]), is_photosphere=True,
+                      sensors_reconstructed={})
+    tile = db.add("Tile", panorama=panorama, param_location=dm.add({}), fallback_path=dm.add({}),
+                  extension="jpg", max_level=3, resolution=512, cube_resolution=1024)
+
+    lot.tile = tile
+    lot.save()
+    return lot
+
+
+def buildCampaign(db, dm, nbLots, files, seed=0):
+    """
+    Create a campaign of nbLots complete lots, linked by track edges.
+
+    :return: The campaign ressource.
+    """
+    campaign = db.add("Campaign", name="benchmark", description="Synthetic campaign")
+    lots = [buildLot(db, dm, campaign, position, files) for position in lotPositions(nbLots, seed=seed)]
+    for lotFrom, lotTo in zip(lots, lots[1:]):
+        for a, b in ((lotFrom, lotTo), (lotTo, lotFrom)):
+            db.add("TrackEdge", lot_from=a, lot_to=b, yaw=0.0, pitch=0.0, targetYaw=180.0, targetPitch=0.0)
+    return campaign
+
+
+def makeReconstruction(directory, panoramaIds, seed=0):
+    """
+    Write an OpenSfM reconstruction (reference_lla.json and reconstruction.json) with a shot per panorama.
+
+    :param panoramaIds: Panorama ids of the shots.
+    :return: The directory.
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    with open(directory / "reference_lla.json", "w") as f:
+        json.dump({"latitude": ORIGIN[0], "longitude": ORIGIN[1], "altitude": ORIGIN[2]}, f)
+
+    shots = {}
+    for i, panoramaId in enumerate(panoramaIds):
+        shots["{}.jpg".format(panoramaId)] = {
+            "rotation": [rng.uniform(-0.1, 0.1), rng.uniform(-3, 3), rng.uniform(-0.1, 0.1)],
+            "translation": [i * LOT_SPACING, rng.uniform(-1, 1), rng.uniform(-0.5, 0.5)]
+        }
+    with open(directory / "reconstruction.json", "w") as f:
+        json.dump([{"shots": shots}], f)
+    return directory
@@ -0,0 +1,74 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: In memory stand-ins for the RestClient and the DirectoryManagerClient, used by the benchmarks.
+
+import time
+import shutil
+import tempfile
+
+from path import Path
+
+from opv_tasks.localbackend import LocalRestClient, LocalDirectoryManagerClient, LocalRessource
+
+
+class FakeRestClient(LocalRestClient):
+    """
+    Local backend on an in memory SQLite database. Each request is counted in self.requests
+    and can be slowed down by latency to mimic a remote API.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency: Seconds added to each request.
+        """
+        super().__init__(":memory:")
+        self.latency = latency
+
+    def _request(self, method):
+        super()._request(method)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add(self, kind, id_malette=LocalRestClient.DEFAULT_MALETTE, **fields):
+        """Insert a ressource without counting a request, used to build the datasets."""
+        ressource = LocalRessource(self, kind, id_malette=id_malette)
+        for name, value in fields.items():
+            setattr(ressource, name, value)
+        ref = self._insert(ressource._ref(), ressource._load())
+        return LocalRessource(self, kind, ref.id, ref.id_malette)
+
+
+class FakeDirectoryManagerClient(LocalDirectoryManagerClient):
+    """Local directory manager in a temporary directory."""
+
+    def __init__(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="opv_bench_dm_")
+        super().__init__(self._tmp.name)
+
+    def add(self, files):
+        """
+        Create a directory with files.
+
+        :param files: dict file name -> source path.
+        :return: The directory uuid.
+        """
+        with self.Open() as (uuid_, directory):
+            for name, source in files.items():
+                shutil.copy(source, Path(directory) / name)
+        return uuid_
+
+    def cleanup(self):
+        self._tmp.cleanup()
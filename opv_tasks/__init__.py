@@ -12,7 +12,6 @@
 # You should have received a copy of the GNU General Public License along
 # with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from opv_tasks.utils import run_cli
+from opv_tasks.utils import run_cli, find_task
 from opv_tasks.task import *
 from opv_tasks.const import Const
-from opv_tasks.third_party import *
@@ -1,31 +1,57 @@
+import sys
 import json
 import logging
 from docopt import docopt
-from .utils import find_task, generateHelp
-from opv_directorymanagerclient import DirectoryManagerClient, Protocol
-from opv_api_client import RestClient
+from .utils import find_task, generateHelp, makeClients
+from .scheduler import TaskScheduler, artifactsFromInput
+from .worker import Worker, submit
+from .task import TASKS
+from .journal import Journal
+from .cache import ResultCache
+from .task.taskMetrics import TaskMetrics
+from .identitymap import IdentityMapClient
 
-tasks = ["makeall", "rotate", "cpfind", "autooptimiser", "stitchable", "stitch", "photosphere", "tiling", "injectcpapn", "findnearestcp", "webgen", "pathfinder", "osfmextract", "osfmall", "osfmsave", "osfmlaunch", "osfmcampaign", "exportviewer"]
+tasks = list(TASKS)
 
 __doc__ = """ Task executor, will execute some task with input datas.
 
 Usage:
-    opv-task <task-name> <input-data> [--db-rest=<str>] [--dir-manager=<str>] [--debug]
+    opv-task worker <spool-dir> [--db-rest=<str>] [--dir-manager=<str>] [--journal=<file>] [--cache-dir=<dir>] [--cache-size=<bytes>] [--debug]
+    opv-task submit <spool-dir> <task-name> <input-data>
+    opv-task <task-name> <input-data> [--db-rest=<str>] [--dir-manager=<str>] [--journal=<file>] [--cache-dir=<dir>] [--cache-size=<bytes>] [--debug]
     opv-task (-h | --help)
 
 Options:
     -h --help                Show help.
-    --db-rest=<str>          API rest server [default: http://opv_master:5000]
-    --dir-manager=<str>      API for directory manager [default: http://opv_master:5005]
+    --db-rest=<str>          API rest server, or sqlite:///<file> for a local database [default: http://opv_master:5000]
+    --dir-manager=<str>      API for directory manager, or file:///<dir> for a local directory [default: http://opv_master:5005]
+    --journal=<file>         Checkpoint journal (JSONL), makeall and run_all skip the stages already completed.
+    --cache-dir=<dir>        Cache cpfind, autooptimiser, stitch and tiling results in this directory.
+    --cache-size=<bytes>     Maximum size of the cache, least recently used results are evicted.
     --debug                  Debug mode.
 
+Worker mode :
+    worker                   Stay resident and run the tasks submitted in <spool-dir>.
+    submit                   Submit a task to the workers of <spool-dir>, the TaskReturn is written in <spool-dir>/done.
+
 Sub commands/tasks are :
 
-""" + "\n\n".join([generateHelp(taskName) for taskName in tasks])
+"""
+
+
+def getDoc(withTasksHelp=False):
+    """
+    Return the docopt doc, tasks help is only built when needed as it imports all the tasks.
+
+    :param withTasksHelp: Add the tasks help.
+    """
+    if not withTasksHelp:
+        return __doc__
+    return __doc__ + "\n\n".join([generateHelp(taskName) for taskName in tasks])
 
 def main():
     """Main function."""
-    arguments = docopt(__doc__)
+    arguments = docopt(getDoc(withTasksHelp='-h' in sys.argv[1:] or '--help' in sys.argv[1:]))
     debug = bool(arguments.get('--debug'))
 
     log_level = logging.DEBUG if debug else logging.INFO
@@ -33,34 +59,43 @@ def main():
 
     logger = logging.getLogger(__name__)
 
-    dir_manager_client = DirectoryManagerClient(api_base=arguments['--dir-manager'], default_protocol=Protocol.FTP)
-    db_client = RestClient(arguments['--db-rest'])
+    if arguments['submit']:
+        requestId = submit(arguments['<spool-dir>'], arguments['<task-name>'], json.loads(arguments['<input-data>']))
+        print(requestId)
+        return
+
+    dir_manager_client, db_client = makeClients(arguments['--db-rest'], arguments['--dir-manager'])
+    journal = Journal(arguments['--journal']) if arguments['--journal'] else None
+    cache = None
+    if arguments['--cache-dir']:
+        cache_size = int(arguments['--cache-size']) if arguments['--cache-size'] else None
+        cache = ResultCache(arguments['--cache-dir'], maxSize=cache_size)
+
+    if arguments['worker']:
+        Worker(dir_manager_client, db_client, arguments['<spool-dir>'], journal=journal, cache=cache).serve()
+        return
 
     # id_task = (arguments['<id>'], arguments['<id-malette>'])
     inputData = json.loads(arguments['<input-data>'])
     task_name = arguments['<task-name>']
 
     if task_name == "run_all":
-        for task in tasks:
-            logger.info("Starting task %s" % task)
-
-            lastTaskReturn = run(dir_manager_client, db_client, task, inputData)
-            logger.debug("TaskReturn : " + lastTaskReturn.toJSON())
-
-            if not lastTaskReturn.isSuccess():
-                logger.error("Last task executed failed with following error : " + lastTaskReturn.error)
-                break
-            inputData = lastTaskReturn.outputData
-
-            logger.info("End of task %s" % task)
+        # Run every task that can be scheduled, following their inputs/outputs
+        # Tasks of a branch share an identity map for the whole pipeline run (see TaskScheduler)
+        scheduler = TaskScheduler(dir_manager_client, IdentityMapClient(db_client), [t for t in tasks if find_task(t) is not None and find_task(t).inputs is not None],
+                                  journal=journal, journalKey=Journal.key(inputData), cache=cache)
+        taskReturns = scheduler.run(artifactsFromInput(inputData))
+        for name, taskReturn in taskReturns.items():
+            logger.info("%s : %s" % (name, TaskMetrics.summary(taskReturn.metrics)))
     else:
-        lastTaskReturn = run(dir_manager_client, db_client, task_name, inputData)
+        lastTaskReturn = run(dir_manager_client, db_client, task_name, inputData, journal=journal, cache=cache)
         logger.debug("TaskReturn : " + lastTaskReturn.toJSON())
+        logger.info("%s : %s" % (task_name, TaskMetrics.summary(lastTaskReturn.metrics)))
 
         if not lastTaskReturn.isSuccess():
             logger.error("Last task executed failed with following error : " + lastTaskReturn.error)
 
-def run(dm_c, db_c, task_name, inputData):
+def run(dm_c, db_c, task_name, inputData, journal=None, cache=None):
     """
     Run task.
     Return a TaskReturn.
@@ -69,7 +104,7 @@ def run(dm_c, db_c, task_name, inputData):
     if not Task:
         raise Exception('Task %s not found' % task_name)
 
-    task = Task(client_requestor=db_c, opv_directorymanager_client=dm_c)
+    task = Task(client_requestor=db_c, opv_directorymanager_client=dm_c, journal=journal, cache=cache)
     return task.run(options=inputData)
 
 
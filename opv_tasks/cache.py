@@ -0,0 +1,138 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Content addressed cache for the outputs of deterministic tasks.
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+
+from path import Path
+
+
+class ResultCache:
+    """
+    Cache the outputs (files or directories) of deterministic tasks (cpfind, autooptimiser, stitch, tiling).
+    Entries are keyed by a hash of the task input files and options, the least recently used entries are
+    evicted when the cache is bigger than maxSize.
+    """
+
+    CHUNK_SIZE = 1024 * 1024    # Bytes read at once when hashing files
+
+    def __init__(self, directory, maxSize=None):
+        """
+        Open a cache.
+
+        :param directory: Cache directory, created if needed.
+        :param maxSize: Maximum size of the cache in bytes, None for an unbounded cache.
+        """
+        self.directory = Path(directory)
+        self.directory.makedirs_p()
+        self.maxSize = maxSize
+        self.logger = logging.getLogger("opv_task." + self.__class__.__name__)
+
+    def key(self, taskName, files=[], options=[]):
+        """
+        Compute the key of a task result.
+
+        :param taskName: Name of the task.
+        :param files: Input files of the task, their content is hashed (not their path).
+        :param options: Options of the task (JSON serializable).
+        :return: The key (hex string).
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([taskName, options], sort_keys=True, default=str).encode("utf-8"))
+        for file in files:
+            h.update(b"\0file\0")
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return self.directory / key
+
+    def fetch(self, key, destination):
+        """
+        Copy a cached result into destination.
+
+        :param key: Result key.
+        :param destination: Directory where the cached files are copied (created if needed).
+        :return: True if the key was in the cache.
+        """
+        entry = self._entry(key)
+        if not entry.isdir():
+            return False
+
+        self.logger.debug("Cache hit %s -> %s" % (key, destination))
+        Path(destination).makedirs_p()
+        for item in entry.listdir():
+            if item.isdir():
+                shutil.copytree(item, Path(destination) / item.basename())
+            else:
+                shutil.copy2(item, destination)
+        os.utime(entry)  # last use, for the eviction
+        return True
+
+    def store(self, key, paths):
+        """
+        Store a result.
+
+        :param key: Result key.
+        :param paths: Files or directories of the result, stored with their basename.
+        """
+        entry = self._entry(key)
+        if entry.isdir():
+            return
+
+        tmpEntry = self.directory / ".{}.tmp".format(uuid.uuid4().hex)
+        tmpEntry.makedirs()
+        for item in map(Path, paths):
+            if item.isdir():
+                shutil.copytree(item, tmpEntry / item.basename())
+            else:
+                shutil.copy2(item, tmpEntry)
+
+        try:
+            os.rename(tmpEntry, entry)  # atomic, concurrent readers never see partial entries
+        except OSError:
+            shutil.rmtree(tmpEntry)     # stored meanwhile by someone else
+        self.logger.debug("Cache stored %s" % key)
+
+        self.evict()
+
+    def size(self, entry):
+        """Size in bytes of a cache entry."""
+        total = 0
+        for root, _, files in os.walk(entry):
+            total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return total
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in maxSize."""
+        if self.maxSize is None:
+            return
+
+        entries = [(e.getmtime(), self.size(e), e) for e in self.directory.dirs() if not e.basename().startswith(".")]
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.maxSize:
+                break
+            self.logger.debug("Cache evict %s" % entry.basename())
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
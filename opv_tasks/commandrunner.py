@@ -0,0 +1,196 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Run external commands, their pipes are read by one asyncio loop thread, logs are batched through a queue.
+
+import os
+import time
+import queue
+import atexit
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+import logging.handlers
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class _LoggerHandler(logging.Handler):
+    """Give the records taken from the queue to the logger that made them."""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+class CommandRunner:
+    """
+    Run an external command, both pipes are read by an asyncio loop running in a dedicated thread, shared by all the
+    commands of the process (no reader threads per command). Processes are started and waited by the calling thread,
+    so no asyncio child watcher is needed (Python < 3.8).
+    Output lines are logged in batches (one log record for many lines) and only if the logger is enabled
+    for their level, records go through a QueueHandler so slow handlers don't hold the loop.
+    The last lines are kept in a bounded buffer, dumped when the command fails or times out.
+    """
+
+    STREAM_LIMIT = 1024 * 1024  # Longest line read at once (bytes), longer lines are dropped
+
+    def __init__(self, bufferLines=200, batchLines=100, batchInterval=1.0):
+        """
+        :param bufferLines: Output lines kept to be dumped on failure.
+        :param batchLines: Maximum lines per log record.
+        :param batchInterval: Maximum seconds a line waits before being logged.
+        """
+        self.bufferLines = bufferLines
+        self.batchLines = batchLines
+        self.batchInterval = batchInterval
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._queue = queue.Queue()
+        self._queueHandler = logging.handlers.QueueHandler(self._queue)
+
+    def _start(self):
+        """Start the loop thread and the log listener, once per process (a forked process starts its own)."""
+        with self._lock:
+            if self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=self._runLoop, args=(loop,), name="opv-command-runner", daemon=True).start()
+                listener = logging.handlers.QueueListener(self._queue, _LoggerHandler())
+                listener.start()
+                atexit.register(listener.stop)     # logs the queued records
+                self._loop, self._pid = loop, os.getpid()
+        return self._loop
+
+    @staticmethod
+    def _runLoop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def _log(self, logger, level, message):
+        """Log through the queue, the records of a command stay in order."""
+        self._queueHandler.handle(logger.makeRecord(logger.name, level, "(unknown file)", 0, message, None, None))
+
+    async def _read(self, pipe, logger, level, buffer):
+        """Read a pipe until EOF, log its lines by batch and keep them in buffer."""
+        loop = self._loop
+        stream = asyncio.StreamReader(limit=self.STREAM_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stream), pipe)
+        enabled = logger.isEnabledFor(level)
+        batch = []
+        deadline = None     # when the batch must be logged
+
+        def flush():
+            if batch:
+                self._log(logger, level, "\n".join(batch))
+                del batch[:]
+
+        while True:
+            try:
+                line = await asyncio.wait_for(stream.readline(), None if deadline is None else max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:    # the command is quiet, log what it printed
+                flush()
+                deadline = None
+                continue
+            except ValueError:              # line longer than STREAM_LIMIT, it's discarded by the reader
+                self._log(logger, logging.WARNING, "Output line longer than %s bytes dropped" % self.STREAM_LIMIT)
+                continue
+            if not line:
+                break
+            line = line.decode(errors="replace").rstrip()
+            buffer.append((enabled, line))
+            if enabled:
+                if not batch:
+                    deadline = loop.time() + self.batchInterval
+                batch.append(line)
+                if len(batch) >= self.batchLines:
+                    flush()
+                    deadline = None
+        flush()
+
+    async def _readAll(self, proc, logger, stdout_level, stderr_level, buffer):
+        await asyncio.gather(
+            self._read(proc.stdout, logger, stdout_level, buffer),
+            self._read(proc.stderr, logger, stderr_level, buffer))
+
+    @staticmethod
+    def _kill(proc, group):
+        """Kill the process (and it's process group when it has one)."""
+        try:
+            if group:
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            pass
+
+    def run(self, args, logger, stdout_level=logging.INFO, stderr_level=logging.WARNING, timeout=None, onStart=None, feed=None):
+        """
+        Run a command and wait for it.
+
+        :param args: Command and its arguments.
+        :param logger: Logger of the command output.
+        :param stdout_level: Level used to log the stdout (INFO, DEBUG...) -> same as in the logging module
+        :param stderr_level: Same as stdout_level, for stderr
+        :param timeout: Optional timeout in seconds, the command is killed when it expires.
+        :param onStart: Optional callable(pid) called once the process is started.
+        :param feed: Optional callable(pipe) writing the command stdin (binary pipe), called from the calling thread
+            while the output is read. The pipe is closed once it returns, the timeout is only checked afterwards.
+        :return: The return code of the command (negative signal number if it was killed).
+        """
+        buffer = deque(maxlen=self.bufferLines)
+        loop = self._start()
+        group = timeout is not None     # the whole process group is killed on timeout
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE if feed is not None else None, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, start_new_session=group)
+        readers = None
+        try:
+            if onStart is not None:
+                onStart(proc.pid)
+
+            deadline = None if timeout is None else time.monotonic() + timeout
+            readers = asyncio.run_coroutine_threadsafe(self._readAll(proc, logger, stdout_level, stderr_level, buffer), loop)
+            if feed is not None:
+                try:
+                    feed(proc.stdin)
+                    proc.stdin.close()
+                except BrokenPipeError:     # the command exited early, its return code tells why
+                    self._log(logger, logging.WARNING, "%s stopped reading its input" % args[0])
+            try:
+                readers.result(timeout)
+                returncode = proc.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+            except (FutureTimeoutError, subprocess.TimeoutExpired):
+                self._log(logger, logging.ERROR, "%s timed out after %ss, killing it" % (args[0], timeout))
+                self._kill(proc, group)
+                readers.result()
+                returncode = proc.wait()
+        finally:
+            if proc.poll() is None:     # the run failed, the process must not be left behind
+                self._kill(proc, group)
+                proc.wait()
+                if readers is not None:
+                    readers.result()
+
+        if returncode != 0:
+            notLogged = [line for logged, line in buffer if not logged]
+            if notLogged:
+                self._log(logger, logging.ERROR, "%s failed with code %s, last output lines :\n%s" % (args[0], returncode, "\n".join(notLogged)))
+        return returncode
+
+
+# Runner shared by the tasks of the process
+commandRunner = CommandRunner()
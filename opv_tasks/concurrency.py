@@ -0,0 +1,64 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Bounded concurrency and size helpers for the API requests.
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from opv_tasks.const import Const
+from opv_tasks.metricscontext import currentMetrics, bindMetrics
+
+
+def fetchConcurrently(fetch, items, maxWorkers=Const.PREFETCH_WORKERS):
+    """
+    Call fetch on each item with at most maxWorkers calls at the same time, used to load ressources
+    when the API has no batch query.
+
+    :param fetch: Callable(item).
+    :param items: Items to fetch.
+    :param maxWorkers: Maximum number of concurrent calls.
+    :return: The results, in the items order.
+    """
+    items = list(items)
+    if len(items) <= 1 or maxWorkers <= 1:
+        return [fetch(item) for item in items]
+
+    metrics = currentMetrics()     # requests of the worker threads are measured in the calling task
+
+    def boundFetch(item):
+        with bindMetrics(metrics):
+            return fetch(item)
+    with ThreadPoolExecutor(max_workers=min(maxWorkers, len(items))) as executor:
+        return list(executor.map(boundFetch, items))
+
+
+def makeAllIn(client, kind, inFilter, ids, filters=(), chunkSize=Const.FILTER_IN_CHUNK_SIZE):
+    """
+    make_all with an "in" filter over many ids, split in queries of chunkSize ids : the filters are sent in the
+    GET query string and the servers limit it's length. The queries are made with a bounded concurrency.
+
+    :param client: The RestClient.
+    :param kind: Ressource kind (ressources.Tile).
+    :param inFilter: Callable(ids) -> filter, ie Filter("id_tile").in_
+    :param ids: The ids, duplicates are queried once.
+    :param filters: Other filters of the queries.
+    :param chunkSize: Maximum number of ids per query.
+    :return: The ressources of all the queries (no query is made without ids).
+    """
+    ids = list(OrderedDict.fromkeys(ids))
+    chunks = [ids[start:start + chunkSize] for start in range(0, len(ids), chunkSize)]
+    results = fetchConcurrently(lambda chunk: client.make_all(kind, filters=tuple(filters) + (inFilter(chunk),)), chunks)
+    return [ressource for result in results for ressource in result]
@@ -25,4 +25,36 @@ class Const():
     CP_HUGIN_IMGID_2_APNID = [3, 0, 1, 2, 4, 5]   # Hugin APN number correspondance to real one, 0->3, 1->0, 2->1
     CP_SEARCHALGO_VERSION = "0.0.1"
     PANO_FILENAME = "panorama.jpg"
+    ROTATION_FILENAME = "rotation.json"     # Virtual rotation of the lot pictures (roll in degrees by picture name), see RotateTask
+    STITCH_PHOTOSPHERE_METADATA = False     # Default stitch mode, True writes the photosphere metadata in the panorama (see PhotosphereTask)
+    STITCH_OUTPUT = "convert"               # How the panorama JPEG is made (see StitchTask) : "convert", "stream" or "jpeg"
+    STITCH_JPEG_QUALITY = 92                # Quality of the panorama JPEG
+    STITCH_JPEG_SUBSAMPLING = "4:4:4"       # Chroma subsampling of the panorama JPEG : "4:4:4", "4:2:2" or "4:2:0"
+    STITCH_STREAM_ROWS = 256                # Rows of the rendered TIFF converted at once in stream mode
+    STITCH_CONVERT_LIMITS = {"memory": "256MiB", "map": "512MiB"}  # ImageMagick resources limits of the convert fallback
+    ROTATE_VIRTUAL = False                  # Default rotate mode, True records the rotation in the projects instead of rotating the pictures
     OPENSFM_RECONSTRUCTION_FOLDER = "/home/opv/data/opensfm_reconstructions/"
+
+    # Node wide subprocess budget (see opv_tasks.slots), shared by all the opv-task processes of the node
+    SUBPROCESS_SLOTS_DIR = "/tmp/opv_tasks_slots"   # Lock files of the slots
+    SUBPROCESS_SLOTS = {                            # Maximum number of processes running at the same time, per command
+        "hugin_executor": 2,
+        "nona": 2,
+        "cpfind": 4,
+        "autooptimiser": 4,
+        "convert": 2,
+        "mogrify": 8,
+        "jpegtran": 8,
+        "cjpeg": 2,
+        "exiftool": 8
+    }
+    SUBPROCESS_NICE = {}                            # Optional niceness increment per command, ie {"hugin_executor": 10}
+    SUBPROCESS_CPUS = {}                            # Optional CPU affinity per command, ie {"nona": [0, 1, 2, 3]}
+
+    SCHEDULER_MAX_WORKERS = 4                       # Tasks of a pipeline (makeall, run_all) running at the same time (see TaskScheduler)
+    FILTER_IN_CHUNK_SIZE = 100                      # Ids per query of an "in" filter, filters are in the GET query string (see concurrency.makeAllIn)
+    PREFETCH_WORKERS = 8                            # Concurrent API requests when ressources are fetched one by one (see concurrency.fetchConcurrently)
+
+    # Spatial index of the stitchable cps (see opv_tasks.spatialindex)
+    SPATIAL_INDEX_CELL_SIZE = 50.0                  # Grid cell width in meters
+    SPATIAL_INDEX_MAX_AGE = 600                     # Seconds before a campaign index is rebuilt
@@ -0,0 +1,123 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Identity map around the RestClient, each ressource is made (and fetched) once per task or pipeline run.
+
+import threading
+
+
+def ressourceKind(ressource):
+    """Kind name of a ressource (ressources.Lot instance -> "Lot")."""
+    return getattr(ressource, "_kind", None) or type(ressource).__name__
+
+
+class IdentityMapClient:
+    """
+    Wrap a RestClient, make() returns the same ressource object for the same (kind, id, id_malette)
+    so its attributes are only fetched once. Ressources made without id (to be created) are never cached.
+    Created or saved ressources must be given to invalidate (see Task._flush and Task._create).
+    """
+
+    def __init__(self, client):
+        """
+        :param client: The wrapped client.
+        """
+        self.client = client
+        self._ressources = {}
+        self._keys = {}     # id() of a ressource -> it's keys, to invalidate it without scanning the map
+        self._lock = threading.Lock()
+
+    @property
+    def identityMap(self):
+        """The identity map itself, tasks given this client (even wrapped) share it instead of wrapping it again (pipeline scope)."""
+        return self
+
+    @staticmethod
+    def _key(kindName, id, id_malette):
+        return kindName, id, id_malette
+
+    @classmethod
+    def _makeKey(cls, kind, args, kwargs):
+        """Key of a make() call, None when the ressource has no id."""
+        args = list(args)
+        if "id_malette" in kwargs:
+            args.append(kwargs["id_malette"])
+        if len(args) != 2 or args[0] is None or len(kwargs) > 1 or (kwargs and "id_malette" not in kwargs):
+            return None
+        return cls._key(kind.__name__ if isinstance(kind, type) else str(kind), args[0], args[1])
+
+    @classmethod
+    def _ressourceKey(cls, ressource):
+        """Key of a ressource, from it's id dict ({"id_lot": ID, "id_malette": ID_MALETTE})."""
+        ids = ressource.id
+        if not isinstance(ids, dict) or "id_malette" not in ids:
+            return None
+        values = [v for k, v in ids.items() if k != "id_malette"]
+        if len(values) != 1:
+            return None
+        return cls._key(ressourceKind(ressource), values[0], ids["id_malette"])
+
+    def make(self, kind, *args, **kwargs):
+        """Make a ressource, the same object is returned for the same kind and ids."""
+        key = self._makeKey(kind, args, kwargs)
+        if key is None:
+            return self.client.make(kind, *args, **kwargs)
+
+        with self._lock:
+            ressource = self._ressources.get(key)
+            if ressource is None:
+                ressource = self.client.make(kind, *args, **kwargs)
+                self._set(key, ressource)
+        return ressource
+
+    def _set(self, key, ressource):
+        """Map key to ressource, the lock must be held."""
+        previous = self._ressources.get(key)
+        if previous is not None and previous is not ressource:
+            self._forget(previous, key)
+        self._ressources[key] = ressource
+        self._keys.setdefault(id(ressource), set()).add(key)
+
+    def _forget(self, ressource, key):
+        keys = self._keys.get(id(ressource))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[id(ressource)]
+
+    def register(self, ressource):
+        """Make ressource the object returned for it's ids (ie once saved, it's up to date)."""
+        key = self._ressourceKey(ressource)
+        if key is not None:
+            with self._lock:
+                self._set(key, ressource)
+
+    def invalidate(self, ressource):
+        """Forget ressource, it will be fetched again by the next make()."""
+        key = self._ressourceKey(ressource)
+        with self._lock:
+            if key is not None and key in self._ressources:
+                self._forget(self._ressources.pop(key), key)
+            for k in self._keys.pop(id(ressource), ()):
+                self._ressources.pop(k, None)
+
+    def clear(self):
+        """Forget all the ressources."""
+        with self._lock:
+            self._ressources.clear()
+            self._keys.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,83 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Checkpoint journal of the pipelines stages, used to resume them.
+
+import json
+import threading
+
+from path import Path
+
+from opv_tasks.task import TaskReturn
+
+
+class Journal:
+    """
+    Append only JSONL file recording the TaskReturn of each stage of a pipeline, keyed by the pipeline input (ie the lot).
+    Each record is written with a single append so many processes can share the same journal.
+    """
+
+    def __init__(self, path):
+        """
+        Open a journal.
+
+        :param path: Path of the JSONL file, created if needed.
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(inputData):
+        """
+        Journal key of a pipeline input.
+
+        :param inputData: Pipeline input data, for instance {"id_lot": ID_LOT, "id_malette": ID_MALETTE}.
+        :return: The key (string).
+        """
+        return json.dumps(inputData, sort_keys=True)
+
+    def record(self, key, taskReturn):
+        """
+        Record the TaskReturn of a stage.
+
+        :param key: Pipeline key (see Journal.key).
+        :param taskReturn: The stage TaskReturn.
+        """
+        line = json.dumps({"key": key, "taskReturn": json.loads(taskReturn.toJSON())}, sort_keys=True)
+        with self._lock, open(self.path, "a") as journal:
+            journal.write(line + "\n")
+
+    def completed(self, key):
+        """
+        Successful stages of a pipeline, the last record of a stage wins.
+
+        :param key: Pipeline key (see Journal.key).
+        :return: A dict task name -> TaskReturn of the completed stages.
+        """
+        stages = {}
+        if not self.path.exists():
+            return stages
+
+        prefix = json.dumps({"key": key})[:-1]  # records start with the key, avoid parsing other pipelines records
+        with open(self.path) as journal:
+            for line in journal:
+                if not line.startswith(prefix):
+                    continue
+                taskReturn = TaskReturn(jsonStr=json.dumps(json.loads(line)["taskReturn"]))
+                if taskReturn.isSuccess():
+                    stages[taskReturn.taskName] = taskReturn
+                else:
+                    stages.pop(taskReturn.taskName, None)
+        return stages
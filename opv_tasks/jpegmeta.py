@@ -0,0 +1,378 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Read and write JPEG metadata (size, GPS Exif, GPano XMP) without decoding the pictures.
+
+import os
+import struct
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from path import Path
+
+# Start Of Frame markers, they hold the picture size (DHT, JPG and DAC share the range but aren't frames)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without length nor payload
+STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01, 0xD8}
+
+
+def readSegments(f):
+    """
+    Iterate over the segments of a JPEG file until the picture data.
+
+    :param f: Binary file object, at the beginning of the file.
+    :return: Yield (marker, payload offset, payload length).
+    """
+    if f.read(2) != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return
+        if byte != b"\xff":
+            raise ValueError("Invalid JPEG marker at {}".format(f.tell() - 1))
+        marker = ord(f.read(1))
+        while marker == 0xFF:   # fill bytes
+            marker = ord(f.read(1))
+        if marker in STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:      # EOI
+            return
+        length, = struct.unpack(">H", f.read(2))
+        offset = f.tell()
+        yield marker, offset, length - 2
+        if marker == 0xDA:      # SOS, the picture data follows
+            return
+        f.seek(offset + length - 2)
+
+
+def readFrame(path):
+    """
+    Frame header of a JPEG picture.
+
+    :param path: Picture path.
+    :return: (width, height, MCU width, MCU height), the MCU (block) size depends on the chroma subsampling.
+    """
+    with open(path, "rb") as f:
+        for marker, offset, length in readSegments(f):
+            if marker in SOF_MARKERS:
+                _, height, width, components = struct.unpack(">BHHB", f.read(6))
+                samplings = [f.read(3)[1] for _ in range(components)]
+                return width, height, 8 * max(s >> 4 for s in samplings), 8 * max(s & 0x0F for s in samplings)
+    raise ValueError("No frame header in {}".format(path))
+
+
+def readSize(path):
+    """
+    Size of a JPEG picture, read from its frame header.
+
+    :param path: Picture path.
+    :return: (width, height)
+    """
+    return readFrame(path)[:2]
+
+
+# Metadata segments
+APP1 = 0xE1
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+MAX_SEGMENT_LENGTH = 0xFFFF - 2
+
+# TIFF tags and types
+GPS_IFD_TAG = 0x8825
+EXIF_IFD_TAG = 0x8769
+INTEROP_IFD_TAG = 0xA005
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+BYTE, ASCII, SHORT, LONG, RATIONAL = 1, 2, 3, 4, 5
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+GPANO_NS = "http://ns.google.com/photos/1.0/panorama/"
+XMP_PACKET = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:GPano="{ns}"{attributes}/>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+def gpanoProperties(width, height):
+    """GPano properties of a full equirectangular panorama of width x height pixels."""
+    return OrderedDict([
+        ("ProjectionType", "equirectangular"),
+        ("CroppedAreaImageWidthPixels", width),
+        ("CroppedAreaImageHeightPixels", height),
+        ("CroppedAreaLeftPixels", 0),
+        ("CroppedAreaTopPixels", 0),
+        ("FullPanoWidthPixels", width),
+        ("FullPanoHeightPixels", height)
+    ])
+
+
+def buildXmp(properties):
+    """XMP packet with GPano properties (dict name -> value)."""
+    attributes = "".join('\n    GPano:{}="{}"'.format(name, escape(str(value), {'"': "&quot;"})) for name, value in properties.items())
+    return XMP_PACKET.format(ns=GPANO_NS, attributes=attributes).encode("utf-8")
+
+
+def rational(value, precision=100000):
+    """(numerator, denominator) of a positive number."""
+    return int(round(value * precision)), precision
+
+
+def toDegreesMinutesSeconds(value, precision=100000):
+    """
+    Absolute value of a decimal coordinate as ((d, 1), (m, 1), (s * precision, precision)) rationals.
+    The coordinate is rounded to the seconds precision first so a rounded up second carries to the minutes and degrees.
+    """
+    total = int(round(abs(value) * 3600 * precision))
+    degrees, total = divmod(total, 3600 * precision)
+    minutes, seconds = divmod(total, 60 * precision)
+    return (degrees, 1), (minutes, 1), (seconds, precision)
+
+
+def gpsEntries(latitude, longitude, altitude=None):
+    """GPS IFD entries [(tag, type, values)] of a position."""
+    entries = [
+        (0x0000, BYTE, (2, 2, 0, 0)),                                   # GPSVersionID
+        (0x0001, ASCII, b"N\x00" if latitude >= 0 else b"S\x00"),        # GPSLatitudeRef
+        (0x0002, RATIONAL, toDegreesMinutesSeconds(latitude)),           # GPSLatitude
+        (0x0003, ASCII, b"E\x00" if longitude >= 0 else b"W\x00"),       # GPSLongitudeRef
+        (0x0004, RATIONAL, toDegreesMinutesSeconds(longitude))           # GPSLongitude
+    ]
+    if altitude is not None:
+        entries.append((0x0005, BYTE, (0 if altitude >= 0 else 1,)))    # GPSAltitudeRef
+        entries.append((0x0006, RATIONAL, (rational(abs(altitude)),)))  # GPSAltitude
+    return entries
+
+
+def packIfd(entries, offset, order, nextIfd=0):
+    """
+    Pack an IFD at offset of the TIFF data.
+
+    :param entries: [(tag, type, values)] new entries or [(tag, type, count, value bytes)] copied ones (see readIfd).
+    :param order: ">" or "<", the TIFF byte order.
+    :return: bytes of the IFD followed by the values that don't fit in the entries (even length).
+    """
+    entries = sorted(entries, key=lambda e: e[0])
+    dataOffset = offset + 2 + 12 * len(entries) + 4
+    packed, data = [struct.pack(order + "H", len(entries))], []
+    for entry in entries:
+        if len(entry) == 4:
+            tag, type_, count, raw = entry
+        else:
+            tag, type_, values = entry
+            if type_ == ASCII:
+                count, raw = len(values), values
+            elif type_ == RATIONAL:
+                count, raw = len(values), b"".join(struct.pack(order + "II", *v) for v in values)
+            else:
+                count, raw = len(values), struct.pack(order + {BYTE: "B", SHORT: "H", LONG: "I"}[type_] * len(values), *values)
+        if len(raw) <= 4:
+            field = raw.ljust(4, b"\x00")
+        else:
+            field = struct.pack(order + "I", dataOffset + sum(len(d) for d in data))
+            data.append(raw + (b"\x00" if len(raw) % 2 else b""))
+        packed.append(struct.pack(order + "HHI", tag, type_, count) + field)
+    packed.append(struct.pack(order + "I", nextIfd))
+    return b"".join(packed + data)
+
+
+def readIfd(tiff, offset, order):
+    """
+    Entries of the IFD at offset of the TIFF data, with their values (not their offsets).
+
+    :return: ([(tag, type, count, value bytes)], offset of the next IFD)
+    """
+    count, = struct.unpack(order + "H", tiff[offset:offset + 2])
+    entries = []
+    for i in range(count):
+        raw = tiff[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        tag, type_, n = struct.unpack(order + "HHI", raw[:8])
+        size = TYPE_SIZES.get(type_, 1) * n
+        if size <= 4:
+            value = bytes(raw[8:8 + size])
+        else:
+            start, = struct.unpack(order + "I", raw[8:12])
+            if start + size > len(tiff):
+                raise ValueError("Exif value out of the segment")
+            value = bytes(tiff[start:start + size])
+        entries.append((tag, type_, n, value))
+    nextIfd, = struct.unpack(order + "I", tiff[offset + 2 + 12 * count:offset + 6 + 12 * count])
+    return entries, nextIfd
+
+
+def _pointer(entries, tag, order):
+    """Offset held by a pointer entry of an IFD, None if it isn't there."""
+    for entry in entries:
+        if entry[0] == tag:
+            return struct.unpack(order + "I", entry[3])[0]
+    return None
+
+
+def buildExif(gps, exif=None):
+    """
+    Exif APP1 payload with a GPS IFD.
+
+    :param gps: GPS entries, see gpsEntries.
+    :param exif: Payload of the existing Exif segment. It's rebuilt : the entries of IFD0, of the Exif and
+                 Interoperability IFDs and of IFD1 (and it's thumbnail) are kept, the GPS IFD is replaced.
+                 Maker notes holding absolute offsets might be invalidated (like with any Exif rewriter).
+    """
+    order, ifd0, exifIfd, interop, ifd1, thumbnail = ">", [], None, None, None, None
+    if exif is not None:
+        tiff = exif[len(EXIF_HEADER):]
+        order = "<" if tiff[:2] == b"II" else ">"
+        try:
+            ifd0, ifd1Offset = readIfd(tiff, struct.unpack(order + "I", tiff[4:8])[0], order)
+            if _pointer(ifd0, EXIF_IFD_TAG, order) is not None:
+                exifIfd, _ = readIfd(tiff, _pointer(ifd0, EXIF_IFD_TAG, order), order)
+                if _pointer(exifIfd, INTEROP_IFD_TAG, order) is not None:
+                    interop, _ = readIfd(tiff, _pointer(exifIfd, INTEROP_IFD_TAG, order), order)
+            if ifd1Offset:
+                ifd1, _ = readIfd(tiff, ifd1Offset, order)
+                start, length = _pointer(ifd1, THUMBNAIL_OFFSET_TAG, order), _pointer(ifd1, THUMBNAIL_LENGTH_TAG, order)
+                if start is not None and length is not None:
+                    thumbnail = bytes(tiff[start:start + length])
+        except (struct.error, ValueError):      # broken Exif, written again from scratch
+            return buildExif(gps)
+
+    pointerTags = {GPS_IFD_TAG, EXIF_IFD_TAG, INTEROP_IFD_TAG, THUMBNAIL_OFFSET_TAG}
+    ifds = OrderedDict([
+        ("ifd0", [e for e in ifd0 if e[0] not in pointerTags]),
+        ("exif", [e for e in exifIfd if e[0] not in pointerTags] if exifIfd is not None else None),
+        ("interop", interop),
+        ("gps", gps),
+        ("ifd1", [e for e in ifd1 if e[0] not in pointerTags] if ifd1 is not None else None)])
+    pointers = {"ifd0": [(GPS_IFD_TAG, "gps"), (EXIF_IFD_TAG, "exif")], "exif": [(INTEROP_IFD_TAG, "interop")]}
+
+    def withPointers(name, offsets):
+        entries = list(ifds[name])
+        for tag, target in pointers.get(name, []):
+            if ifds[target] is not None:
+                entries.append((tag, LONG, (offsets.get(target, 0),)))
+        if name == "ifd1" and thumbnail is not None:
+            entries.append((THUMBNAIL_OFFSET_TAG, LONG, (offsets.get("thumbnail", 0),)))
+        return entries
+
+    # Layout : header, the IFDs one after the other and the thumbnail, the sizes don't depend on the offsets
+    offsets, offset = {}, 8
+    for name in ifds:
+        if ifds[name] is not None:
+            offsets[name] = offset
+            offset += len(packIfd(withPointers(name, {}), offset, order))
+    offsets["thumbnail"] = offset
+
+    tiff = bytearray(b"II\x2a\x00" if order == "<" else b"MM\x00\x2a") + struct.pack(order + "I", 8)
+    for name in ifds:
+        if ifds[name] is not None:
+            nextIfd = offsets["ifd1"] if name == "ifd0" and ifds["ifd1"] is not None else 0
+            tiff += packIfd(withPointers(name, offsets), offsets[name], order, nextIfd)
+    if thumbnail is not None and ifds["ifd1"] is not None:
+        tiff += thumbnail
+    return EXIF_HEADER + bytes(tiff)
+
+
+def readMetadata(path):
+    """
+    Exif and XMP segments of a JPEG picture.
+
+    :return: (Exif payload or None, XMP packet or None)
+    """
+    exif = xmp = None
+    with open(path, "rb") as f:
+        for marker, offset, length in readSegments(f):
+            if marker == APP1:
+                payload = f.read(length)
+                if payload.startswith(EXIF_HEADER) and exif is None:
+                    exif = payload
+                elif payload.startswith(XMP_HEADER) and xmp is None:
+                    xmp = payload[len(XMP_HEADER):]
+    return exif, xmp
+
+
+def hasGPano(path):
+    """True if the picture has GPano XMP properties (ie it's a photosphere)."""
+    try:
+        _, xmp = readMetadata(path)
+    except (ValueError, struct.error, TypeError):
+        return False
+    return xmp is not None and GPANO_NS.encode() in xmp and b"ProjectionType" in xmp
+
+
+def writeMetadata(path, gpano=None, gps=None):
+    """
+    Write GPano XMP properties and a GPS position in a JPEG picture, in one pass without re-encoding it.
+    Existing Exif entries are kept, an existing XMP packet is replaced.
+
+    :param path: Picture path, modified in place.
+    :param gpano: GPano properties (see gpanoProperties) or None.
+    :param gps: GPS entries (see gpsEntries) or None.
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        segments = [(marker, offset, length) for marker, offset, length in readSegments(f)]
+        f.seek(0)
+        data = f.read()
+
+    if not segments or segments[-1][0] != 0xDA:
+        raise ValueError("No picture data in {}".format(path))
+
+    exif = None
+    kept = []
+    for marker, offset, length in segments:
+        payload = data[offset:offset + length]
+        if marker == APP1 and payload.startswith(EXIF_HEADER) and gps is not None and exif is None:
+            exif = payload
+        elif marker == APP1 and payload.startswith(XMP_HEADER) and gpano is not None:
+            continue
+        elif marker != 0xDA:
+            kept.append((marker, offset, length))
+
+    newSegments = []
+    if gps is not None:
+        newSegments.append(buildExif(gps, exif))
+    if gpano is not None:
+        newSegments.append(XMP_HEADER + buildXmp(gpano))
+    if any(len(payload) > MAX_SEGMENT_LENGTH for payload in newSegments):
+        raise ValueError("Metadata too large for a JPEG segment")
+
+    tmpPath = path + ".meta"
+    with open(tmpPath, "wb") as out:
+        out.write(b"\xff\xd8")
+        # JFIF must stay first
+        while kept and kept[0][0] == 0xE0:
+            marker, offset, length = kept.pop(0)
+            out.write(data[offset - 4:offset + length])
+        for payload in newSegments:
+            out.write(struct.pack(">BBH", 0xFF, APP1, len(payload) + 2) + payload)
+        for marker, offset, length in kept:
+            out.write(data[offset - 4:offset + length])
+        sos = segments[-1]
+        out.write(data[sos[1] - 4:])    # the picture data, untouched
+    os.replace(tmpPath, path)
+
+
+def writePhotosphereMetadata(path, coordinates):
+    """
+    Make a full equirectangular panorama a photosphere : write its GPano properties and GPS position.
+
+    :param path: Panorama path, modified in place.
+    :param coordinates: [latitude, longitude, altitude] (altitude is optional).
+    """
+    width, height = readSize(path)
+    altitude = coordinates[2] if len(coordinates) > 2 else None
+    writeMetadata(path, gpano=gpanoProperties(width, height), gps=gpsEntries(coordinates[0], coordinates[1], altitude))
@@ -0,0 +1,444 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Local backend, SQLite ressources store and filesystem directory manager (no network).
+
+import os
+import re
+import json
+import math
+import operator
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import Counter, namedtuple
+
+from path import Path
+
+from opv_tasks.metricscontext import measureRequest
+
+try:
+    from opv_api_client.exceptions import RequestAPIException
+except ImportError:
+    RequestAPIException = LookupError
+
+# Relation to an other ressource, stored in the records instead of the ressource itself
+Ref = namedtuple("Ref", ["kind", "id", "id_malette"])
+
+# Reverse relations : (kind, attribute) -> (kind of the referencing ressources, attribute referencing it)
+REVERSE_RELATIONS = {
+    ("Campaign", "lots"): ("Lot", "campaign"),
+    ("Lot", "cps"): ("Cp", "lot"),
+    ("Lot", "track_edges"): ("TrackEdge", "lot_from"),
+    ("Cp", "panorama"): ("Panorama", "cp"),
+}
+
+EARTH_RADIUS = 6371000.0    # meters, for the within filters
+
+# Ordering operators of the filters
+COMPARISONS = {
+    "<": operator.lt, "lt": operator.lt,
+    "<=": operator.le, "le": operator.le,
+    ">": operator.gt, "gt": operator.gt,
+    ">=": operator.ge, "ge": operator.ge
+}
+
+
+def kindName(kind):
+    """Name of a ressource kind, kind is a ressource class (ressources.Lot) or it's name."""
+    return kind if isinstance(kind, str) else kind.__name__
+
+
+def idKey(kind):
+    """Name of the id of a ressource kind : Lot -> id_lot, PathDetails -> id_path_details."""
+    return "id_" + re.sub(r"(?<!^)(?<!_)([A-Z])", r"_\1", kindName(kind)).lower()
+
+
+def _encode(value):
+    """Ressource data to JSON."""
+    if isinstance(value, Ref):
+        return {"$ref": list(value)}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decodeRef(obj):
+    return Ref(*obj["$ref"]) if "$ref" in obj else obj
+
+
+class RessourceNotFoundException(RequestAPIException):
+    """Raised when a ressource doesn't exist in the local backend."""
+
+    def __init__(self, ref):
+        Exception.__init__(self, "{} {} (malette {}) not found".format(*ref))
+        self.ref = ref
+
+
+class UnsupportedFilterException(RequestAPIException):
+    """Raised when a filter can't be applied by the local backend (matching every row would be wrong)."""
+
+    def __init__(self, filter):
+        Exception.__init__(self, "Filter {!r} isn't supported by the local backend".format(filter))
+        self.filter = filter
+
+
+def distance(positionA, positionB):
+    """Haversine distance in meters between 2 positions ([LAT, LON, ...] in degrees)."""
+    lat1, lon1, lat2, lon2 = [math.radians(v) for v in (positionA[0], positionA[1], positionB[0], positionB[1])]
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class LocalResponse:
+    """Response of a create, as returned by the RestClient ressources."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return dict(self._data)
+
+
+class LocalRessource:
+    """
+    A ressource of the LocalRestClient. Attributes are loaded on first access, changes are
+    stored with save() or create() like the RestClient ressources.
+    """
+
+    def __init__(self, client, kind, id=None, id_malette=None, data=None):
+        object.__setattr__(self, "_client", client)
+        object.__setattr__(self, "_kind", kindName(kind))
+        object.__setattr__(self, "_idKey", idKey(kind))
+        object.__setattr__(self, "_id", id)
+        object.__setattr__(self, "_id_malette", id_malette)
+        object.__setattr__(self, "_data", data)
+
+    def _load(self):
+        if self._data is None:
+            if self._id is None:
+                object.__setattr__(self, "_data", {})
+            else:
+                self.get()
+        return self._data
+
+    def _ref(self):
+        return Ref(self._kind, self._id, self._id_malette)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name == self._idKey:
+            return self._id
+        if name == "id_malette":
+            return self._id_malette
+        if name == "id":
+            return {self._idKey: self._id, "id_malette": self._id_malette}
+
+        data = self._load()
+        if name not in data:
+            if (self._kind, name) in REVERSE_RELATIONS:
+                return self._client._referencing(self._ref(), *REVERSE_RELATIONS[(self._kind, name)])
+            return self._client._column(self._kind, self._id, self._id_malette, data, name)    # id of a relation (cp.id_lot)
+        return self._client._decode(data.get(name))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        if name == self._idKey:
+            object.__setattr__(self, "_id", value)
+        elif name == "id_malette":
+            object.__setattr__(self, "_id_malette", value)
+        else:
+            self._load()[name] = self._client._encode(value)
+
+    def __eq__(self, other):
+        return isinstance(other, LocalRessource) and self._ref() == other._ref()
+
+    def __hash__(self):
+        return hash(self._ref())
+
+    def __repr__(self):
+        return "<{} {}>".format(self._kind, self.id)
+
+    def get(self):
+        """Reload the ressource."""
+        object.__setattr__(self, "_data", self._client._get(self._ref()))
+        return self
+
+    def save(self):
+        """Store the changes."""
+        self._client._put(self._ref(), self._load())
+
+    def create(self):
+        """Create the ressource, return a response which json() is the ressource id."""
+        ref = self._client._post(self._ref(), self._load())
+        object.__setattr__(self, "_id", ref.id)
+        object.__setattr__(self, "_id_malette", ref.id_malette)
+        return LocalResponse(self.id)
+
+
+class LocalRestClient:
+    """
+    RestClient storing the ressources in a SQLite database, same make/make_all interface.
+    Relations are stored as references, make_all understands filters given as flask-restless
+    dicts {"name": COLUMN, "op": OP, "val": VALUE} (or objects with these attributes), OP is a comparison, in or
+    within (distance to a ressource position), other filters raise an UnsupportedFilterException.
+    The PanoramaSensors view is built from the panoramas, cps, lots and sensors.
+    """
+
+    DEFAULT_MALETTE = 1
+
+    def __init__(self, database=":memory:"):
+        """
+        Open a local ressources store.
+
+        :param database: Path of the SQLite database, created if needed (":memory:" for a volatile one).
+        """
+        self.database = database
+        self.requests = Counter()
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self.logger = logging.getLogger("opv_task." + self.__class__.__name__)
+
+    def _db(self):
+        """SQLite connection of the current process, connections are not shared with forked processes."""
+        if self._connection is None or (self._pid != os.getpid() and self.database != ":memory:"):
+            self._connection = sqlite3.connect(self.database, timeout=60, isolation_level=None, check_same_thread=False)
+            self._pid = os.getpid()
+            if self.database != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS ressources ("
+                "kind TEXT NOT NULL, id INTEGER NOT NULL, id_malette INTEGER NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (kind, id, id_malette))")
+        return self._connection
+
+    def _request(self, method):
+        """Called for each read or write (measured as a REST request with what follows it), counts them."""
+        with self._lock:
+            self.requests[method] += 1
+
+    def _encode(self, value):
+        if isinstance(value, LocalRessource):
+            return value._ref()
+        if isinstance(value, list):
+            return [self._encode(v) for v in value]
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, Ref):
+            return LocalRessource(self, value.kind, value.id, value.id_malette)
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
+
+    def _rows(self, kind):
+        """All the (id, id_malette, data) of a kind."""
+        with self._lock:
+            rows = self._db().execute("SELECT id, id_malette, data FROM ressources WHERE kind = ? ORDER BY id, id_malette", (kind,)).fetchall()
+        return [(id, id_malette, json.loads(data, object_hook=_decodeRef)) for id, id_malette, data in rows]
+
+    def _panoramaSensorsRows(self):
+        """
+        Rows of the PanoramaSensors view of the API : the panoramas with the original sensors (position) and the
+        campaign of their lot.
+        """
+        def byRef(kind):
+            return {(id, id_malette): data for id, id_malette, data in self._rows(kind)}
+
+        def follow(table, ref):
+            return table.get((ref.id, ref.id_malette), {}) if isinstance(ref, Ref) else {}
+
+        cps, lots, sensors = byRef("Cp"), byRef("Lot"), byRef("Sensors")
+        rows = []
+        for id, id_malette, data in self._rows("Panorama"):
+            lot = follow(lots, follow(cps, data.get("cp")).get("lot"))
+            sensorsRef, campaign = lot.get("sensors"), lot.get("campaign")
+            view = dict(data, id_panorama=id, original_gps_pos=follow(sensors, sensorsRef).get("gps_pos"))
+            view["original_id_sensors"], view["original_id_malette"] = (sensorsRef.id, sensorsRef.id_malette) if isinstance(sensorsRef, Ref) else (None, None)
+            view["id_campaign"], view["id_campaign_malette"] = (campaign.id, campaign.id_malette) if isinstance(campaign, Ref) else (None, None)
+            rows.append((id, id_malette, view))
+        return rows
+
+    def _get(self, ref):
+        with measureRequest():
+            self._request("GET")
+            with self._lock:
+                row = self._db().execute("SELECT data FROM ressources WHERE kind = ? AND id = ? AND id_malette = ?", tuple(ref)).fetchone()
+        if row is None:
+            raise RessourceNotFoundException(ref)
+        return json.loads(row[0], object_hook=_decodeRef)
+
+    def _put(self, ref, data):
+        with measureRequest():
+            self._request("PUT")
+            with self._lock:
+                self._db().execute("INSERT OR REPLACE INTO ressources (kind, id, id_malette, data) VALUES (?, ?, ?, ?)",
+                                   tuple(ref) + (json.dumps(_encode(data)),))
+
+    def _post(self, ref, data):
+        with measureRequest():
+            self._request("POST")
+            return self._insert(ref, data)
+
+    def _insert(self, ref, data):
+        id_malette = ref.id_malette or data.get("id_malette") or self.DEFAULT_MALETTE
+        data = {k: v for k, v in data.items() if k != "id_malette"}
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")   # ids are allocated by many processes
+            try:
+                id = ref.id
+                if id is None:
+                    id = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM ressources WHERE kind = ?", (ref.kind,)).fetchone()[0]
+                db.execute("INSERT OR REPLACE INTO ressources (kind, id, id_malette, data) VALUES (?, ?, ?, ?)",
+                           (ref.kind, id, id_malette, json.dumps(_encode(data))))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return Ref(ref.kind, id, id_malette)
+
+    def _referencing(self, ref, kind, attribute):
+        """Ressources of kind which attribute is ref."""
+        with measureRequest():
+            self._request("GET")
+            rows = self._rows(kind)
+        return [LocalRessource(self, kind, id, id_malette, data) for id, id_malette, data in rows if data.get(attribute) == ref]
+
+    def _column(self, kind, id, id_malette, data, name):
+        """
+        Value of a column as seen by the API filters, ids of the relations are columns too : id_lot and id_lot_malette
+        for the relation lot, id_lot_from and id_lot_from_malette for the relation lot_from.
+        """
+        if name == idKey(kind):
+            return id
+        if name == "id_malette":
+            return id_malette
+        if name in data and not isinstance(data[name], Ref):
+            return data[name]
+        for attribute, value in data.items():
+            if isinstance(value, Ref):
+                if name == "id_" + attribute:
+                    return value.id
+                if name == "id_" + attribute + "_malette":
+                    return value.id_malette
+        for value in data.values():
+            if isinstance(value, Ref):
+                if name == idKey(value.kind):
+                    return value.id
+                if name == idKey(value.kind) + "_malette":
+                    return value.id_malette
+        return None
+
+    def _filter(self, kind, filter):
+        """
+        Filter as a dict (name, op, val), unsupported filters raise an UnsupportedFilterException.
+        A within filter (op or name "within", val ([ID, ID_MALETTE], DISTANCE)) gets the position of the referenced
+        ressource, as "center".
+        """
+        if not isinstance(filter, dict):
+            if not all(hasattr(filter, a) for a in ("name", "op", "val")):
+                raise UnsupportedFilterException(filter)
+            filter = {"name": filter.name, "op": filter.op, "val": filter.val}
+        filter = dict(filter, op=filter.get("op", "=="))
+
+        if "within" in (filter["op"], filter.get("name")):
+            try:
+                (id, id_malette), maxDistance = filter["val"]
+            except (TypeError, ValueError):
+                raise UnsupportedFilterException(filter)
+            with self._lock:
+                row = self._db().execute("SELECT data FROM ressources WHERE kind = ? AND id = ? AND id_malette = ?", (kind, id, id_malette)).fetchone()
+            if row is None:
+                raise RessourceNotFoundException(Ref(kind, id, id_malette))
+            center = json.loads(row[0], object_hook=_decodeRef).get("gps_pos")
+            return dict(filter, op="within", center=center["coordinates"] if center else None, distance=maxDistance)
+
+        if filter["op"] not in ("==", "eq", "equals", "!=", "neq", "not_equal_to", "in") and filter["op"] not in COMPARISONS:
+            raise UnsupportedFilterException(filter)
+        return filter
+
+    def _match(self, kind, id, id_malette, data, filter):
+        op = filter["op"]
+        if op == "within":
+            position = data.get("gps_pos")
+            return filter["center"] is not None and position is not None and \
+                distance(filter["center"], position["coordinates"]) <= filter["distance"]
+
+        value = self._column(kind, id, id_malette, data, filter["name"])
+        if op in ("==", "eq", "equals"):
+            return value == filter["val"]
+        if op in ("!=", "neq", "not_equal_to"):
+            return value != filter["val"]
+        if op == "in":
+            return value in filter["val"]
+        return value is not None and COMPARISONS[op](value, filter["val"])
+
+    def make(self, kind, id=None, id_malette=None):
+        """Make a ressource, it's loaded on first access."""
+        return LocalRessource(self, kind, id, id_malette)
+
+    def make_all(self, kind, filters=()):
+        """All the ressources of a kind matching the filters, they are loaded (like the API collections)."""
+        kind = kindName(kind)
+        filters = filters if isinstance(filters, (tuple, list)) else (filters,)
+        filters = [self._filter(kind, f) for f in filters]
+        with measureRequest():
+            self._request("GET")
+            rows = self._panoramaSensorsRows() if kind == "PanoramaSensors" else self._rows(kind)
+        return [LocalRessource(self, kind, id, id_malette, data) for id, id_malette, data in rows
+                if all(self._match(kind, id, id_malette, data, f) for f in filters)]
+
+
+class LocalDirectory:
+    """A directory of the LocalDirectoryManagerClient, same interface as the DirectoryManagerClient ones."""
+
+    def __init__(self, uuid, local_directory):
+        self.uuid = uuid
+        self.local_directory = local_directory
+
+    def __enter__(self):
+        return self.uuid, self.local_directory
+
+    def __exit__(self, *args):
+        pass
+
+    def save(self):
+        pass
+
+
+class LocalDirectoryManagerClient:
+    """DirectoryManagerClient keeping the directories in a local directory, files are never transfered."""
+
+    def __init__(self, root):
+        """
+        :param root: Directory where the directories are stored, created if needed.
+        """
+        self.root = Path(root)
+        self.root.makedirs_p()
+
+    def Open(self, uuid_=None):
+        """Open a directory, a new one if uuid_ is None."""
+        uuid_ = uuid_ or uuid.uuid4().hex
+        directory = self.root / uuid_
+        directory.makedirs_p()
+        return LocalDirectory(uuid_, str(directory))
@@ -0,0 +1,95 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Metrics of the task running in the current thread, the REST requests are measured where they are sent.
+
+import time
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def _stack():
+    stack = getattr(_local, "metrics", None)
+    if stack is None:
+        stack = _local.metrics = []
+    return stack
+
+
+def currentMetrics():
+    """TaskMetrics of the task running in this thread, None outside of a task run."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def bindMetrics(metrics):
+    """
+    Make metrics the current metrics of this thread, used by the task runs and by the worker threads of a task.
+
+    :param metrics: A TaskMetrics (None keeps the current one).
+    """
+    if metrics is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(metrics)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def directoryManagerCall():
+    """Mark a DirectoryManager call, the HTTP requests it sends aren't counted as REST requests."""
+    _local.directoryManager = getattr(_local, "directoryManager", 0) + 1
+    try:
+        yield
+    finally:
+        _local.directoryManager -= 1
+
+
+@contextmanager
+def measureRequest():
+    """Time a REST request, it's added to the current metrics."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = currentMetrics()
+        if metrics is not None and not getattr(_local, "directoryManager", 0):
+            metrics.addRestCall(time.perf_counter() - start)
+
+
+def measureRequests():
+    """
+    Measure every request sent with the requests library (used by the RestClient) : the ressources are fetched
+    lazily, on attribute access, so requests are measured where they are sent. Installed once per process.
+    """
+    try:
+        import requests
+    except ImportError:
+        return
+    send = requests.Session.send
+    if getattr(send, "measured", False):
+        return
+
+    def measuredSend(self, request, **kwargs):
+        with measureRequest():
+            return send(self, request, **kwargs)
+    measuredSend.measured = True
+    requests.Session.send = measuredSend
@@ -0,0 +1,206 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Run tasks as a DAG built from their declared inputs and outputs.
+
+import copy
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from opv_tasks.const import Const
+from opv_tasks.utils import find_task, runTask
+from opv_tasks.identitymap import IdentityMapClient
+from opv_tasks.task.taskMetrics import TaskMetrics
+
+# Artifacts that can be given directly as input data, with the keys identifying them
+SEED_ARTIFACTS = OrderedDict([
+    ("lot", ["id_lot", "id_malette"]),
+    ("cp", ["id_cp", "id_malette"]),
+    ("panorama", ["id_panorama", "id_malette"]),
+    ("campaign", ["id_campaign", "id_malette"]),
+    ("virtualtour", ["id_virtualtour", "id_malette"]),
+    ("osfm_panoramas", ["ids_pano", "osfm_dir", "id_malette"])
+])
+
+
+def artifactsFromInput(inputData):
+    """
+    Build the initial artifacts from a task input data.
+
+    :param inputData: Input data, for instance {"id_lot": ID_LOT, "id_malette": ID_MALETTE}.
+    :return: A dict artifact name -> artifact value.
+    """
+    artifacts = {}
+    if isinstance(inputData, dict):
+        for name, keys in SEED_ARTIFACTS.items():
+            if all(k in inputData for k in keys):
+                artifacts[name] = inputData
+    return artifacts
+
+
+class TaskScheduler:
+    """
+    Schedule tasks using their inputs/outputs artifacts (lot -> cp -> panorama -> tile ...).
+    A task is started as soon as all its inputs are available, independent branches run at the same time.
+    Neither the identity map nor the ressources are thread safe, so each branch has its own identity map : a task
+    takes the map of the task producing its inputs, the other consumers of these artifacts get a new one.
+    """
+
+    def __init__(self, dm_c, db_c, taskNames, maxWorkers=None, recover=None, journal=None, journalKey=None, cache=None):
+        """
+        Build the DAG.
+
+        :param dm_c: The directory manager client.
+        :param db_c: The db client, when it's an identity map the first branch uses it.
+        :param taskNames: Names of the tasks to schedule, they must declare inputs and outputs.
+        :param maxWorkers: Maximum number of tasks running at the same time (default Const.SCHEDULER_MAX_WORKERS).
+        :param recover: Optional callable (taskName, taskReturn) -> TaskReturn or None, called when a task failed.
+        :param journal: Optional Journal, completed stages are skipped and each stage is recorded.
+        :param journalKey: Key of the pipeline in the journal (see Journal.key).
+        :param cache: Optional ResultCache given to the tasks.
+        """
+        self._dm_c = dm_c
+        self._identity_map = getattr(db_c, "identityMap", None) or IdentityMapClient(db_c)
+        self.maxWorkers = maxWorkers or Const.SCHEDULER_MAX_WORKERS
+        self.recover = recover
+        self.journal = journal
+        self.journalKey = journalKey
+        self.cache = cache
+        self.logger = logging.getLogger("opv_task." + self.__class__.__name__)
+
+        self.tasks = OrderedDict()
+        self.producers = {}
+        for taskName in taskNames:
+            Task = find_task(taskName)
+            if Task is None:
+                raise Exception('Task %s not found' % taskName)
+            if Task.inputs is None or Task.outputs is None:
+                raise Exception('Task %s does not declare its inputs/outputs' % taskName)
+
+            self.tasks[taskName] = Task
+            for output in Task.outputs:
+                if output in self.producers:
+                    raise Exception('Artifact %s is produced by %s and %s' % (output, self.producers[output], taskName))
+                self.producers[output] = taskName
+
+    def buildInput(self, taskName, artifacts):
+        """
+        Build the input data of a task from its input artifacts.
+
+        :param taskName: Task name.
+        :param artifacts: Available artifacts.
+        :return: The task input data.
+        """
+        inputs = self.tasks[taskName].inputs
+        if len(inputs) == 1:
+            return copy.deepcopy(artifacts[inputs[0]])
+
+        inputData = {}
+        for name in inputs:
+            inputData.update(artifacts[name])
+        return inputData
+
+    def branchMap(self, taskName):
+        """
+        Identity map of a task, the one of the first producer of its inputs not already taken by another consumer.
+
+        :param taskName: Task name.
+        :return: An IdentityMapClient.
+        """
+        for name in self.tasks[taskName].inputs:
+            identityMap = self.artifactMaps.get(name)
+            if identityMap is not None:
+                break
+        else:
+            identityMap = IdentityMapClient(self._identity_map.client)
+        # The map is taken, the artifacts produced by the task give it to their first consumer
+        self.artifactMaps = {name: m for name, m in self.artifactMaps.items() if m is not identityMap}
+        for output in self.tasks[taskName].outputs:
+            self.artifactMaps[output] = identityMap
+        return identityMap
+
+    def runTask(self, taskName, inputData, db_c):
+        """Run a task with the db client (identity map) of its branch, return it's TaskReturn."""
+        self.logger.info("Starting task %s" % taskName)
+        taskReturn = runTask(self._dm_c, db_c, taskName, inputData, cache=self.cache)
+        self.logger.debug("TaskReturn : " + taskReturn.toJSON())
+
+        if not taskReturn.isSuccess() and self.recover is not None:
+            recoveredReturn = self.recover(taskName, taskReturn)
+            if recoveredReturn is not None:
+                taskReturn = recoveredReturn
+
+        if self.journal is not None:
+            self.journal.record(self.journalKey, taskReturn)
+
+        if taskReturn.isSuccess():
+            self.logger.info("End of task %s (%s)" % (taskName, TaskMetrics.summary(taskReturn.metrics)))
+        else:
+            self.logger.error("Task %s failed with following error : %s (%s)" % (taskName, taskReturn.error, TaskMetrics.summary(taskReturn.metrics)))
+        return taskReturn
+
+    def run(self, artifacts):
+        """
+        Run all the tasks which inputs can be satisfied.
+
+        :param artifacts: Initial artifacts (see artifactsFromInput), updated with the tasks outputs.
+        :return: An OrderedDict task name -> TaskReturn, tasks that could not run are not in it.
+        """
+        self.artifacts = artifacts
+        self.artifactMaps = {name: self._identity_map for name in artifacts}    # maps not taken yet, by artifact
+        taskReturns = OrderedDict()
+        pending = OrderedDict(self.tasks)
+        running = {}
+
+        completed = self.journal.completed(self.journalKey) if self.journal is not None else {}
+
+        with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            while True:
+                resumed = True
+                while resumed:     # tasks resumed from the journal might make others ready
+                    resumed = False
+                    for taskName, Task in list(pending.items()):
+                        if len(running) >= self.maxWorkers:
+                            break
+                        if all(name in artifacts for name in Task.inputs):
+                            del pending[taskName]
+                            identityMap = self.branchMap(taskName)
+                            if taskName in completed:
+                                self.logger.info("Task %s already completed, skipping it" % taskName)
+                                taskReturns[taskName] = completed[taskName]
+                                for output in Task.outputs:
+                                    artifacts[output] = completed[taskName].outputData
+                                resumed = True
+                                continue
+                            inputData = self.buildInput(taskName, artifacts)
+                            running[executor.submit(self.runTask, taskName, inputData, identityMap)] = taskName
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    taskName = running.pop(future)
+                    taskReturn = future.result()
+                    taskReturns[taskName] = taskReturn
+                    if taskReturn.isSuccess():
+                        for output in self.tasks[taskName].outputs:
+                            artifacts[output] = taskReturn.outputData
+
+        for taskName in pending:
+            self.logger.info("Task %s skipped, inputs %s unavailable" % (taskName, self.tasks[taskName].inputs))
+
+        return taskReturns
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Node wide concurrency budget for the external commands (hugin, ImageMagick, exiftool ...).
+
+import os
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+
+from path import Path
+
+from opv_tasks.const import Const
+
+
+class SubprocessSlots:
+    """
+    Limit the number of processes of a command running at the same time on the node.
+    Each command has N slots, a slot is a lock file held (flock) while the process runs, so the budget is shared
+    by all the threads and processes (workers, makecampaign pool ...) of the node and released if a process dies.
+    The directory is shared by the users of the node (sticky and world writable like /tmp), lock files are
+    readable by all and opened read-only, flock doesn't need more.
+    """
+
+    def __init__(self, directory=Const.SUBPROCESS_SLOTS_DIR, slots=Const.SUBPROCESS_SLOTS, nice=Const.SUBPROCESS_NICE,
+                 cpus=Const.SUBPROCESS_CPUS, pollInterval=0.05):
+        """
+        :param directory: Directory of the slots lock files, created if needed.
+        :param slots: dict command -> number of slots, commands not in it are not limited.
+        :param nice: dict command -> niceness increment of its processes.
+        :param cpus: dict command -> CPUs the processes are bound to.
+        :param pollInterval: Seconds between two attempts to get a slot.
+        """
+        self.directory = Path(directory)
+        self.slots = slots
+        self.nice = nice
+        self.cpus = cpus
+        self.pollInterval = pollInterval
+        self.logger = logging.getLogger("opv_task." + self.__class__.__name__)
+
+    @staticmethod
+    def command(cmd):
+        """Command name used in the configuration : /usr/bin/nona -> nona."""
+        return os.path.basename(cmd)
+
+    def _makeDirectory(self):
+        """Create the slots directory, writable by all the users of the node."""
+        if not self.directory.isdir():
+            self.directory.makedirs_p()
+        if self.directory.stat().st_uid == os.getuid() and self.directory.stat().st_mode & 0o1777 != 0o1777:
+            os.chmod(self.directory, 0o1777)    # the umask applies to makedirs
+
+    def _tryLock(self, command):
+        """Try to lock one of the slots of command, return the locked file descriptor or None."""
+        for slot in range(self.slots[command]):
+            fd = os.open(self.directory / "{}.{}.lock".format(command, slot), os.O_RDONLY | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_uid == os.getuid() and os.fstat(fd).st_mode & 0o444 != 0o444:
+                os.fchmod(fd, 0o644)    # the other users must be able to open it
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @contextmanager
+    def acquire(self, cmd):
+        """
+        Wait for a slot of cmd and hold it, use it as a context manager around the process run.
+
+        :param cmd: The command (name or path).
+        :return: Yield the time waited for the slot in seconds.
+        """
+        command = self.command(cmd)
+        if command not in self.slots:
+            yield 0.0
+            return
+
+        self._makeDirectory()
+        start = time.perf_counter()
+        fd = self._tryLock(command)
+        if fd is None:
+            self.logger.debug("Waiting for a %s slot" % command)
+        while fd is None:
+            time.sleep(self.pollInterval)
+            fd = self._tryLock(command)
+        waitTime = time.perf_counter() - start
+
+        try:
+            yield waitTime
+        finally:
+            os.close(fd)    # releases the lock
+
+    def configure(self, cmd, pid):
+        """
+        Apply the nice level and CPU affinity of cmd to a started process (done from the parent, preexec_fn isn't thread safe).
+
+        :param cmd: The command (name or path).
+        :param pid: Process id.
+        """
+        command = self.command(cmd)
+        nice = self.nice.get(command)
+        cpus = self.cpus.get(command)
+        try:
+            if nice is not None:
+                os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + nice)
+            if cpus is not None:
+                os.sched_setaffinity(pid, cpus)
+        except OSError as e:   # the process might already be done
+            self.logger.debug("Can't configure %s process %s : %s" % (command, pid, e))
+
+
+# Budget shared by the tasks of the process
+subprocessSlots = SubprocessSlots()
@@ -0,0 +1,225 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: In process spatial index of the stitchable cps of a campaign, used to find APN0 donors.
+
+import math
+import time
+import threading
+
+import numpy as np
+
+from opv_api_client import ressources, Filter
+
+from opv_tasks.const import Const
+from opv_tasks.concurrency import makeAllIn
+
+EARTH_RADIUS = 6373000.0    # meters
+
+
+def haversine(lat, lon, lats, lons):
+    """
+    Distances in meters between a position and many positions (degrees), vectorized.
+
+    :param lat: Latitude of the position.
+    :param lon: Longitude of the position.
+    :param lats: Latitudes (numpy array or scalar).
+    :param lons: Longitudes (numpy array or scalar).
+    """
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def ressourceKey(ressource, idName):
+    """(id, id_malette) of a ressource : ressourceKey(cp, "id_cp")."""
+    return getattr(ressource, idName), ressource.id_malette
+
+
+def lotPosition(lot):
+    """Position [lat, lon, ...] of a lot, None if it has no sensors or no position."""
+    sensors = lot.sensors
+    if sensors is None or not sensors.gps_pos:
+        return None
+    return sensors.gps_pos["coordinates"]
+
+
+def campaignEntries(client, campaign):
+    """
+    Index entries of the stitchable cps of a campaign, loaded with 3 queries : the lots, their sensors and their
+    stitchable cps (ids lists are split in chunks, see makeAllIn). Relations are followed with their ids columns. Lots without sensors or position are skipped.
+
+    :param client: The RestClient.
+    :param campaign: The campaign ressource.
+    :return: [(cp key, lot key, latitude, longitude)]
+    :raise: RequestAPIException (or TypeError, AttributeError from the client Filter) when the queries can't be made.
+    """
+    lots = client.make_all(ressources.Lot, filters=(
+        Filter("id_campaign") == campaign.id_campaign,
+        Filter("id_campaign_malette") == campaign.id_malette))
+    sensors = makeAllIn(client, ressources.Sensors, Filter("id_sensors").in_,
+                        [lot.id_sensors for lot in lots if lot.id_sensors is not None])
+    positions = {ressourceKey(s, "id_sensors"): s.gps_pos["coordinates"] for s in sensors if s.gps_pos}
+
+    lotsPositions = {}
+    for lot in lots:
+        position = positions.get((lot.id_sensors, lot.id_sensors_malette))
+        if position is not None:
+            lotsPositions[ressourceKey(lot, "id_lot")] = position
+
+    cps = makeAllIn(client, ressources.Cp, Filter("id_lot").in_, [id_lot for id_lot, _ in lotsPositions],
+                    filters=(Filter("stichable") == True,))
+    entries = []
+    for cp in cps:
+        lotKey = (cp.id_lot, cp.id_lot_malette)
+        if cp.stichable and lotKey in lotsPositions:
+            entries.append((ressourceKey(cp, "id_cp"), lotKey, lotsPositions[lotKey][0], lotsPositions[lotKey][1]))
+    return entries
+
+
+class StitchableCpIndex:
+    """
+    Grid of the stitchable cps positions (the position of their lot). The positions are projected on a plane
+    tangent to the campaign (its first position), each cell is cellSize meters wide. A lookup only computes
+    the distances of the cps of the cells around the position.
+    """
+
+    def __init__(self, cellSize=Const.SPATIAL_INDEX_CELL_SIZE):
+        """
+        :param cellSize: Cell width in meters.
+        """
+        self.cellSize = cellSize
+        self.builtAt = time.monotonic()
+        self._cps = {}      # cp key -> (lot key, latitude, longitude)
+        self._cells = {}    # cell -> set of cp keys
+        self._refCos = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cps)
+
+    def _cell(self, lat, lon):
+        if self._refCos is None:
+            self._refCos = math.cos(math.radians(lat))
+        meters = math.radians(1) * EARTH_RADIUS   # length of a degree of latitude
+        return int(math.floor(lat * meters / self.cellSize)), int(math.floor(lon * meters * self._refCos / self.cellSize))
+
+    def add(self, cpKey, lotKey, lat, lon):
+        """Add (or move) a stitchable cp, lat and lon are its lot position in degrees."""
+        with self._lock:
+            self._remove(cpKey)
+            self._cps[cpKey] = (lotKey, lat, lon)
+            self._cells.setdefault(self._cell(lat, lon), set()).add(cpKey)
+
+    def remove(self, cpKey):
+        """Remove a cp (no longer stitchable)."""
+        with self._lock:
+            self._remove(cpKey)
+
+    def _remove(self, cpKey):
+        entry = self._cps.pop(cpKey, None)
+        if entry is not None:
+            cell = self._cells[self._cell(entry[1], entry[2])]
+            cell.discard(cpKey)
+
+    def nearest(self, lat, lon, maxDistance, excludeLot=None):
+        """
+        Stitchable cps around a position.
+
+        :param lat: Latitude (degrees).
+        :param lon: Longitude (degrees).
+        :param maxDistance: Search radius in meters.
+        :param excludeLot: Lot key which cps are ignored (the lot the donor is searched for).
+        :return: [(distance in meters, cp key)] sorted by distance.
+        """
+        with self._lock:
+            if not self._cps:
+                return []
+            row, col = self._cell(lat, lon)
+            reach = int(math.ceil(maxDistance / self.cellSize))
+            keys = [key for r in range(row - reach, row + reach + 1) for c in range(col - reach, col + reach + 1)
+                    for key in self._cells.get((r, c), ()) if self._cps[key][0] != excludeLot]
+            positions = np.array([self._cps[key][1:] for key in keys], dtype=float).reshape(-1, 2)
+
+        distances = haversine(lat, lon, positions[:, 0], positions[:, 1])
+        return [(float(distances[i]), keys[i]) for i in np.argsort(distances, kind="stable") if distances[i] <= maxDistance]
+
+
+class StitchableCpIndexes:
+    """
+    Index of each campaign, built on the first lookup (see campaignEntries) and rebuilt when older than maxAge
+    (other processes update the cps too).
+    Indexes aren't shared between processes : each makecampaign pool worker builds the index of a campaign when
+    it first needs it (APN0 recovery), the pool is forked before any request is made so it can't be built before.
+    """
+
+    def __init__(self, maxAge=Const.SPATIAL_INDEX_MAX_AGE):
+        """
+        :param maxAge: Seconds an index is used before being rebuilt.
+        """
+        self.maxAge = maxAge
+        self._indexes = {}      # campaign key -> StitchableCpIndex
+        self._lock = threading.Lock()
+
+    def cached(self, campaign):
+        """Index of a campaign if it's in memory and not too old, else None."""
+        with self._lock:
+            index = self._indexes.get(ressourceKey(campaign, "id_campaign"))
+        if index is not None and time.monotonic() - index.builtAt <= self.maxAge:
+            return index
+        return None
+
+    def get(self, client, campaign):
+        """
+        Index of a campaign, built with the client if needed.
+
+        :raise: The errors of campaignEntries when the index can't be built.
+        """
+        index = self.cached(campaign)
+        if index is not None:
+            return index
+
+        index = StitchableCpIndex()
+        for entry in campaignEntries(client, campaign):
+            index.add(*entry)
+        with self._lock:
+            self._indexes[ressourceKey(campaign, "id_campaign")] = index
+        return index
+
+    def updateCp(self, cp):
+        """Add or remove a cp from its campaign index after it's stitchability changed, nothing is done if the index isn't built."""
+        with self._lock:
+            if not self._indexes:
+                return
+        lot = cp.lot
+        with self._lock:
+            index = self._indexes.get(ressourceKey(lot.campaign, "id_campaign"))
+        if index is None:
+            return
+
+        cpKey = ressourceKey(cp, "id_cp")
+        position = lotPosition(lot)
+        if cp.stichable and position is not None:
+            index.add(cpKey, ressourceKey(lot, "id_lot"), position[0], position[1])
+        else:
+            index.remove(cpKey)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+# Indexes shared by the tasks of the process
+stitchableCpIndexes = StitchableCpIndexes()
@@ -16,21 +16,34 @@ from opv_tasks.task.taskStatusCode import TaskStatusCode
 from opv_tasks.task.taskReturn import TaskReturn
 from opv_tasks.task.taskException import TaskException
 from opv_tasks.task.task import Task, TaskInvalidArgumentsException
-from opv_tasks.task.rotatetask import RotateTask
-from opv_tasks.task.cpfindtask import CpfindTask
-from opv_tasks.task.autooptimisertask import AutooptimiserTask
-from opv_tasks.task.stitchabletask import StitchableTask
-from opv_tasks.task.stitchtask import StitchTask
-from opv_tasks.task.tilingtask import TilingTask
-from opv_tasks.task.photospheretask import PhotosphereTask
-from opv_tasks.task.injectcpapntask import InjectcpapnTask
-from opv_tasks.task.findnearestcptask import FindnearestcpTask
-from opv_tasks.task.osfmextracttask import OsfmextractTask
-from opv_tasks.task.osfmsavetask import OsfmsaveTask
-from opv_tasks.task.osfmlaunchtask import OsfmlaunchTask
-from opv_tasks.task.osfmalltask import OsfmallTask
-from opv_tasks.task.makealltask import MakeallTask
-from opv_tasks.task.pathfindertask import PathfinderTask
-from opv_tasks.task.webgentask import WebgenTask
-from opv_tasks.task.osfmcampaigntask import OsfmcampaignTask
-from opv_tasks.task.exportviewertask import ExportviewerTask
+from collections import OrderedDict
+
+# Task name -> module, tasks are only imported when they are used : get their class with opv_tasks.utils.find_task
+# (or import their module, from opv_tasks.task.rotatetask import RotateTask)
+TASKS = OrderedDict([
+    ("makeall", "opv_tasks.task.makealltask"),
+    ("makecampaign", "opv_tasks.task.makecampaigntask"),
+    ("rotate", "opv_tasks.task.rotatetask"),
+    ("cpfind", "opv_tasks.task.cpfindtask"),
+    ("autooptimiser", "opv_tasks.task.autooptimisertask"),
+    ("stitchable", "opv_tasks.task.stitchabletask"),
+    ("stitch", "opv_tasks.task.stitchtask"),
+    ("photosphere", "opv_tasks.task.photospheretask"),
+    ("tiling", "opv_tasks.task.tilingtask"),
+    ("injectcpapn", "opv_tasks.task.injectcpapntask"),
+    ("findnearestcp", "opv_tasks.task.findnearestcptask"),
+    ("webgen", "opv_tasks.task.webgentask"),
+    ("pathfinder", "opv_tasks.task.pathfindertask"),
+    ("osfmextract", "opv_tasks.task.osfmextracttask"),
+    ("osfmall", "opv_tasks.task.osfmalltask"),
+    ("osfmsave", "opv_tasks.task.osfmsavetask"),
+    ("osfmlaunch", "opv_tasks.task.osfmlaunchtask"),
+    ("osfmcampaign", "opv_tasks.task.osfmcampaigntask"),
+    ("exportviewer", "opv_tasks.task.exportviewertask")
+])
+
+
+def taskClassName(taskName):
+    """Name of the class implementing a task : rotate -> RotateTask."""
+    return "{}Task".format(taskName.title())
+
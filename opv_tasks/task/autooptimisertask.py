@@ -42,13 +42,15 @@ class AutooptimiserTask(Task):
     TMP_OUTPUT = "out.pto"
 
     requiredArgsKeys = ["id_cp", "id_malette"]
+    inputs = ["cp"]
+    outputs = ["optimised_cp"]
 
     def optimise(self):
         """Optimise CP."""
         with self._opv_directory_manager.Open(self.cp.pto_dir) as (_, pto_dirpath):
             proj_pto = Path(pto_dirpath) / Const.CP_PTO_FILENAME
 
-            lot = self._client_requestor.make(ressources.Lot, *self.cp.lot.id.values())
+            lot = self.cp.lot
 
             with self._opv_directory_manager.Open(lot.pictures_path) as (_, pictures_dir):
                 local_tmp_pto = Path(pictures_dir) / self.TMP_PTONAME
@@ -57,15 +59,25 @@ class AutooptimiserTask(Task):
                 self.logger.debug("Copy pto file " + proj_pto + " -> " + local_tmp_pto)
                 copyfile(proj_pto, local_tmp_pto)
 
-                options = list(self.AUTOOPTIMISER_OPTIONS)
-                options.append("-o")
-                options.append(local_tmp_output)  # Add output
-                options.append(local_tmp_pto)  # Add input pto
-                self.logger.debug("Running : " + "autooptimiser" + " ".join(options))
-                exitCode = self._run_cli("autooptimiser", options)
+                cacheKey = None
+                if self._cache is not None:
+                    cacheKey = self._cache.key(self.TASK_NAME, files=[local_tmp_pto], options=self.AUTOOPTIMISER_OPTIONS)
 
-                if exitCode != 0:
-                    raise AutooptimiserException(cli_options=options)
+                if cacheKey is not None and self._cache.fetch(cacheKey, pictures_dir):
+                    self.logger.info("Optimised CP found in cache, autooptimiser skipped")
+                else:
+                    options = list(self.AUTOOPTIMISER_OPTIONS)
+                    options.append("-o")
+                    options.append(local_tmp_output)  # Add output
+                    options.append(local_tmp_pto)  # Add input pto
+                    self.logger.debug("Running : " + "autooptimiser" + " ".join(options))
+                    exitCode = self._run_cli("autooptimiser", options)
+
+                    if exitCode != 0:
+                        raise AutooptimiserException(cli_options=options)
+
+                    if cacheKey is not None:
+                        self._cache.store(cacheKey, [local_tmp_output])
 
                 self.cp.optimized = True
 
@@ -80,7 +92,7 @@ class AutooptimiserTask(Task):
 
         self.optimise()
 
-        self.cp.save()
+        self._save(self.cp)
 
         return self.cp.id     # Return id_cp and id_malette in a dict
 
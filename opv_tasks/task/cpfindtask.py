@@ -17,11 +17,15 @@
 # Description: Find control points using hugin cpfind.
 
 import os
+import re
+import json
+import math
 from shutil import copyfile
 from path import Path
 from opv_api_client import ressources
 
 from opv_tasks.const import Const
+from opv_tasks.jpegmeta import readSize
 
 from opv_tasks.task import Task, TaskException
 
@@ -48,6 +52,61 @@ class CpfindTask(Task):
         "--kdtreesteps", "300"]
 
     requiredArgsKeys = ["id_lot", "id_malette"]
+    inputs = ["rotated_lot"]
+    outputs = ["cp"]
+
+    def applyRotation(self, pto_path, pictures_dir):
+        """
+        Apply the virtual rotation of the lot pictures (see RotateTask) to a project : the image lines get the
+        pictures real size and the rotation as roll, the field of view is converted to the new width (the old width
+        is the height of the picture once rotated by 90°).
+
+        :param pto_path: Project file, modified in place.
+        :param pictures_dir: Lot pictures directory.
+        """
+        rotation_path = Path(pictures_dir) / Const.ROTATION_FILENAME
+        if not rotation_path.exists():
+            return
+        rolls = json.loads(rotation_path.text())
+        self.logger.debug("Applying virtual rotation : " + str(rolls))
+
+        lines = []
+        for line in pto_path.lines(retain=False):
+            name = re.search(r' n"([^"]*)"', line)
+            if line.startswith("i ") and name is not None and rolls.get(name.group(1)):
+                line = self.rotateImageLine(line, rolls[name.group(1)], readSize(Path(pictures_dir) / name.group(1)))
+            lines.append(line)
+        pto_path.write_text("\n".join(lines) + "\n")
+
+    @staticmethod
+    def rotateImageLine(line, roll, size):
+        """
+        Rotate a project image line.
+
+        :param line: "i w2880 h3840 f3 v92.96 ... r0 ..." line.
+        :param roll: Roll in degrees.
+        :param size: (width, height) of the picture.
+        :return: The new line.
+        """
+        tokens = line.split(" ")
+        projection = next((t[1:] for t in tokens[1:] if t.startswith("f")), None)
+        ratio = float(size[0]) / size[1] if roll % 180 == 90 else 1.0    # new width / old width
+
+        for i, token in enumerate(tokens):
+            if token.startswith("w"):
+                tokens[i] = "w{}".format(size[0])
+            elif token.startswith("h"):
+                tokens[i] = "h{}".format(size[1])
+            elif token.startswith("r") and re.match(r"^r-?[0-9.]+$", token):
+                tokens[i] = "r{}".format(roll)
+            elif token.startswith("v") and re.match(r"^v[0-9.]+$", token):    # "v=0" is linked to the first image
+                fov = float(token[1:])
+                if projection == "0":    # rectilinear
+                    fov = math.degrees(2 * math.atan(math.tan(math.radians(fov) / 2) * ratio))
+                else:                    # fisheye, the field of view is proportional to the width
+                    fov = fov * ratio
+                tokens[i] = "v{}".format(fov)
+        return " ".join(tokens)
 
     def searchCP(self):
         """Run cli CP search."""
@@ -60,17 +119,29 @@ class CpfindTask(Task):
             tmp_output_pto = Path(pictures_dir) / self.TMP_OUTPUT
             self.logger.debug("Copy base template " + base_pto_path + " -> " + local_tmp_pto)
             copyfile(base_pto_path, local_tmp_pto)  # need pto to be local as pictures path are relatives
-
-            options = list(self.CPFIND_OPTIONS)
-            options.append('-o')  # output pto file
-            options.append(tmp_output_pto)
-            options.append(local_tmp_pto)          # input pto file
-            self.logger.debug("Starting CP search with options" + " ".join(options))
-            exitCode = self._run_cli("cpfind", options)
-            self.logger.debug("cpfind exit code : " + str(exitCode))
-
-            if exitCode != 0:
-                raise CpFindException(options)
+            self.applyRotation(local_tmp_pto, pictures_dir)
+
+            cacheKey = None
+            if self._cache is not None:
+                pictures = [Path(pictures_dir) / "APN{}.JPG".format(apnNo) for apnNo in range(0, 6)]
+                cacheKey = self._cache.key(self.TASK_NAME, files=[local_tmp_pto] + pictures, options=self.CPFIND_OPTIONS)
+
+            if cacheKey is not None and self._cache.fetch(cacheKey, pictures_dir):
+                self.logger.info("CP found in cache, cpfind skipped")
+            else:
+                options = list(self.CPFIND_OPTIONS)
+                options.append('-o')  # output pto file
+                options.append(tmp_output_pto)
+                options.append(local_tmp_pto)          # input pto file
+                self.logger.debug("Starting CP search with options" + " ".join(options))
+                exitCode = self._run_cli("cpfind", options)
+                self.logger.debug("cpfind exit code : " + str(exitCode))
+
+                if exitCode != 0:
+                    raise CpFindException(options)
+
+                if cacheKey is not None:
+                    self._cache.store(cacheKey, [tmp_output_pto])
 
             cp_pto_dest = Path(self.ptoDirMan.local_directory) / Const.CP_PTO_FILENAME
             self.logger.debug("Moving " + local_tmp_pto + " -> " + cp_pto_dest + " (UUID : " + self.ptoDirMan.uuid + ")")
@@ -93,7 +164,7 @@ class CpfindTask(Task):
         self.searchCP()
 
         self.ptoDirMan.save()
-        self.cp.create()
+        self._create(self.cp)
 
         self.logger.debug("Created CP :" + repr(self.cp))
 
@@ -1,6 +1,8 @@
 from opv_tasks.task import Task, TaskStatusCode
+from opv_tasks.concurrency import fetchConcurrently
 from opv_api_client import ressources, Filter
 from path import Path
+from collections import OrderedDict
 import tempfile
 import json
 
@@ -13,6 +15,8 @@ class ExportviewerTask(Task):
     """
     TASK_NAME = "exportviewer"
     requiredArgsKeys = ["id_virtualtour", "id_malette"]
+    inputs = ["virtualtour"]
+    outputs = ["export"]
 
     def createDir(self):
         self.path.mkdir_p()
@@ -25,8 +29,22 @@ class ExportviewerTask(Task):
         self.panorama_dir = self.db / "panorama"
         self.panorama_dir.mkdir_p()
 
+    def loadPath(self, virtualtour_path):
+        """Load the path details of a virtualtour path with its nodes and edges (called from the loading threads)."""
+        path_details = self._client_requestor.make(ressources.PathDetails, virtualtour_path.path_details.id_path_details, virtualtour_path.path_details.id_malette)
+        path_nodes = self._client_requestor.make_all(ressources.PathNodeExtended, filters=(
+            Filter("id_path_details")==path_details.id_path_details,
+            Filter("id_path_details_malette")==path_details.id_malette,
+            Filter("disabled")==False)
+        )
+        path_edges = self._client_requestor.make_all(ressources.PathEdge, filters=(
+            Filter("id_path_details")==path_details.id_path_details,
+            Filter("id_path_details_malette")==path_details.id_malette)
+        )
+        return path_details, path_nodes, path_edges
+
     def buildJSON(self):
-        self.panorama_to_add = []
+        self.panorama_to_add = OrderedDict()    # (id_panorama, id_malette) -> None, each panorama is exported once
         self.virtualtour_dict = {
             "id_virtualtour": self.virtualtour.id_virtualtour,
             "id_malette": self.virtualtour.id_malette,
@@ -34,8 +52,8 @@ class ExportviewerTask(Task):
             "description": self.virtualtour.decription,
             "virtualtour_paths": []
         }
-        for virtualtour_path in self.virtualtour_paths:
-            path_details = self._client_requestor.make(ressources.PathDetails, virtualtour_path.path_details.id_path_details, virtualtour_path.path_details.id_malette)
+        paths = fetchConcurrently(self.loadPath, self.virtualtour_paths)
+        for virtualtour_path, (path_details, path_nodes, path_edges) in zip(self.virtualtour_paths, paths):
             virtualtour_path_dict = {
                 "id_virtualtour_path": virtualtour_path.id_virtualtour_path,
                 "id_malette": virtualtour_path.id_malette,
@@ -54,16 +72,6 @@ class ExportviewerTask(Task):
                     "path_edges": {}
                 }
             }
-            path_nodes = self.virtualtour_paths = self._client_requestor.make_all(ressources.PathNodeExtended, filters=(
-                Filter("id_path_details")==path_details.id_path_details,
-                Filter("id_path_details_malette")==path_details.id_malette,
-                Filter("disabled")==False)
-            )
-            path_edges = self.virtualtour_paths = self._client_requestor.make_all(ressources.PathEdge, filters=(
-                Filter("id_path_details")==path_details.id_path_details,
-                Filter("id_path_details_malette")==path_details.id_malette)
-            )
-
             for path_node in path_nodes:
                 virtualtour_path_dict["path_details"]["path_nodes"]["{}-{}".format(path_node.id_malette, path_node.id_path_node)] = {
                     "id_path_node": path_node.id_path_node,
@@ -86,7 +94,7 @@ class ExportviewerTask(Task):
                     "edges_dest": [],
                     "edges_source": []
                 }
-                self.panorama_to_add.append("{}-{}".format(path_node.id_panorama, path_node.id_panorama_malette))
+                self.panorama_to_add[(path_node.id_panorama, path_node.id_panorama_malette)] = None
 
             for path_edge in path_edges:
                 virtualtour_path_dict["path_details"]["path_edges"]["{}-{}".format(path_edge.id_malette, path_edge.id_path_edge)] = {
@@ -111,62 +119,69 @@ class ExportviewerTask(Task):
             json.dump(self.virtualtour_dict, virtualtour_file)
 
     def buildPanoramaJSON(self):
-        for panorama in self.panorama_to_add:
-            panorama = panorama.split("-")
-            panorama = self._client_requestor.make(ressources.PanoramaSensors, panorama[0], panorama[1])
-            panorama_json = {
-                "id_panorama": panorama.id_panorama,
-                "id_malette": panorama.id_malette,
-                "id_cp": panorama.id_cp,
-                "id_cp_malette": panorama.id_cp_malette,
-                "active": panorama.active,
-                "equirectangular_path": panorama.equirectangular_path,
-                "is_photosphere": panorama.is_photosphere,
-                "reconstructed_id_sensors": panorama.reconstructed_id_sensors,
-                "reconstructed_id_malette": panorama.reconstructed_id_malette,
-                "reconstructed_gps_pos": panorama.reconstructed_gps_pos,
-                "reconstructed_degrees": panorama.reconstructed_degrees,
-                "reconstructed_minutes": panorama.reconstructed_minutes,
-                "original_id_sensors": panorama.original_id_sensors,
-                "original_id_malette": panorama.original_id_malette,
-                "original_gps_pos": panorama.original_gps_pos,
-                "original_degrees": panorama.original_degrees,
-                "original_minutes": panorama.original_minutes,
-                "id_campaign": panorama.id_campaign,
-                "id_campaign_malette": panorama.id_campaign_malette,
-                "tiles": {}
+        for uuids in fetchConcurrently(self.exportPanorama, self.panorama_to_add):
+            self.uuid.extend(uuids)
+
+    def exportPanorama(self, panorama_id):
+        """Write the json of a panorama and its tiles (called from the loading threads), return the directories to export."""
+        uuids = []
+        panorama = self._client_requestor.make(ressources.PanoramaSensors, *panorama_id)
+        panorama_json = {
+            "id_panorama": panorama.id_panorama,
+            "id_malette": panorama.id_malette,
+            "id_cp": panorama.id_cp,
+            "id_cp_malette": panorama.id_cp_malette,
+            "active": panorama.active,
+            "equirectangular_path": panorama.equirectangular_path,
+            "is_photosphere": panorama.is_photosphere,
+            "reconstructed_id_sensors": panorama.reconstructed_id_sensors,
+            "reconstructed_id_malette": panorama.reconstructed_id_malette,
+            "reconstructed_gps_pos": panorama.reconstructed_gps_pos,
+            "reconstructed_degrees": panorama.reconstructed_degrees,
+            "reconstructed_minutes": panorama.reconstructed_minutes,
+            "original_id_sensors": panorama.original_id_sensors,
+            "original_id_malette": panorama.original_id_malette,
+            "original_gps_pos": panorama.original_gps_pos,
+            "original_degrees": panorama.original_degrees,
+            "original_minutes": panorama.original_minutes,
+            "id_campaign": panorama.id_campaign,
+            "id_campaign_malette": panorama.id_campaign_malette,
+            "tiles": {}
+        }
+        uuids.append(panorama.equirectangular_path)
+        tiles = self._client_requestor.make_all(ressources.Tile, filters=(
+            Filter("id_panorama")==panorama.id_panorama,
+            Filter("id_panorama_malette")==panorama.id_malette
+        ))
+        for tile in tiles:
+            panorama_json["tiles"]["{}-{}".format(tile.id_malette, tile.id_tile)] = {
+                "id_tile": tile.id_tile,
+                "id_malette": tile.id_malette,
+                "param_location": tile.param_location,
+                "fallback_path": tile.fallback_path,
+                "extension": tile.extension,
+                "resolution": tile.resolution,
+                "max_level": tile.max_level,
+                "cube_resolution": tile.cube_resolution,
+                "id_panorama": tile.panorama.id_panorama,
+                "id_panorama_malette": tile.panorama.id_malette
             }
-            self.uuid.append(panorama.equirectangular_path)
-            tiles = self._client_requestor.make_all(ressources.Tile, filters=(
-                Filter("id_panorama")==panorama.id_panorama,
-                Filter("id_panorama_malette")==panorama.id_malette
-            ))
-            for tile in tiles:
-                panorama_json["tiles"]["{}-{}".format(tile.id_malette, tile.id_tile)] = {
-                    "id_tile": tile.id_tile,
-                    "id_malette": tile.id_malette,
-                    "param_location": tile.param_location,
-                    "fallback_path": tile.fallback_path,
-                    "extension": tile.extension,
-                    "resolution": tile.resolution,
-                    "max_level": tile.max_level,
-                    "cube_resolution": tile.cube_resolution,
-                    "id_panorama": tile.panorama.id_panorama,
-                    "id_panorama_malette": tile.panorama.id_malette
-                }
-                self.uuid.append(tile.param_location)
-                self.uuid.append(tile.fallback_path)
-            with open(self.panorama_dir / "{}-{}.json".format(panorama.id_malette, panorama.id_panorama), "w") as panorama_file:
-                json.dump(panorama_json, panorama_file)
-    
+            uuids.append(tile.param_location)
+            uuids.append(tile.fallback_path)
+        with open(self.panorama_dir / "{}-{}.json".format(panorama.id_malette, panorama.id_panorama), "w") as panorama_file:
+            json.dump(panorama_json, panorama_file)
+        return uuids
+
     def storeUUID(self):
         with open(self.dm / "uuid.list", "a") as uuid_file:
             uuid_file.write("\n".join(self.uuid))
         
-        for uuid in self.uuid:
-            with self._opv_directory_manager.Open(uuid) as (name, dir_path):
-                uuid_dir = Path(dir_path)
-                uuid_dir.copytree(self.dm / uuid)
+        fetchConcurrently(self.copyUUID, OrderedDict.fromkeys(self.uuid))
+
+    def copyUUID(self, uuid):
+        with self._opv_directory_manager.Open(uuid) as (name, dir_path):
+            uuid_dir = Path(dir_path)
+            uuid_dir.copytree(self.dm / uuid)
 
     def runWithExceptions(self, options={}):
         self.checkArgs(options)
@@ -18,6 +18,7 @@
 
 from opv_tasks.task import Task
 from opv_tasks.task import TaskException
+from opv_tasks.spatialindex import stitchableCpIndexes, lotPosition
 from opv_api_client import ressources, Filter
 from math import sin, cos, sqrt, atan2, radians
 from opv_api_client.exceptions import RequestAPIException
@@ -48,7 +49,7 @@ class FindnearestcpTask(Task):
         lat1 = radians(gpsPosA['coordinates'][0])
         lon1 = radians(gpsPosA['coordinates'][1])
         lat2 = radians(gpsPosB['coordinates'][0])
-        lon2 = radians(gpsPosA['coordinates'][1])
+        lon2 = radians(gpsPosB['coordinates'][1])
 
         dlon = lon2 - lon1
         dlat = lat2 - lat1
@@ -68,62 +69,99 @@ class FindnearestcpTask(Task):
         """
         return [cp for cp in lot.cps if cp.stichable]
 
-    def searchNearestLocatedCp(self, lot, max_distance=30):  # TODO test
+    def searchNearestLocatedCp(self, lot, max_distance=30):
         """
-        Search nearest stitchable cps.
+        Search nearest stitchable cps, with the spatial index of the campaign (built with a few queries on the first
+        search of the process). The Sensors within query is used when the index can't be built.
 
         :param lot: cp will be near this lot.
-        :param max_distance: maximum distance with the search sensor.
-        :return: A list of nearest CPs, migth be empty, cp migth no be stitchable.
+        :param max_distance: maximum distance with the search sensor (meters).
+        :return: A list of nearest CPs (nearest first), migth be empty.
+        """
+        position = lotPosition(lot)
+        if position is None:
+            return []
+
+        try:
+            index = stitchableCpIndexes.get(self._client_requestor, lot.campaign)
+        except (RequestAPIException, TypeError, AttributeError) as e:    # the client Filter might not have the in operator
+            self.logger.warning("Can't build the campaign spatial index ({}), using the within query".format(e))
+            return self.searchNearestWithin(lot, max_distance)
+
+        nearest = index.nearest(position[0], position[1], max_distance, excludeLot=(lot.id_lot, lot.id_malette))
+        self.logger.debug(nearest)
+
+        return [self._client_requestor.make(ressources.Cp, id_cp, id_malette) for _, (id_cp, id_malette) in nearest]
+
+    def searchNearestWithin(self, lot, max_distance=30):
+        """
+        Search nearest stitchable cps with a Sensors within query.
+
+        :param lot: cp will be near this lot.
+        :param max_distance: maximum distance with the search sensor (meters).
+        :return: A list of nearest CPs (nearest first), migth be empty.
         """
-        nearest_cps = []
         nearestSensors = self._client_requestor.make_all(ressources.Sensors,
                                                          filters=(Filter.within([lot.sensors.id_sensors,
-                                                                  lot.sensors.id_malette], 30)))
+                                                                  lot.sensors.id_malette], max_distance)))
         self.logger.debug(nearestSensors)
-        nearestSensorsWithDistance = []
-
-        # computing distances, with tuple (dist, sensor)
-        for s in nearestSensors:
-            self.logger.debug(s)
-            nearestSensorsWithDistance.append((self.distance(s.gps_pos, lot.sensors.gps_pos), s))
-
-        # sorting it
-        nearestSensorsWithDistance = sorted(nearestSensorsWithDistance, key=lambda sensorTuple: sensorTuple[0])
-        self.logger.debug(str(nearestSensorsWithDistance))
-
-        # filtering it
-        # remove itself
-        self.logger.debug(len(nearestSensorsWithDistance))
-        nearestSensorsWithDistanceFiltered = []
-        self.logger.debug("-- Filtering --")
-        for sensorWithDistance in nearestSensorsWithDistance:
-            s = sensorWithDistance[1]
-            if not(s.lot.id_lot == lot.id_lot and s.lot.id_malette == lot.id_malette):
-                nearestSensorsWithDistanceFiltered.append(sensorWithDistance)
-
-        self.logger.debug(nearestSensorsWithDistanceFiltered)
-        self.logger.debug(len(nearestSensorsWithDistanceFiltered))
-
-        # finding nearest stitchable
-        for sensorDist in nearestSensorsWithDistanceFiltered:
-            _, sensor = sensorDist
-            associatedLot = sensor.lot
-            cps = self.getStitchableCps(associatedLot)
-            nearest_cps += cps
 
+        # sorting by distance, removing the lot itself
+        nearestSensors = sorted((s for s in nearestSensors if s.gps_pos), key=lambda s: self.distance(s.gps_pos, lot.sensors.gps_pos))
+        nearest_cps = []
+        for sensor in nearestSensors:
+            associatedLot = sensor.lot
+            if not(associatedLot.id_lot == lot.id_lot and associatedLot.id_malette == lot.id_malette):
+                nearest_cps += self.getStitchableCps(associatedLot)
         return nearest_cps
 
-    def searchNearestByLotId(self, lot, max_id_number=10):  # TODO test
+    def searchNearestByLotId(self, lot, max_id_number=10):
         """
         Search 'nearest' stitchable cps, thoses associated whith id_lot between : lot.id_lot - max_id_number / lot.id_lot + max_id_number
+        The lots of the campaign in this range and their cps are fetched with 2 range queries.
+
+        :param lot: cp will be near this lot.
+        :param max_id_number: id_lot between : lot.id_lot - max_id_number / lot.id_lot + max_id_number
+        :return: A list of 'nearest' CPs (ordered by id_lot), migth be empty, cp migth no be stitchable.
+        """
+        id_lot_min = max(lot.id_lot - max_id_number, 0)
+        id_lot_max = lot.id_lot + max_id_number
+        try:
+            lots = self._client_requestor.make_all(ressources.Lot, filters=(
+                Filter("id_lot") >= id_lot_min,
+                Filter("id_lot") <= id_lot_max,
+                Filter("id_malette") == lot.id_malette,
+                Filter("id_campaign") == lot.campaign.id_campaign,
+                Filter("id_campaign_malette") == lot.campaign.id_malette))
+            cps = self._client_requestor.make_all(ressources.Cp, filters=(
+                Filter("id_lot") >= id_lot_min,
+                Filter("id_lot") <= id_lot_max,
+                Filter("id_lot_malette") == lot.id_malette))
+        except (RequestAPIException, TypeError) as e:   # TypeError when the client Filter has no ordering operators
+            self.logger.warning("Range queries failed ({}), fetching the lots one by one".format(e))
+            return self.searchNearestByLotIdOneByOne(lot, max_id_number)
+
+        cps_by_lot = {}
+        for cp in cps:
+            cps_by_lot.setdefault(cp.id_lot, []).append(cp)   # the lot id column, the lot isn't fetched
+
+        resulted_cps = []
+        for l in sorted(lots, key=lambda l: l.id_lot):
+            if l.id_lot != lot.id_lot:
+                resulted_cps += cps_by_lot.get(l.id_lot, [])
+        self.logger.debug(resulted_cps)
+        return resulted_cps
+
+    def searchNearestByLotIdOneByOne(self, lot, max_id_number=10):
+        """
+        Same as searchNearestByLotId, fetch each lot, used when the API can't do range queries.
 
         :param lot: cp will be near this lot.
         :param max_id_number: id_lot between : lot.id_lot - max_id_number / lot.id_lot + max_id_number
         :return: A list of 'nearest' CPs, migth be empty, cp migth no be stitchable.
         """
         resulted_cps = []
-        lots_ids = [lot.id_lot + i for i in range(-max_id_number, max_id_number) if lot.id_lot + i >= 0 and i != 0]
+        lots_ids = [lot.id_lot + i for i in range(-max_id_number, max_id_number + 1) if lot.id_lot + i >= 0 and i != 0]
         for id_lot in lots_ids:
             try:
                 l = self._client_requestor.make(ressources.Lot, id_lot, lot.id_malette)
@@ -126,7 +126,7 @@ class InjectcpapnTask(Task):
 
                 # Setting optimized to false
                 cpDest.optimized = False
-                cpDest.save()
+                self._save(cpDest)
 
     def runWithExceptions(self, options={}):
         """
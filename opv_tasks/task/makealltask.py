@@ -16,8 +16,10 @@
 # Email: team@openpathview.fr
 # Description: Make it all, with correction logic
 
-from opv_tasks.task import Task, TaskStatusCode
+from opv_tasks.task import Task, TaskStatusCode, TaskException
 from opv_tasks.utils import runTask
+from opv_tasks.scheduler import TaskScheduler
+from opv_tasks.journal import Journal
 from opv_api_client import ressources, Filter 
 
 
@@ -27,63 +29,82 @@ class MakeallTask(Task):
     Input format :
         opv-task makeall '{"id_lot": ID_LOT, "id_malette": ID_MALETTE }'
     Output format :
-        {"id_lot": ID_LOT, "id_malette": ID_MALETTE }
+        {"id_tile": ID_TILE, "id_malette": ID_MALETTE } (output of the tiling task)
+    When a stage fails (and the APN0 recovery didn't fix it) makeall fails too, with a MakeallException naming the
+    stage : the TaskReturn is an error instead of a success holding the output of the last stage run.
     """
     TASK_NAME = "makeall"
     requiredArgsKeys = ["id_cp", "id_malette"]
 
+    TASKS = ["rotate", "cpfind", "autooptimiser", "stitchable", "stitch", "photosphere", "tiling"]
+
+    def recoverApn0(self, task, lastTaskReturn):
+        """
+        Recover from a stitchable APN0 error injecting the APN0 control points of the nearest stitchable CP.
+
+        :param task: Name of the failed task.
+        :param lastTaskReturn: TaskReturn of the failed task.
+        :return: The TaskReturn of the new stitchable task or None if it can't be recovered.
+        """
+        if not(task == "stitchable" and lastTaskReturn.statusCode == TaskStatusCode.ERROR_CP_APN0):
+            return None
+
+        self.logger.info("APN0 error, injecting points ...")
+        toCp = lastTaskReturn.outputData
+        cp = self._client_requestor.make(ressources.Cp, toCp["id_cp"], toCp["id_malette"])
+        cp.get()
+        cp.lot.get()
+        self.logger.debug(cp.lot.id)
+        lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "findnearestcp", cp.lot.id)
+        self.logger.debug(lastTaskReturn.toJSON())
+        fromCp = lastTaskReturn.outputData
+
+        if not(fromCp is not None and "id_cp" in fromCp):
+            return None
+
+        injectInput = {}
+        injectInput["idCpFrom"] = fromCp
+        injectInput["idCpTo"] = toCp
+        injectInput["apnList"] = [0]
+        self.logger.debug("injectInput: " + str(injectInput))
+        lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "injectcpapn", injectInput)
+        inputData = lastTaskReturn.outputData
+        self.logger.debug(lastTaskReturn.toJSON())
+
+        lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "autooptimiser", inputData, cache=self._cache)
+        inputData = lastTaskReturn.outputData
+        self.logger.debug(lastTaskReturn.toJSON())
+
+        lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "stitchable", inputData)
+        self.logger.debug(lastTaskReturn.toJSON())
+
+        return lastTaskReturn
+
     def runWithExceptions(self, options={}):
         """
             :param options: {"id_lot": , "id_malette"}
             :return:
         """
+        scheduler = TaskScheduler(self._opv_directory_manager, self._client_requestor, self.TASKS, recover=self.recoverApn0,
+                                  journal=self._journal, journalKey=Journal.key(options), cache=self._cache)
+        taskReturns = scheduler.run({"lot": options})
+
+        for task, taskReturn in taskReturns.items():
+            self.metrics.stages[task] = taskReturn.metrics
+
+        for task in self.TASKS:
+            if task in taskReturns and not taskReturns[task].isSuccess():
+                raise MakeallException(task, taskReturns[task].error)
+
+        return scheduler.artifacts["tile"]
+
+
+class MakeallException(TaskException):
+    """ Raised when one of the lot tasks failed. """
+
+    def __init__(self, taskName, error):
+        self.taskName = taskName
+        self.error = error
 
-        tasks = ["rotate", "cpfind", "autooptimiser", "stitchable", "stitch", "photosphere", "tiling"]
-        inputData = options
-        for task in tasks:
-            self.logger.info("Starting task %s" % task)
-
-            lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, task, inputData)
-            self.logger.debug("TaskReturn : " + lastTaskReturn.toJSON())
-            inputData = lastTaskReturn.outputData
-
-            if not lastTaskReturn.isSuccess():
-                if task == "stitchable" and lastTaskReturn.statusCode == TaskStatusCode.ERROR_CP_APN0:
-                    self.logger.info("APN0 error, injecting points ...")
-                    toCp = lastTaskReturn.outputData
-                    cp = self._client_requestor.make(ressources.Cp, toCp["id_cp"], toCp["id_malette"])
-                    cp.get()
-                    cp.lot.get()
-                    self.logger.debug(cp.lot.id)
-                    lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "findnearestcp", cp.lot.id)
-                    self.logger.debug(lastTaskReturn.toJSON())
-                    fromCp = lastTaskReturn.outputData
-
-                    if not(fromCp is not None and "id_cp" in fromCp):
-                        break
-
-                    injectInput = {}
-                    injectInput["idCpFrom"] = fromCp
-                    injectInput["idCpTo"] = toCp
-                    injectInput["apnList"] = [0]
-                    self.logger.debug("injectInput: " + str(injectInput))
-                    lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "injectcpapn", injectInput)
-                    inputData = lastTaskReturn.outputData
-                    self.logger.debug(lastTaskReturn.toJSON())
-
-                    lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "autooptimiser", inputData)
-                    inputData = lastTaskReturn.outputData
-                    self.logger.debug(lastTaskReturn.toJSON())
-
-                    lastTaskReturn = runTask(self._opv_directory_manager, self._client_requestor, "stitchable", inputData)
-                    inputData = lastTaskReturn.outputData
-                    self.logger.debug(lastTaskReturn.toJSON())
-
-                    continue
-
-                self.logger.error("Last task executed failed with following error : " + lastTaskReturn.error)
-                break
-
-            self.logger.info("End of task %s" % task)
-
-        return inputData
+    def getErrorMessage(self):
+        return "makeall failed on task " + str(self.taskName) + " : " + str(self.error)
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Run makeall on many lots at once with a pool of processes.
+
+import logging
+import multiprocessing
+
+from opv_api_client import ressources
+
+from opv_tasks.task import Task, TaskInvalidArgumentsException, TaskReturn, TaskStatusCode
+from opv_tasks.utils import runTask
+
+_workerClients = None   # (directory manager client, db client, journal, cache) of a pool worker process
+
+
+def _initWorker(dm_c, db_c, journal, cache):
+    """Pool initializer, keep the clients inherited from the parent process."""
+    global _workerClients
+    _workerClients = (dm_c, db_c, journal, cache)
+
+
+def _makeallLot(lotId):
+    """
+    Run makeall for a lot in a pool worker, return (lotId, TaskReturn).
+    Any error of the lot is returned as an error TaskReturn, it mustn't stop the other lots.
+    """
+    dm_c, db_c, journal, cache = _workerClients
+    try:
+        return lotId, runTask(dm_c, db_c, "makeall", lotId, journal=journal, cache=cache)
+    except Exception as e:
+        logging.getLogger("opv_task.MakecampaignTask").exception("makeall crashed on lot %s" % lotId)
+        return lotId, TaskReturn(taskName="makeall", statusCode=TaskStatusCode.ERROR, inputData=lotId, error=repr(e))
+
+
+class MakecampaignTask(Task):
+    """
+    Run makeall on all the lots of a campaign (or on a list of lots) with a pool of processes.
+    Input format :
+        opv-task makecampaign '{"id_campaign": ID_CAMPAIGN, "id_malette": ID_MALETTE, "processes": NB_PROCESSES }'
+        opv-task makecampaign '{"lots": [{"id_lot": ID_LOT, "id_malette": ID_MALETTE }], "processes": NB_PROCESSES }'
+    processes is optionnal, it defaults to the number of CPUs.
+    Output format :
+        {"succeeded": [{"id_lot": ID_LOT, "id_malette": ID_MALETTE }], "failed": [{"id_lot": ID_LOT, "id_malette": ID_MALETTE }]}
+    """
+
+    TASK_NAME = "makecampaign"
+
+    def getLots(self, options):
+        """
+        List the lots to process.
+
+        :param options: Task options, with "lots" or "id_campaign" and "id_malette".
+        :return: A list of lot ids {"id_lot": ID_LOT, "id_malette": ID_MALETTE}.
+        """
+        if "lots" in options:
+            return options["lots"]
+
+        if "id_campaign" in options and "id_malette" in options:
+            campaign = self._client_requestor.make(ressources.Campaign, options["id_campaign"], options["id_malette"])
+            return [lot.id for lot in campaign.lots]
+
+        raise TaskInvalidArgumentsException(requiredArguements=["lots", "id_campaign", "id_malette"], invalidArguments=["lots"])
+
+    def runWithExceptions(self, options={}):
+        """
+        Run makeall on each lot, lots are dispatched to the pool processes.
+
+        :param options: {"id_campaign": ID_CAMPAIGN, "id_malette": ID_MALETTE, "processes": NB_PROCESSES}
+        :return: {"succeeded": [...], "failed": [...]}
+        """
+        processes = options.get("processes") or multiprocessing.cpu_count()
+
+        # The pool is forked before any request is made so that the workers inherit the
+        # clients without sharing an opened connection with the parent. Each lot gets it's own identity map.
+        context = multiprocessing.get_context("fork")
+        with context.Pool(processes, initializer=_initWorker, initargs=(self._opv_directory_manager, self._identity_map.client, self._journal, self._cache)) as pool:
+            lots = self.getLots(options)
+            self.logger.info("Running makeall on %s lots with %s processes" % (len(lots), processes))
+
+            output = {"succeeded": [], "failed": []}
+            for done, (lotId, taskReturn) in enumerate(pool.imap_unordered(_makeallLot, lots), start=1):
+                if taskReturn.isSuccess():
+                    output["succeeded"].append(lotId)
+                    self.logger.info("[%s/%s] Lot %s done" % (done, len(lots), lotId))
+                else:
+                    output["failed"].append(lotId)
+                    self.logger.error("[%s/%s] Lot %s failed : %s" % (done, len(lots), lotId, taskReturn.error))
+
+        self.logger.info("%s lots succeeded, %s lots failed" % (len(output["succeeded"]), len(output["failed"])))
+        return output
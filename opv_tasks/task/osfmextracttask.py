@@ -13,6 +13,8 @@ class OsfmextractTask(Task):
     """
     TASK_NAME = "osfmextract"
     requiredArgsKeys = ["id_malette", "ids_pano", "osfm_dir"]
+    inputs = ["osfm_panoramas"]
+    outputs = ["osfm_dataset"]
     DEFAULT_CONF = """processes: 8                  # Number of threads to use
 depthmap_min_consistent_views: 2      # Min number of views that should reconstruct a point for it to be valid
 """
@@ -92,3 +94,5 @@ depthmap_min_consistent_views: 2      # Min number of views that should reconstr
         self.osfm_dir = options["osfm_dir"]
 
         self.launch()
+
+        return {"osfm_dir": self.osfm_dir, "id_malette": self.malette_id}
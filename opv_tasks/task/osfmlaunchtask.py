@@ -13,6 +13,8 @@ class OsfmlaunchTask(Task):
     """
     TASK_NAME = "osfmlaunch"
     requiredArgsKeys = ["id_malette", "osfm_dir"]
+    inputs = ["osfm_dataset"]
+    outputs = ["osfm_reconstruction"]
 
     def runWithExceptions(self, options={}):
         self.checkArgs(options)
@@ -31,3 +33,5 @@ class OsfmlaunchTask(Task):
         self.logger.info("Launch reconstruct")
         command = Reconstruct()
         command.run(data)
+
+        return {"osfm_dir": options["osfm_dir"], "id_malette": options["id_malette"]}
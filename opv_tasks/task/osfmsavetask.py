@@ -1,5 +1,8 @@
 from opv_tasks.task import Task
+from opv_tasks.concurrency import fetchConcurrently
 from path import Path
+from collections import OrderedDict
+import numpy as np
 import json
 from opv_api_client import ressources
 from opensfm.geo import lla_from_topocentric
@@ -16,6 +19,8 @@ class OsfmsaveTask(Task):
     """
     TASK_NAME = "osfmsave"
     requiredArgsKeys = ["id_malette", "osfm_dir"]
+    inputs = ["osfm_reconstruction"]
+    outputs = ["osfm_sensors"]
 
     def angleToNorthSigned(self, camVect):
         """
@@ -36,38 +41,77 @@ class OsfmsaveTask(Task):
             camVect
         )
 
-    def getPanosData(self):
+    def anglesToNorthSigned(self, camVects):
+        """
+        Vectorized angleToNorthSigned.
+        :param camVects: (N, 2) array of camera vectors
+        :return: The angles to the north clock wise signed (radians).
+        """
+        camVects = np.asarray(camVects, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cosines = camVects[:, 1] / np.linalg.norm(camVects, axis=1)
+        signs = np.where(camVects[:, 0] >= 0, 1, -1)
+        return signs * np.arccos(np.clip(cosines, -1, 1))
+
+    def loadShots(self):
+        """
+        Load the shots of all the reconstructions.
+        :return: (panorama ids, (N, 3) rotations, (N, 3) translations), a panorama in many reconstructions is kept once (the last one)
+        """
         with open(self.dir / "reconstruction.json") as reconstructions:
             self.reconstructions = json.load(reconstructions)
-            for reconstruction in self.reconstructions:
-                for pano in reconstruction["shots"]:
-                    data = reconstruction["shots"][pano]
-                    pano = int(pano.split(".")[0])
-                    self.logger.info("Panorama {} had been treat by opensfm".format(pano))
-                    corrected_sensors = self._client_requestor.make(ressources.Sensors)
-                    optical_center = self.reconstructionUtils.opticalCenter(data)
-                    corrected_sensors.gps_pos = Point(
-                        coordinates=lla_from_topocentric(
-                            optical_center[0],
-                            optical_center[1],
-                            optical_center[2],
-                            self.refLla["latitude"],
-                            self.refLla["longitude"],
-                            self.refLla["altitude"]
-                        )
-                    )
-                    orientation = self.reconstructionUtils.cordToVector(self.reconstructionUtils.getImageOrientationVector(data), optical_center)
-                    camVect = [orientation[i] for i in range(2)]
-                    north_offset = degrees(self.angleToNorthSigned(camVect))
-
-                    corrected_sensors.degrees = int(north_offset)
-                    corrected_sensors.minutes = int((north_offset - int(north_offset)) * 60)
-                    corrected_sensors.create()
-
-                    pano = self._client_requestor.make(ressources.Panorama, pano, self.id_malette)
-                    pano.sensors_reconstructed["id_sensors"] = corrected_sensors.id_sensors
-                    pano.sensors_reconstructed["id_malette"] = corrected_sensors.id_malette
-                    pano.save()
+
+        shots = OrderedDict()
+        for reconstruction in self.reconstructions:
+            for pano, data in reconstruction["shots"].items():
+                pano = int(pano.split(".")[0])
+                shots.pop(pano, None)
+                shots[pano] = data
+
+        rotations = np.array([data["rotation"] for data in shots.values()], dtype=np.float64).reshape(-1, 3)
+        translations = np.array([data["translation"] for data in shots.values()], dtype=np.float64).reshape(-1, 3)
+        return list(shots.keys()), rotations, translations
+
+    def computeSensors(self, rotations, translations):
+        """
+        Compute the corrected position and north offset of all the shots at once.
+        :return: ((N, 3) latitude, longitude, altitude array, (N,) north offsets in degrees)
+        """
+        optical_centers = self.reconstructionUtils.opticalCenters(rotations, translations)
+        lla = np.column_stack(lla_from_topocentric(
+            optical_centers[:, 0],
+            optical_centers[:, 1],
+            optical_centers[:, 2],
+            self.refLla["latitude"],
+            self.refLla["longitude"],
+            self.refLla["altitude"]
+        ))
+        orientations = self.reconstructionUtils.getImagesOrientationVectors(rotations, translations) - optical_centers
+        north_offsets = np.degrees(self.anglesToNorthSigned(orientations[:, :2]))
+        return lla, north_offsets
+
+    def saveShot(self, shot):
+        """
+        Create the corrected sensors of a panorama and link them to it (called from the writing threads).
+        :param shot: (panorama id, [latitude, longitude, altitude], north offset in degrees)
+        """
+        pano, coordinates, north_offset = shot
+        self.logger.info("Panorama {} had been treat by opensfm".format(pano))
+        corrected_sensors = self._client_requestor.make(ressources.Sensors)
+        corrected_sensors.gps_pos = Point(coordinates=coordinates)
+        corrected_sensors.degrees = int(north_offset)
+        corrected_sensors.minutes = int((north_offset - int(north_offset)) * 60)
+        self._create(corrected_sensors)
+
+        pano = self._client_requestor.make(ressources.Panorama, pano, self.id_malette)
+        pano.sensors_reconstructed["id_sensors"] = corrected_sensors.id_sensors
+        pano.sensors_reconstructed["id_malette"] = corrected_sensors.id_malette
+        self._save(pano)
+
+    def getPanosData(self):
+        panos, rotations, translations = self.loadShots()
+        lla, north_offsets = self.computeSensors(rotations, translations)
+        fetchConcurrently(self.saveShot, zip(panos, lla.tolist(), north_offsets.tolist()))
 
     def runWithExceptions(self, options={}):
         """
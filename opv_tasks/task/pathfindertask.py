@@ -24,6 +24,7 @@ import operator
 
 from opv_tasks.task import Task
 from opv_tasks.task import TaskException
+from opv_tasks.concurrency import fetchConcurrently
 from opv_api_client import ressources, Filter
 from opv_api_client.exceptions import RequestAPIException
 
@@ -53,6 +54,8 @@ class PathfinderTask(Task):
 
     TASK_NAME = "pathfinder"
     requiredArgsKeys = ["id_campaign", "id_malette"]
+    inputs = ["campaign"]
+    outputs = ["path"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -124,6 +127,61 @@ class PathfinderTask(Task):
             campaign_id, malette_id
         ))
 
+        panoramas = self.found_panorama_bulk(campaign_id, malette_id)
+        if not panoramas:
+            self.logger.info("No panorama found with the PanoramaSensors view, walking the campaign lots")
+            panoramas = self.found_panorama_by_lot(campaign_id, malette_id)
+
+        self.logger.info("Found %s lot: %s" % (
+            len(panoramas), sorted(panoramas.keys())
+        ))
+        return panoramas
+
+    def found_panorama_bulk(self, campaign_id, malette_id):
+        """
+        Found the panorama to use with one PanoramaSensors query, the photosphere panoramas of the campaign
+        with their GPS positions. Keep the first panorama of each lot (ie of each original sensors) as is_usable_lot.
+        :param campaign_id:
+        :param malette_id:
+        :return: panoramas founds, empty if the query isn't available
+        """
+        try:
+            panoramas_sensors = self._client_requestor.make_all(ressources.PanoramaSensors, filters=(
+                Filter("id_campaign")==campaign_id,
+                Filter("id_campaign_malette")==malette_id,
+                Filter("is_photosphere")==True))
+        except RequestAPIException as e:
+            self.logger.warning("Can't query the PanoramaSensors of the campaign: %s" % e)
+            return {}
+
+        panoramas = {}
+        lots_sensors = set()
+        for panorama in panoramas_sensors:
+            lot_sensors = (panorama.original_id_sensors, panorama.original_id_malette)
+            if panorama.id_panorama is None or lot_sensors in lots_sensors or panorama.original_gps_pos is None:
+                continue
+            lots_sensors.add(lot_sensors)
+
+            coord = panorama.original_gps_pos["coordinates"]
+            panoramas[panorama.id_panorama] = {
+                "id": {"id_panorama": panorama.id_panorama, "id_malette": panorama.id_malette},
+                "id_panorama": panorama.id_panorama,
+                "id_malette": panorama.id_malette,
+                "gps": {
+                    "latitude": coord[0],
+                    "longitude": coord[1],
+                    "altitude": coord[2]
+                }
+            }
+        return panoramas
+
+    def found_panorama_by_lot(self, campaign_id, malette_id):
+        """
+        Found the panorama to use by checking each lot of the campaign
+        :param campaign_id:
+        :param malette_id:
+        :return: panoramas founds
+        """
         campaign = self._client_requestor.make(ressources.Campaign, campaign_id, malette_id)
 
         panoramas = {}
@@ -132,10 +190,6 @@ class PathfinderTask(Task):
             if pano is not None:
                 #print(pano)
                 panoramas[pano["id_panorama"]] = pano
-
-        self.logger.info("Found %s lot: %s" % (
-            len(panoramas), sorted(panoramas.keys())
-        ))
         return panoramas
 
     def get_panoramas_from_id(self, panoramas_id, malette_id):
@@ -152,6 +206,67 @@ class PathfinderTask(Task):
                 panoramas[pano["id_panorama"]] = pano
         return panoramas
 
+    def createPathNode(self, name, path_detailed, malette_id, hotpoints):
+        """
+        Create the path node of a graphe node (called from the persistence threads).
+
+        :return: The id of the created path node.
+        """
+        path_node = self._client_requestor.make(ressources.PathNode, id_malette=malette_id)
+        path_node.id_malette = malette_id
+        path_node.panorama = self._client_requestor.make(ressources.Panorama, int(name), malette_id)
+        path_node.path_details = path_detailed
+        path_node.disabled = False
+        path_node.hotspot = name in hotpoints
+
+        return self._create(path_node).json()["id_path_node"]
+
+    def createPathEdge(self, edge, path_detailed, malette_id, path_nodes):
+        """
+        Create the path edge of a graphe edge (called from the persistence threads).
+
+        :param path_nodes: graphe node name -> PathNode ressource.
+        """
+        path_edge = self._client_requestor.make(ressources.PathEdge, id_malette=malette_id)
+        path_edge.id_malette = malette_id
+        path_edge.path_details = path_detailed
+        path_edge.source_path_node = path_nodes[edge.source]
+        path_edge.dest_path_node = path_nodes[edge.dest]
+        self._create(path_edge)
+
+    def persistPath(self, final_graphe, path_detailed, malette_id):
+        """
+        Write the path nodes and edges of the graphe, each with its own request as the API has no batch creation.
+        Requests are sent with a bounded concurrency, nodes first as the edges reference them.
+
+        :param final_graphe: The computed graphe.
+        :param path_detailed: The created PathDetails.
+        :param malette_id: Malette id.
+        """
+        names = list(final_graphe.nodes.keys())
+        ids = fetchConcurrently(lambda name: self.createPathNode(name, path_detailed, malette_id, final_graphe.hotpoints), names)
+        transco_table = dict(zip(names, ids))
+
+        # The created nodes are referenced from their ids, no fetch is needed
+        path_nodes = {
+            name: self._client_requestor.make(ressources.PathNode, int(id_path_node), malette_id)
+            for name, id_path_node in transco_table.items()
+        }
+
+        self.logger.info("%s path nodes created" % len(path_nodes))
+
+        # Todo: Make a better implementation for the start and stop point
+        if final_graphe.path:
+            path_detailed.start_node = path_nodes[final_graphe.path[0]]
+            path_detailed.stop_node = path_nodes[final_graphe.path[-1]]
+            self._save(path_detailed)
+
+        edges = list(final_graphe.edges.values())
+        fetchConcurrently(lambda edge: self.createPathEdge(edge, path_detailed, malette_id, path_nodes), edges)
+
+        self.logger.info("%s path edges created" % len(edges))
+        return transco_table
+
     def runWithExceptions(self, options={}):
         """
         Create the path between panorama.
@@ -222,49 +337,12 @@ class PathfinderTask(Task):
         )
         path_detailed.description = "Generated by pathfinder"
 
-        toto = path_detailed.create()
+        toto = self._create(path_detailed)
 
         id_path_details = toto.json()["id_path_details"]
 
         path_detailed = self._client_requestor.make(ressources.PathDetails, id_path_details, id_malette=malette_id)
 
-        transco_table = {}
-
-        # Create all the path_node
-        for name, nodes in final_graphe.nodes.items():
-            path_node = self._client_requestor.make(ressources.PathNode, id_malette=malette_id)
-            path_node.id_malette = malette_id
-            path_node.panorama = self._client_requestor.make(ressources.Panorama, int(name), malette_id)
-            path_node.path_details = path_detailed
-            path_node.disabled = False
-            path_node.hotspot = name in final_graphe.hotpoints
-
-            response = path_node.create().json()
-
-            transco_table[name] = response["id_path_node"]
-            # Todo: Make a better implementation for the start and stop point
-            if name == final_graphe.path[0]:
-                path_detailed.start_node = self._client_requestor.make(
-                    ressources.PathNode, response["id_path_node"], malette_id
-                )
-                path_detailed.save()
-            if name == final_graphe.path[-1]:
-                path_detailed.stop_node = self._client_requestor.make(
-                    ressources.PathNode, response["id_path_node"], malette_id
-                )
-                path_detailed.save()
-
-        # Create all the path_edge
-        for name, edge in final_graphe.edges.items():
-            path_edge = self._client_requestor.make(ressources.PathEdge, id_malette=malette_id)
-            path_edge.id_malette = malette_id
-            path_edge.path_details = path_detailed
-            path_edge.source_path_node = self._client_requestor.make(
-                ressources.PathNode, int(transco_table[edge.source]), id_malette=malette_id
-            )
-            path_edge.dest_path_node = self._client_requestor.make(
-                ressources.PathNode, int(transco_table[edge.dest]), id_malette=malette_id
-            )
-            path_edge.create()
+        self.persistPath(final_graphe, path_detailed, malette_id)
 
         return
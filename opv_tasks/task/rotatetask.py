@@ -18,27 +18,43 @@
 
 from PIL import Image
 import os
+import json
+import shutil
+import struct
+import logging
 from path import Path
 
 from opv_api_client import ressources
 
+from opv_tasks.const import Const
 from opv_tasks.task import Task, TaskStatusCode, TaskException
+from opv_tasks.jpegmeta import readSize, readFrame
+from opv_tasks.concurrency import fetchConcurrently
 
 
 class RotateTask(Task):
     """
     Manage rotation for source set of images.
+    With "virtual" the pictures are left untouched, their rotation is recorded in the lot pictures directory
+    (Const.ROTATION_FILENAME) and applied as a roll by cpfind in the project.
     Input format :
-        opv-task rotate '{"id_lot": ID_LOT, "id_malette": ID_MALETTE }'
+        opv-task rotate '{"id_lot": ID_LOT, "id_malette": ID_MALETTE, "virtual": false }'
     Output format :
         {"id_lot": ID_LOT, "id_malette": ID_MALETTE }
     """
 
     TASK_NAME = "rotate"
     requiredArgsKeys = ["id_lot", "id_malette"]
+    inputs = ["lot"]
+    outputs = ["rotated_lot"]
 
     def getPictureSizes(self, picPath):
-        """Return (width, height) of the specified picture (picPath)."""
+        """Return (width, height) of the specified picture (picPath), read from the JPEG header."""
+        try:
+            return readSize(picPath)
+        except (ValueError, struct.error, TypeError) as e:
+            self.logger.debug("Can't read the size of {} from its header ({}), decoding it".format(picPath, e))
+
         with Image.open(picPath) as pic:
             width, height = pic.size
 
@@ -50,13 +66,44 @@ class RotateTask(Task):
         self.logger.debug("Width: " + str(x) + "  Height: " + str(y))
         return x < y
 
+    def rotatePicLossless(self, rotation_angle, picPath):
+        """
+        Rotate picPath with rotation_angle in the DCT domain (jpegtran), the picture isn't re-encoded.
+
+        Modify picture in place !
+        :return: False if it can't be done losslessly (no jpegtran, size not a multiple of the JPEG blocks).
+        """
+        if shutil.which("jpegtran") is None:
+            return False
+        try:
+            width, height, mcuWidth, mcuHeight = readFrame(picPath)
+        except (ValueError, struct.error, TypeError):
+            return False
+        if width % mcuWidth or height % mcuHeight:     # partial blocks on the edges can't be rotated
+            return False
+
+        rotatedPath = picPath + ".rotated"
+        cli_code = self._run_cli('jpegtran', ["-rotate", str(rotation_angle), "-perfect", "-copy", "all", "-outfile", rotatedPath, picPath],
+                                 stderr_level=logging.DEBUG)
+        if cli_code != 0:
+            self.logger.debug("Can't rotate {} losslessly".format(picPath))
+            if os.path.exists(rotatedPath):
+                os.remove(rotatedPath)
+            return False
+
+        os.replace(rotatedPath, picPath)
+        return True
+
     def rotatePic(self, rotation_angle, picPath):
         """
-        Rotate picPath with rotation_angle.
+        Rotate picPath with rotation_angle, losslessly if possible.
 
         Modify picture in place !
         """
         self.logger.debug("Rotate pic " + picPath + " angle : " + str(rotation_angle))
+        if self.rotatePicLossless(rotation_angle, picPath):
+            return
+
         cli_code = self._run_cli('mogrify', ["-rotate", str(rotation_angle), picPath])
 
         if cli_code != 0:
@@ -68,16 +115,42 @@ class RotateTask(Task):
         if not self.isPortrait(picPath):
             self.rotatePic(90, picPath)
 
-    def rotateToPortraitAll(self):
-        """Rotate all picture of lot to portrait."""
+    def virtualRotations(self, pic_paths):
+        """
+        Rolls to apply to the pictures to have them in portrait.
+
+        :return: dict picture name -> roll in degrees, None if the pictures don't all need the same roll
+                 (the projects share the field of view of the first picture).
+        """
+        rolls = {pic_path.basename(): 0 if self.isPortrait(pic_path) else 90 for pic_path in pic_paths}
+        if len(set(rolls.values())) != 1:
+            return None
+        return rolls
+
+    def rotateToPortraitAll(self, virtual=False):
+        """
+        Rotate all picture of lot to portrait, the 6 pictures are rotated in parallel.
+
+        :param virtual: Record the rotation (Const.ROTATION_FILENAME) instead of rotating the pictures.
+        """
         if self.lot is not None and self.lot.pictures_path is not None:
             with self._opv_directory_manager.Open(self.lot.pictures_path) as (uuid, dir_path):
-                for apnNo in range(0, 6):
-                    pic_path = Path(dir_path) / "APN{}.JPG".format(apnNo)
-                    if os.path.exists(pic_path):
-                        self.rotateToPortrait(pic_path)
-                    else:
-                        raise RotateException(filePath=dir_path, rotationAngle=90)
+                pic_paths = [Path(dir_path) / "APN{}.JPG".format(apnNo) for apnNo in range(0, 6)]
+                if not all(os.path.exists(pic_path) for pic_path in pic_paths):
+                    raise RotateException(filePath=dir_path, rotationAngle=90)
+
+                rotation_path = Path(dir_path) / Const.ROTATION_FILENAME
+                if virtual:
+                    rolls = self.virtualRotations(pic_paths)
+                    if rolls is not None:
+                        self.logger.debug("Virtual rotation : " + str(rolls))
+                        rotation_path.write_text(json.dumps(rolls))
+                        return
+                    self.logger.info("The pictures don't need the same rotation, rotating them")
+
+                if rotation_path.exists():     # the pictures will be in portrait, an old virtual rotation doesn't apply anymore
+                    rotation_path.remove()
+                fetchConcurrently(self.rotateToPortrait, pic_paths, maxWorkers=len(pic_paths))
 
     def runWithExceptions(self, options={}):
         """
@@ -87,7 +160,7 @@ class RotateTask(Task):
         self.logger.debug("runWithExceptions start")
         self.checkArgs(options)
         self.lot = self._client_requestor.make(ressources.Lot, options['id_lot'], options['id_malette'])
-        self.rotateToPortraitAll()
+        self.rotateToPortraitAll(virtual=options.get("virtual", Const.ROTATE_VIRTUAL))
         return self.lot.id
 
 
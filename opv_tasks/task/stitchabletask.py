@@ -18,9 +18,11 @@
 
 from path import Path
 from opv_tasks.task import Task, TaskException, TaskReturn, TaskStatusCode
+from opv_tasks.task.taskMetrics import TaskMetrics
 from hsi import Panorama, ifstream
 from opv_api_client import ressources
 from opv_tasks.const import Const
+from opv_tasks.spatialindex import stitchableCpIndexes
 
 class StitchableTask(Task):
     """
@@ -33,6 +35,8 @@ class StitchableTask(Task):
 
     TASK_NAME = "stitchable"
     requiredArgsKeys = ["id_cp", "id_malette"]
+    inputs = ["optimised_cp"]
+    outputs = ["stitchable_cp"]
 
     def stichable(self, proj_pto):
         """Check if a proj_pto is stichable."""
@@ -57,9 +61,11 @@ class StitchableTask(Task):
 
         self.cp.nb_cp = nbPoints
         self.cp.stichable = isStitchable
-        self.cp.save()
+        self._save(self.cp)
+        stitchableCpIndexes.updateCp(self.cp)
 
         if not isStitchable:
+            self._flush()   # the failure is recorded on the cp, it's used by the APN0 recovery
             raise NotStichableException(picLinks=picLinkNb)
 
         self.logger.debug("CP : " + str(self.cp))
@@ -88,13 +94,20 @@ class StitchableTask(Task):
 
     def run(self, options={}):
         """ """
-        try:
-            ouput = self.runWithExceptions(options=options)
-            return TaskReturn(taskName=self.TASK_NAME, statusCode=TaskStatusCode.SUCCESS, outputData=ouput, inputData=options)
-        except NotStichableException as e:
-            apnList = e.getPicturesWithNotEnoughLinks()
-            if 0 in apnList:
-                return TaskReturn(taskName=self.TASK_NAME, statusCode=TaskStatusCode.ERROR_CP_APN0, error="APN0 no CP", inputData=options, outputData=options)
+        self.metrics = TaskMetrics()
+        with self.metrics:
+            try:
+                ouput = self.runWithExceptions(options=options)
+                self._flush()
+                taskReturn = TaskReturn(taskName=self.TASK_NAME, statusCode=TaskStatusCode.SUCCESS, outputData=ouput, inputData=options)
+            except NotStichableException as e:
+                apnList = e.getPicturesWithNotEnoughLinks()
+                if 0 in apnList:
+                    taskReturn = TaskReturn(taskName=self.TASK_NAME, statusCode=TaskStatusCode.ERROR_CP_APN0, error="APN0 no CP", inputData=options, outputData=options)
+                else:
+                    taskReturn = TaskReturn(taskName=self.TASK_NAME, statusCode=TaskStatusCode.ERROR, error=e.getErrorMessage(), inputData=options, outputData=options)
+        taskReturn.metrics = self.metrics.toDict()
+        return taskReturn
 
 
 
@@ -16,57 +16,178 @@
 # Email: team@openpathview.fr
 # Description: Stitch the panorama
 
+import re
+import shutil
+
 from path import Path
-from opv_tasks.task import Task, TaskException
+from opv_tasks.task import Task, TaskException, TaskInvalidArgumentsException
 from opv_api_client import ressources
 
 from opv_tasks.const import Const
+from opv_tasks.jpegmeta import writePhotosphereMetadata
+from opv_tasks.tiffstream import NotStreamableTiffException, SAMPLING_FACTORS, readLayout, writePnm, encodeJpeg
 
 
 class StitchTask(Task):
     """
     Stitch the panorama.
+    With "photosphere_metadata" (default Const.STITCH_PHOTOSPHERE_METADATA) the photosphere metadata are written
+    in the panorama before it's stored (whatever the output), the photosphere task only updates the panorama then.
+    "output" (default Const.STITCH_OUTPUT) is how the JPEG is made :
+        - "stream" : hugin renders an uncompressed TIFF, it's piped band by band into cjpeg (if cjpeg isn't
+          installed it's encoded in process with the whole picture in memory).
+        - "jpeg" : hugin writes the JPEG itself, no TIFF (the chroma subsampling is the hugin one).
+        - "convert" : ImageMagick convert with the Const.STITCH_CONVERT_LIMITS memory limits (the default).
+    "stream" falls back to "convert" when the TIFF can't be streamed.
     Input format :
-        opv-task stitch '{"id_cp": ID_CP, "id_malette": ID_MALETTE }'
+        opv-task stitch '{"id_cp": ID_CP, "id_malette": ID_MALETTE, "photosphere_metadata": false, "output": "stream", "quality": 92, "subsampling": "4:4:4" }'
     Output format :
         {"id_panorama": ID_PANORAMA, "id_malette": ID_MALETTE }
+        {"id_panorama": ID_PANORAMA, "id_malette": ID_MALETTE, "photosphere_metadata": true } with photosphere_metadata
     """
 
     TASK_NAME = "stitch"
     requiredArgsKeys = ['id_cp', 'id_malette']
+    inputs = ["stitchable_cp"]
+    outputs = ["panorama"]
 
     TMP_PTONAME = 'tmp.pto'
+    OUTPUTS = ["stream", "jpeg", "convert"]
+
+    output = Const.STITCH_OUTPUT
+    quality = Const.STITCH_JPEG_QUALITY
+    subsampling = Const.STITCH_JPEG_SUBSAMPLING
+
+    @staticmethod
+    def setOutputSettings(proj_pto, settings):
+        """
+        Set the hugin output settings of a project (its #hugin_output... lines, read by hugin_executor), missing
+        lines are added. The p line is left as it is, it's only the nona remapping format.
+
+        :param proj_pto: Project path, modified in place.
+        :param settings: Settings by name, ie {"ImageType": "tif", "ImageTypeCompression": "NONE"}.
+        """
+        settings = dict(settings)
+        lines = []
+        for line in proj_pto.lines(retain=False):
+            match = re.match(r"#hugin_output(\w+) ", line)
+            if match and match.group(1) in settings:
+                line = "#hugin_output%s %s" % (match.group(1), settings.pop(match.group(1)))
+            lines.append(line)
+        lines += ["#hugin_output%s %s" % setting for setting in sorted(settings.items())]
+        proj_pto.write_text("\n".join(lines) + "\n")
+
+    def hugin(self, proj_pto, extension):
+        """
+        Run hugin_executor on proj_pto, the output files are prefixed by the project name.
+
+        :param extension: Extension of the panorama rendered by hugin ("tif" or "jpg").
+        :return: Path of the rendered panorama.
+        """
+        options = ["-s", "--prefix=" + proj_pto.stripext(), proj_pto]
+        exit_code = self._run_cli('hugin_executor', options)
+
+        output = proj_pto.stripext() + "." + extension
+        if exit_code != 0 or not output.exists():
+            raise HuginExecutorException(self.cp.id, options)
+        return output
+
+    def convert(self, pano_tif, pano):
+        """Convert pano_tif to the jpeg pano with ImageMagick, it's memory is limited by Const.STITCH_CONVERT_LIMITS."""
+        options = []
+        for resource, limit in Const.STITCH_CONVERT_LIMITS.items():
+            options += ["-limit", resource, limit]
+        options += [pano_tif, "-quality", self.quality, "-sampling-factor", SAMPLING_FACTORS[self.subsampling], pano]
+        if self._run_cli("convert", options) != 0:
+            raise JpegEncodingException("convert", options)
+
+    def stream(self, pano_tif, pano):
+        """
+        Convert the uncompressed pano_tif to the jpeg pano band by band. With cjpeg the bands are piped on its stdin,
+        the memory used doesn't depend on the panorama size. Without cjpeg it's encoded in process, the whole 8 bits
+        picture is then held in memory (unbounded).
+        """
+        if shutil.which("cjpeg") is None:
+            self.logger.warning("cjpeg isn't installed, encoding the panorama in process (whole picture in memory)")
+            encodeJpeg(pano_tif, pano, self.quality, self.subsampling, Const.STITCH_STREAM_ROWS)
+            return
+
+        layout = readLayout(pano_tif)   # raises NotStreamableTiffException before cjpeg is started
+        self.logger.debug("Piping the %sx%s pano tif to cjpeg" % (layout.width, layout.height))
+        options = ["-quality", self.quality, "-sample", SAMPLING_FACTORS[self.subsampling], "-outfile", pano]
+        if self._run_cli("cjpeg", options, feed=lambda pipe: writePnm(pano_tif, pipe, Const.STITCH_STREAM_ROWS)) != 0:
+            raise JpegEncodingException("cjpeg", options)
+
+    def render(self, proj_pto, pano):
+        """Render the projection proj_pto with hugin into the jpeg pano."""
+        if self.output == "jpeg":
+            self.setOutputSettings(proj_pto, {"ImageType": "jpg", "JPEGQuality": self.quality})
+            pano_jpg = self.hugin(proj_pto, "jpg")
+            self.logger.debug("Moving pano jpg -> %s" % pano)
+            pano_jpg.move(pano)
+            return
+
+        if self.output == "stream":
+            self.setOutputSettings(proj_pto, {"ImageType": "tif", "ImageTypeCompression": "NONE"})
+        pano_tif = self.hugin(proj_pto, "tif")
+
+        self.logger.debug("Converting and moving pano from tif -> %s" % pano)
+        try:
+            if self.output == "stream":
+                try:
+                    self.stream(pano_tif, pano)
+                except NotStreamableTiffException as e:
+                    self.logger.warning("Panorama can't be streamed (%s), using convert" % e)
+                    self.convert(pano_tif, pano)
+            else:
+                self.convert(pano_tif, pano)
+        finally:
+            pano_tif.remove()  # remove tif to save place and transfer time
 
-    def stitch(self, proj_pto):
-        """Stitch a projection."""
-        exit_code = self._run_cli('hugin_executor', ["-s", proj_pto])
+    def stitch(self, proj_pto, photosphereMetadata=False):
+        """
+        Stitch a projection.
 
-        if exit_code != 0:
-            raise HuginExecutorException(self.cp.id, ["-s", proj_pto])
+        :param photosphereMetadata: Write the photosphere metadata in the panorama (done locally, before it's stored).
+        """
+        cacheKey = None
+        if self._cache is not None:
+            pictures = [proj_pto.dirname() / "APN{}.JPG".format(apnNo) for apnNo in range(0, 6)]
+            cacheKey = self._cache.key(self.TASK_NAME, files=[proj_pto] + pictures, options=[self.output, self.quality, self.subsampling])
 
         with self._opv_directory_manager.Open() as (path_uuid, panorama_path):
             panorama_path = Path(panorama_path)
-
-            pano_tif = proj_pto.dirname().glob('*.tif')[0]
             pano = panorama_path / Const.PANO_FILENAME
 
-            self.logger.debug("Converting and moving pano from tif -> %s" % (panorama_path / Const.PANO_FILENAME))
-            self._run_cli("convert", [pano_tif, pano])
+            if cacheKey is not None and self._cache.fetch(cacheKey, panorama_path):
+                self.logger.info("Panorama found in cache, stitching skipped")
+            else:
+                self.render(proj_pto, pano)
+                if cacheKey is not None:
+                    self._cache.store(cacheKey, [pano])
 
-            pano_tif.remove()  # remove tif to save place and transfer time
+            if photosphereMetadata:
+                self.logger.debug("Writing the photosphere metadata")
+                writePhotosphereMetadata(pano, self.cp.lot.sensors.gps_pos["coordinates"])
 
             self.logger.debug("Adding panorama in DB")
             self.panorama = self._client_requestor.make(ressources.Panorama)
             self.panorama.id_malette = self.cp.id_malette
             self.panorama.equirectangular_path = path_uuid
             self.panorama.cp = self.cp
-            self.panorama.create()
+            self._create(self.panorama)
 
     def runWithExceptions(self, options={}):
         """Run a StitchTask with options."""
 
         self.checkArgs(options)
         self.cp = self._client_requestor.make(ressources.Cp, options["id_cp"], options["id_malette"])
+        photosphereMetadata = options.get("photosphere_metadata", Const.STITCH_PHOTOSPHERE_METADATA)
+        self.output = options.get("output", Const.STITCH_OUTPUT)
+        self.quality = int(options.get("quality", Const.STITCH_JPEG_QUALITY))
+        self.subsampling = options.get("subsampling", Const.STITCH_JPEG_SUBSAMPLING)
+        if self.output not in self.OUTPUTS or self.subsampling not in SAMPLING_FACTORS:
+            raise TaskInvalidArgumentsException(requiredArguements=self.requiredArgsKeys, invalidArguments=["output", "subsampling"])
 
         if not self.cp.stichable:
             raise InvalidNotSitchaleException(self.cp.id)
@@ -80,12 +201,14 @@ class StitchTask(Task):
                 self.logger.debug("Copy pto file " + proj_pto + " -> " + local_tmp_pto)
                 proj_pto.copyfile(local_tmp_pto)
 
-                self.stitch(local_tmp_pto)
+                self.stitch(local_tmp_pto, photosphereMetadata=photosphereMetadata)
 
+        if photosphereMetadata:
+            return dict(self.panorama.id, photosphere_metadata=True)
         return self.panorama.id
 
 class HuginExecutorException(TaskException):
-    """ hugin executor exception (non 0 exit code). """
+    """ hugin executor exception (non 0 exit code or no panorama rendered). """
     def __init__(self, idCp, cli_param):
         self.cli_param = cli_param
         self.idCp = idCp
@@ -93,6 +216,15 @@ class HuginExecutorException(TaskException):
     def getErrorMessage(self):
         return "hugin executor failled for CP " + str(self.idCp) + "with the following options : " + str(self.cli_param)
 
+class JpegEncodingException(TaskException):
+    """ Raised when the panorama JPEG encoding failed (non 0 exit code). """
+    def __init__(self, cmd, cli_param):
+        self.cmd = cmd
+        self.cli_param = cli_param
+
+    def getErrorMessage(self):
+        return self.cmd + " failed to encode the panorama with the following options : " + str(self.cli_param)
+
 class InvalidNotSitchaleException(TaskException):
     """ When CP isn't stitchable. """
     def __init__(self, idCp):
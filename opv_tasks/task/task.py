@@ -16,27 +16,50 @@
 # Email: team@openpathview.fr
 # Description: Abstract class for representing task, you must redefine the run methods.
 
-import subprocess
+import time
 import logging
 import threading
 
 from opv_tasks.task import TaskReturn, TaskStatusCode, TaskException
+from opv_tasks.task.taskMetrics import TaskMetrics, MeasuredDirectoryManagerClient
+from opv_tasks.metricscontext import measureRequests
+from opv_tasks.identitymap import IdentityMapClient
+from opv_tasks.slots import subprocessSlots
+from opv_tasks.commandrunner import commandRunner
+from opv_tasks.concurrency import fetchConcurrently
 
 class Task:
     """An abstract class, you must redefine the run method."""
 
     TASK_NAME = None            # TaskName should be set in the implementation
     requiredArgsKeys = None     # Required arguments key for checkArgs
+    inputs = None               # Artifacts consumed by the task (["lot"], ["cp"]...), None if it can't be scheduled by TaskScheduler
+    outputs = None              # Artifacts produced by the task, set to the task output data
 
-    def __init__(self, client_requestor, opv_directorymanager_client):
+    def __init__(self, client_requestor, opv_directorymanager_client, journal=None, cache=None):
         """
         Create a task.
 
         :param client_requestor: the client requestor to use for the task
         :param opv_directorymanager_client: The client directory manager to use
+        :param journal: Optional Journal, used by the pipeline tasks to resume their stages
+        :param cache: Optional ResultCache, used by the deterministic tasks to reuse their outputs
         """
-        self._client_requestor = client_requestor
-        self._opv_directory_manager = opv_directorymanager_client
+        # Ressources are made once per task run, or per pipeline run when the client is already an identity map
+        self._identity_map = getattr(client_requestor, "identityMap", None) or IdentityMapClient(client_requestor)
+
+        # REST requests are measured where they are sent, the DirectoryManager client is wrapped, see self.metrics
+        measureRequests()
+        self.metrics = TaskMetrics()
+        self._client_requestor = self._identity_map
+        self._opv_directory_manager = MeasuredDirectoryManagerClient(opv_directorymanager_client, lambda: self.metrics)
+        self._journal = journal
+        self._cache = cache
+
+        # Ressources to save at the end of the run, see _save
+        self._dirty = []
+        self._dirty_ids = set()     # id() of the ressources in _dirty
+        self._dirty_lock = threading.Lock()
 
         logger_name = "opv_task." + self.__class__.__name__
         shell_logger_name = logger_name + '.shell'
@@ -90,17 +113,59 @@ class Task:
         taskReturn = TaskReturn(taskName=self.TASK_NAME)
 
         # Running task and handeling exceptions
-        try:
-            taskOutput = self.runWithExceptions(options=options)
-            taskReturn.outputData = taskOutput
-            taskReturn.statusCode = TaskStatusCode.SUCCESS
-        except TaskException as taskException:
-            taskReturn.error = taskException.getErrorMessage()
-            taskReturn.statusCode = TaskStatusCode.ERROR
+        self.metrics = TaskMetrics()
+        with self.metrics:
+            try:
+                taskOutput = self.runWithExceptions(options=options)
+                self._flush()
+                taskReturn.outputData = taskOutput
+                taskReturn.statusCode = TaskStatusCode.SUCCESS
+            except TaskException as taskException:
+                taskReturn.error = taskException.getErrorMessage()
+                taskReturn.statusCode = TaskStatusCode.ERROR
+        taskReturn.metrics = self.metrics.toDict()
 
         return taskReturn
 
-    def _run_cli(self, cmd, args=[], stdout_level=logging.INFO, stderr_level=logging.WARNING):
+    def _save(self, ressource):
+        """
+        Mark a ressource to be saved at the end of the task (unit of work, see _flush).
+        Saving the same ressource many times during a run only sends it once.
+
+        :param ressource: Ressource to save.
+        """
+        with self._dirty_lock:
+            if id(ressource) not in self._dirty_ids:
+                self._dirty_ids.add(id(ressource))
+                self._dirty.append(ressource)
+
+    def _flush(self):
+        """
+        Save the ressources marked by _save (with a bounded concurrency), done at the end of a successful run.
+        Flush before failing when the changes must be kept anyway.
+        Saved ressources are dropped from the identity map, the next make() fetches them again.
+        """
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, []
+            self._dirty_ids = set()
+        fetchConcurrently(self._saveNow, dirty)
+
+    def _saveNow(self, ressource):
+        ressource.save()
+        self._identity_map.invalidate(ressource)
+
+    def _create(self, ressource):
+        """
+        Create a ressource, other copies of it in the identity map are dropped.
+
+        :param ressource: Ressource to create.
+        :return: The create response.
+        """
+        response = ressource.create()
+        self._identity_map.invalidate(ressource)
+        return response
+
+    def _run_cli(self, cmd, args=[], stdout_level=logging.INFO, stderr_level=logging.WARNING, timeout=None, feed=None):
         """
         Run a command.
 
@@ -108,28 +173,28 @@ class Task:
         :param args: Args to pass to the command
         :param stdout_level: Level to use to log the stdout (INFO, DEBUG...) -> same as in the logging module
         :param stderr_level: Same as stdout_level, for stderr
+        :param timeout: Optional timeout in seconds, the command is killed when it expires
+        :param feed: Optional callable(pipe) writing the command stdin
         :return: return code of the cli
         """
         my_cmd = cmd if isinstance(cmd, list) else [cmd]
         my_args = args if isinstance(args, list) else [args]
-        proc = subprocess.Popen(
-            my_cmd + my_args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-
-        def log_output(handler, logger, level):
-            for line in handler:
-                logger.log(level, line.strip())
-
-        # Use threads to log in the same time
-        threading.Thread(target=log_output, args=[proc.stdout, self.shell_logger, stdout_level]).start()
-        threading.Thread(target=log_output, args=[proc.stderr, self.shell_logger, stderr_level]).start()
-
-        proc.wait()
 
-        return proc.returncode
+        # Wait for a slot of the node wide budget of this command
+        with subprocessSlots.acquire(my_cmd[0]) as slotWait:
+            start = time.perf_counter()
+            returncode = commandRunner.run(
+                [str(a) for a in my_cmd + my_args],
+                self.shell_logger,
+                stdout_level=stdout_level,
+                stderr_level=stderr_level,
+                timeout=timeout,
+                onStart=lambda pid: subprocessSlots.configure(my_cmd[0], pid),
+                feed=feed
+            )
+        self.metrics.addSubprocess(my_cmd[0], time.perf_counter() - start, slotWait=slotWait)
+
+        return returncode
 
 class TaskInvalidArgumentsException(TaskException):
     """ Raised when some arguments/options are missing or invalid"""
@@ -0,0 +1,183 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Time and resources used by a task run.
+
+import time
+import resource
+import threading
+
+from opv_tasks.metricscontext import bindMetrics, directoryManagerCall
+
+
+def readIoCounters():
+    """
+    Bytes read and written by the process (Linux only).
+
+    :return: (bytes read, bytes written) or (None, None) if not available.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class TaskMetrics:
+    """
+    Measure a task run : wall time, CPU time, peak RSS, time spent in subprocesses, in the REST
+    and DirectoryManager clients, and bytes read/written. Use it as a context manager around the run,
+    it's the current metrics of the thread meanwhile (see opv_tasks.metricscontext) : the REST requests sent by
+    the thread, and by the worker threads of fetchConcurrently, are added to it.
+    Process wide counters (CPU, children CPU, peak RSS, IO) are shared by the tasks running at the same time in a process,
+    the CPU time includes the thread pools of the task.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.subprocesses = []          # [{"cmd": CMD, "time": SECONDS, "slotWait": SECONDS}]
+        self.restTime = 0.0
+        self.restCalls = 0
+        self.directoryManagerTime = 0.0
+        self.directoryManagerCalls = 0
+        self.stages = {}                # metrics of the sub tasks, by task name
+        self.wallTime = None
+        self.cpuTime = None
+        self.childrenCpuTime = None
+        self.peakRss = None
+        self.childrenPeakRss = None
+        self.bytesRead = None
+        self.bytesWritten = None
+
+    def __enter__(self):
+        self._bound = bindMetrics(self)
+        self._bound.__enter__()
+        self._startWall = time.perf_counter()
+        self._startCpu = time.process_time()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._startChildrenCpu = children.ru_utime + children.ru_stime
+        self._startRead, self._startWritten = readIoCounters()
+        return self
+
+    def __exit__(self, *args):
+        self.wallTime = time.perf_counter() - self._startWall
+        self.cpuTime = time.process_time() - self._startCpu
+
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.childrenCpuTime = children.ru_utime + children.ru_stime - self._startChildrenCpu
+        self.childrenPeakRss = children.ru_maxrss                                   # kB
+        self.peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss            # kB
+
+        read, written = readIoCounters()
+        if read is not None and self._startRead is not None:
+            self.bytesRead = read - self._startRead
+            self.bytesWritten = written - self._startWritten
+        self._bound.__exit__(*args)
+
+    def addSubprocess(self, cmd, duration, slotWait=0.0):
+        """Record a subprocess run (cmd name, duration and time waited for a slot in seconds)."""
+        with self._lock:
+            self.subprocesses.append({"cmd": cmd, "time": duration, "slotWait": slotWait})
+
+    def addRestCall(self, duration):
+        """Record a REST client call."""
+        with self._lock:
+            self.restTime += duration
+            self.restCalls += 1
+
+    def addDirectoryManagerCall(self, duration, count=1):
+        """Record the time spent in the DirectoryManager client, count is 1 for an Open (0 for the use of the opened directory)."""
+        with self._lock:
+            self.directoryManagerTime += duration
+            self.directoryManagerCalls += count
+
+    def toDict(self):
+        """Return the metrics as a JSON serializable dict."""
+        metrics = {
+            "wallTime": self.wallTime,
+            "cpuTime": self.cpuTime,
+            "childrenCpuTime": self.childrenCpuTime,
+            "peakRss": self.peakRss,
+            "childrenPeakRss": self.childrenPeakRss,
+            "subprocessTime": sum(s["time"] for s in self.subprocesses),
+            "subprocesses": list(self.subprocesses),
+            "slotWaitTime": sum(s["slotWait"] for s in self.subprocesses),
+            "restTime": self.restTime,
+            "restCalls": self.restCalls,
+            "directoryManagerTime": self.directoryManagerTime,
+            "directoryManagerCalls": self.directoryManagerCalls,
+            "bytesRead": self.bytesRead,
+            "bytesWritten": self.bytesWritten
+        }
+        if self.stages:
+            metrics["stages"] = dict(self.stages)
+        return metrics
+
+    @staticmethod
+    def summary(metrics):
+        """One line summary of a metrics dict (see toDict)."""
+        if not metrics or metrics.get("wallTime") is None:
+            return "no metrics"
+        return "wall %.2fs, cpu %.2fs, subprocess %.2fs (slot wait %.2fs), rest %.2fs (%s calls), directory manager %.2fs (%s calls), peak rss %s kB" % (
+            metrics["wallTime"], metrics["cpuTime"], metrics["subprocessTime"], metrics.get("slotWaitTime", 0.0), metrics["restTime"], metrics["restCalls"],
+            metrics["directoryManagerTime"], metrics["directoryManagerCalls"], metrics["peakRss"])
+
+
+class MeasuredDirectory:
+    """Wrap a directory opened with the DirectoryManager, the time spent to enter, exit and save it is added to it's Open."""
+
+    def __init__(self, directory, getMetrics):
+        self._directory = directory
+        self._getMetrics = getMetrics
+
+    def _measure(self, method, *args):
+        start = time.perf_counter()
+        try:
+            with directoryManagerCall():
+                return method(*args)
+        finally:
+            self._getMetrics().addDirectoryManagerCall(time.perf_counter() - start, count=0)
+
+    def __enter__(self):
+        return self._measure(self._directory.__enter__)
+
+    def __exit__(self, *args):
+        return self._measure(self._directory.__exit__, *args)
+
+    def save(self, *args):
+        return self._measure(self._directory.save, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._directory, name)
+
+
+class MeasuredDirectoryManagerClient:
+    """Wrap a DirectoryManager client, each Open is a call, the time spent to open, transfer and save directories is added to the task metrics."""
+
+    def __init__(self, client, getMetrics):
+        self._client = client
+        self._getMetrics = getMetrics
+
+    def Open(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with directoryManagerCall():
+                return MeasuredDirectory(self._client.Open(*args, **kwargs), self._getMetrics)
+        finally:
+            self._getMetrics().addDirectoryManagerCall(time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
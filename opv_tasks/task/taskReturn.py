@@ -25,7 +25,7 @@ class TaskReturn:
      Represent return value of a task.
     """
 
-    def __init__(self, taskName=None, jsonStr=None, statusCode=TaskStatusCode.SUCCESS, inputData={}, outputData={}, error=None):
+    def __init__(self, taskName=None, jsonStr=None, statusCode=TaskStatusCode.SUCCESS, inputData={}, outputData={}, error=None, metrics={}):
         """
         Init TaskReturn with values or from json string.
         """
@@ -37,6 +37,7 @@ class TaskReturn:
             self.error = error              # Error string message
             self.inputData = inputData      # Task input data dict
             self.outputData = outputData    # Task output (returned) data dict
+            self.metrics = metrics          # Time and resources used by the task (see TaskMetrics.toDict)
 
     def isSuccess(self):
         return self.statusCode == TaskStatusCode.SUCCESS
@@ -53,3 +54,4 @@ class TaskReturn:
         self.error = data['error']
         self.inputData = data['inputData']
         self.outputData = data['outputData']
+        self.metrics = data.get('metrics', {})
@@ -18,12 +18,14 @@
 
 from path import Path
 import json
+import time
 import tempfile
 
 from opv_api_client import ressources
 
 from .task import Task
 from opv_tasks.const import Const
+from opv_tasks.slots import subprocessSlots
 from opv_tasks.third_party.tile import tile
 
 class TilingTask(Task):
@@ -37,6 +39,8 @@ class TilingTask(Task):
 
     TASK_NAME = "tiling"
     requiredArgsKeys = ["id_panorama", "id_malette"]
+    inputs = ["photosphere"]     # the panorama, once photosphere is done with it (it rewrites the JPEG)
+    outputs = ["tile"]
 
     TILESIZE = 512
     CUBESIZE = 0
@@ -48,13 +52,26 @@ class TilingTask(Task):
         with tempfile.TemporaryDirectory() as output_dirpath:
             output_dirpath = Path(output_dirpath) / "output"
 
-            tile(
-                inputFile=pano_path,
-                output=output_dirpath,
-                tileSize=self.TILESIZE,
-                cubeSize=self.CUBESIZE,
-                quality=self.QUALITY,
-                png=self.PNG)
+            cacheKey = None
+            if self._cache is not None:
+                cacheKey = self._cache.key(self.TASK_NAME, files=[pano_path], options=[self.TILESIZE, self.CUBESIZE, self.QUALITY, self.PNG])
+
+            if cacheKey is not None and self._cache.fetch(cacheKey, output_dirpath):
+                self.logger.info("Tiles found in cache, tiling skipped")
+            else:
+                with subprocessSlots.acquire("nona") as slotWait:     # tile runs nona itself
+                    start = time.perf_counter()
+                    tile(
+                        inputFile=pano_path,
+                        output=output_dirpath,
+                        tileSize=self.TILESIZE,
+                        cubeSize=self.CUBESIZE,
+                        quality=self.QUALITY,
+                        png=self.PNG)
+                self.metrics.addSubprocess("nona", time.perf_counter() - start, slotWait=slotWait)
+
+                if cacheKey is not None:
+                    self._cache.store(cacheKey, output_dirpath.listdir())
 
             self.tile = self._client_requestor.make(ressources.Tile)
             self.tile.id_malette = self.pano.id_malette
@@ -77,7 +94,7 @@ class TilingTask(Task):
                 self.tile.cube_resolution = tile_config['cubeResolution']
 
             self.tile.panorama = self.pano
-            self.tile.create()
+            self._create(self.tile)
 
             self.pano.cp.get()
             self.pano.cp.lot.get()
@@ -85,7 +102,7 @@ class TilingTask(Task):
             lot = self.pano.cp.lot
 
             lot.tile = self.tile
-            lot.save()
+            self._save(lot)
 
     def runWithExceptions(self, options={}):
         """Run the tilling task my faverite one."""
@@ -17,8 +17,11 @@
 # Description: Generate the camapaign pannellum config and copy config asset.
 
 from opv_tasks.task import Task
-from opv_api_client import ressources
+from opv_tasks.concurrency import fetchConcurrently, makeAllIn
+from opv_api_client import ressources, Filter
+from opv_api_client.exceptions import RequestAPIException
 from path import Path
+from collections import OrderedDict
 import json
 import tempfile
 import os
@@ -35,23 +38,150 @@ class WebgenTask(Task):
     """
     TASK_NAME = "webgen"
     requiredArgsKeys = ["id_campaign", "id_malette"]
+    inputs = ["campaign"]
+    outputs = ["website"]
     BASE_TEMPLATE_REL_PATH = "../ressources/base.html"
 
+    @staticmethod
+    def lotData(lot, gps, tile, equirectangular_path, track_edges):
+        """
+            Config data of an usable lot, track_edges is the list of it's track edges ids.
+        """
+        return {
+            "lot": lot,
+            "gps": gps,
+            "extension": tile.extension,
+            "resolution": tile.resolution,
+            "param_location": tile.param_location,
+            "cube_resolution": tile.cube_resolution,
+            "max_level": tile.max_level,
+            "equirectangular_path": equirectangular_path,
+            "fallback_path": tile.fallback_path,
+            "track_edges": track_edges
+        }
+
+    @staticmethod
+    def hotspot(track_edge, lot_to):
+        """
+            Hotspot of a track edge, lot_to is the (id_lot, id_malette) of the scene it leads to.
+        """
+        scene = "{}-{}".format(*lot_to)
+        return {
+            "type": "scene",
+            "text": scene,
+            "sceneId": scene,
+            "yaw": track_edge.yaw,
+            "pitch": track_edge.pitch,
+            "targetYaw": track_edge.targetYaw,
+            "targetPitch": track_edge.targetPitch
+        }
+
+    def findLotBulk(self, lots):
+        """
+            Load the tiles, panoramas, positions and track edges of the lots with one query per kind (ids lists are
+            split in chunks, see makeAllIn). Relations are followed with their ids columns (lot.id_tile ...) so no
+            ressource is fetched alone.
+            Return {(id_lot, id_malette): lot data or None if it isn't usable} and the hotspots by track edge id.
+        """
+        tiles_ids = [lot.id_tile for lot in lots if lot.id_tile is not None]
+        lots_ids = [lot.id_lot for lot in lots]
+        tiles = {(tile.id_tile, tile.id_malette): tile for tile in makeAllIn(
+            self._client_requestor, ressources.Tile, Filter("id_tile").in_, tiles_ids)}
+        panoramas_ids = [tile.id_panorama for tile in tiles.values()]
+        panoramas = {(panorama.id_panorama, panorama.id_malette): panorama for panorama in makeAllIn(
+            self._client_requestor, ressources.Panorama, Filter("id_panorama").in_, panoramas_ids)}
+        track_edges = makeAllIn(self._client_requestor, ressources.TrackEdge, Filter("id_lot_from").in_, lots_ids)
+        positions = {}
+        for panorama in self._client_requestor.make_all(ressources.PanoramaSensors, filters=(
+                Filter("id_campaign")==self.campaign_id,
+                Filter("id_campaign_malette")==self.malette_id)):
+            if panorama.original_gps_pos is not None:
+                positions[(panorama.original_id_sensors, panorama.original_id_malette)] = panorama.original_gps_pos["coordinates"]
+
+        lot_track_edges = {}
+        hotspots = {}
+        for track_edge in track_edges:
+            track_edge_id = (track_edge.id_track_edge, track_edge.id_malette)
+            lot_track_edges.setdefault((track_edge.id_lot_from, track_edge.id_lot_from_malette), []).append(track_edge_id)
+            hotspots[track_edge_id] = self.hotspot(track_edge, (track_edge.id_lot_to, track_edge.id_lot_to_malette))
+
+        lots_data = {}
+        for lot in lots:
+            lots_data[(lot.id_lot, lot.id_malette)] = None
+            tile = tiles.get((lot.id_tile, lot.id_tile_malette))
+            track_edges_ids = lot_track_edges.get((lot.id_lot, lot.id_malette))
+            if tile is None or not track_edges_ids:
+                continue
+            panorama = panoramas.get((tile.id_panorama, tile.id_panorama_malette))
+            if panorama is None:
+                self.logger.warning("Panorama of the tile {}-{} not found, lot {}-{} skipped".format(
+                    tile.id_tile, tile.id_malette, lot.id_lot, lot.id_malette))
+                continue
+            gps = positions.get((lot.id_sensors, lot.id_sensors_malette))
+            if gps is None:     # lot without photosphere panorama in the PanoramaSensors view
+                gps = lot.sensors.gps_pos["coordinates"]
+            lots_data[(lot.id_lot, lot.id_malette)] = self.lotData(lot, gps, tile, panorama.equirectangular_path, track_edges_ids)
+        return lots_data, hotspots
+
+    def prefetchLot(self, lot):
+        """
+            Load what the config needs about a lot (tile, panorama, sensors and track edges ids), called from the prefetch threads.
+            Return None if the lot isn't usable.
+        """
+        tile = lot.tile
+        if tile is None:
+            return None
+        track_edges = lot.track_edges
+        if len(track_edges) == 0:
+            return None
+
+        track_edges_ids = [(track_edge["id_track_edge"], track_edge["id_malette"]) for track_edge in track_edges]
+        return self.lotData(lot, lot.sensors.gps_pos["coordinates"], tile, tile.panorama.equirectangular_path, track_edges_ids)
+
+    def prefetchTrackEdge(self, track_edge_id):
+        """
+            Load the hotspot of a track edge, called from the prefetch threads.
+        """
+        track_edge = self._client_requestor.make(ressources.TrackEdge, *track_edge_id)
+        return self.hotspot(track_edge, (track_edge.lot_to.id_lot, track_edge.lot_to.id_malette))
+
+    def findLotOneByOne(self, lots):
+        """
+            Same as findLotBulk, each lot and track edge is loaded (with a bounded concurrency), used when the
+            API or the client can't do the queries.
+        """
+        lots_data = dict(zip([(lot.id_lot, lot.id_malette) for lot in lots], fetchConcurrently(self.prefetchLot, lots)))
+
+        # Each track edge is fetched once
+        track_edge_ids = list(OrderedDict.fromkeys(
+            track_edge_id for lot_data in lots_data.values() if lot_data is not None for track_edge_id in lot_data["track_edges"]))
+        return lots_data, dict(zip(track_edge_ids, fetchConcurrently(self.prefetchTrackEdge, track_edge_ids)))
+
     def findLot(self):
         """
             Generate a list of lot who are usable and who will be put in pannellum
             A lot is usable when it is assemble and he had trackedge
+            All the lots (and their tile, sensors and track edges) are loaded here with a few queries.
         """
         self.campaign = self._client_requestor.make(ressources.Campaign, self.campaign_id, self.malette_id)
         self.usable_lot = []
+        self.lots_data = OrderedDict()
 
         self.logger.info("Find usable lot")
 
-        for lot in self.campaign.lots:
-            if lot.tile is not None:
-                if len(lot.track_edges) != 0:
-                    self.usable_lot.append(lot)
-                    self.logger.info("Lot number {}-{} is an usable lot and will be put in pannellum config".format(lot.id_lot, lot.id_malette))
+        lots = self.campaign.lots
+        try:
+            lots_data, self.hotspots = self.findLotBulk(lots)
+        except (RequestAPIException, TypeError, AttributeError) as e:    # the client Filter might not have the in operator
+            self.logger.warning("Can't query the lots data at once ({}), fetching the lots one by one".format(e))
+            lots_data, self.hotspots = self.findLotOneByOne(lots)
+
+        for lot in lots:
+            lot_data = lots_data[(lot.id_lot, lot.id_malette)]
+            if lot_data is not None:
+                self.usable_lot.append(lot)
+                self.lots_data["{}-{}".format(lot.id_lot, lot.id_malette)] = lot_data
+                self.logger.info("Lot number {}-{} is an usable lot and will be put in pannellum config".format(lot.id_lot, lot.id_malette))
 
     def generateConf(self):
         """
@@ -69,38 +199,21 @@ class WebgenTask(Task):
 
         scenes = {}
 
-        for lot in self.usable_lot:
-            lot_name = "{}-{}".format(lot.id_lot, lot.id_malette)
-
+        for lot_name, lot_data in self.lots_data.items():
             scenes[lot_name] = {}
             scenes[lot_name]["title"] = lot_name
-            sensors = self._client_requestor.make(ressources.Sensors, lot.sensors.id_sensors, lot.sensors.id_malette)
-            scenes[lot_name]["gps"] = sensors.gps_pos["coordinates"]
+            scenes[lot_name]["gps"] = lot_data["gps"]
             scenes[lot_name]["type"] = "multires"
             scenes[lot_name]["multiRes"] = {}
-            scenes[lot_name]["multiRes"]["extension"] = lot.tile.extension
-            scenes[lot_name]["multiRes"]["tileResolution"] = lot.tile.resolution
-            scenes[lot_name]["multiRes"]["basePath"] = "poc/"+lot.tile.param_location
-            scenes[lot_name]["multiRes"]["cubeResolution"] = lot.tile.cube_resolution
+            scenes[lot_name]["multiRes"]["extension"] = lot_data["extension"]
+            scenes[lot_name]["multiRes"]["tileResolution"] = lot_data["resolution"]
+            scenes[lot_name]["multiRes"]["basePath"] = "poc/"+lot_data["param_location"]
+            scenes[lot_name]["multiRes"]["cubeResolution"] = lot_data["cube_resolution"]
             scenes[lot_name]["multiRes"]["path"] = "/%l/%s%y_%x"
-            scenes[lot_name]["multiRes"]["maxLevel"] = lot.tile.max_level
-            scenes[lot_name]["multiRes"]["preview"] = "poc/"+lot.tile.panorama.equirectangular_path
-            scenes[lot_name]["multiRes"]["fallbackPath"] = "poc/"+lot.tile.fallback_path
-            scenes[lot_name]["hotSpots"] = []
-
-            for track_edge in lot.track_edges:
-                track_edge = self._client_requestor.make(ressources.TrackEdge, track_edge["id_track_edge"], track_edge["id_malette"])
-
-                hotspot = {}
-                hotspot["type"] = "scene"
-                hotspot["text"] = "{}-{}".format(track_edge.lot_to.id_lot, track_edge.lot_to.id_malette)
-                hotspot["sceneId"] = "{}-{}".format(track_edge.lot_to.id_lot, track_edge.lot_to.id_malette)
-                hotspot["yaw"] = track_edge.yaw
-                hotspot["pitch"] = track_edge.pitch
-                hotspot["targetYaw"] = track_edge.targetYaw
-                hotspot["targetPitch"] = track_edge.targetPitch
-
-                scenes[lot_name]["hotSpots"].append(hotspot)
+            scenes[lot_name]["multiRes"]["maxLevel"] = lot_data["max_level"]
+            scenes[lot_name]["multiRes"]["preview"] = "poc/"+lot_data["equirectangular_path"]
+            scenes[lot_name]["multiRes"]["fallbackPath"] = "poc/"+lot_data["fallback_path"]
+            scenes[lot_name]["hotSpots"] = [dict(self.hotspots[track_edge_id]) for track_edge_id in lot_data["track_edges"]]
 
         self.conf["scenes"] = scenes
         self.conf = json.dumps(self.conf)
@@ -131,14 +244,14 @@ class WebgenTask(Task):
         self.logger.info("The web directory is store here : "+self.web_path)
 
         self.logger.info("Put asset in the web directory")
-        for lot in self.usable_lot:
-            with self._opv_directory_manager.Open(lot.tile.param_location) as (name, dir_path):
+        for lot_data in self.lots_data.values():
+            with self._opv_directory_manager.Open(lot_data["param_location"]) as (name, dir_path):
                 loc = Path(dir_path)
                 shutil.copytree(loc, self.poc_path / name, copy_function=os.link)
-            with self._opv_directory_manager.Open(lot.tile.fallback_path) as (name, dir_path):
+            with self._opv_directory_manager.Open(lot_data["fallback_path"]) as (name, dir_path):
                 loc = Path(dir_path)
                 shutil.copytree(loc, self.poc_path / name, copy_function=os.link)
-            with self._opv_directory_manager.Open(lot.tile.panorama.equirectangular_path) as (name, dir_path):
+            with self._opv_directory_manager.Open(lot_data["equirectangular_path"]) as (name, dir_path):
                 loc = Path(dir_path)
                 shutil.copytree(loc, self.poc_path / name, copy_function=os.link)
 
@@ -153,3 +153,49 @@ class ReconstructionUtils:
                      -shot["rotation"][2]]
         rt = self.rotate(shot["translation"], angleaxis)
         return np.negative(rt)
+
+    def rotateAll(self, vectors, angleaxes):
+        """
+        Vectorized rotate, rotate each vector by its angle axis.
+
+        :param vectors: (N, 3) array of vectors.
+        :param angleaxes: (N, 3) array of angle axis.
+        :return: (N, 3) array of rotated vectors.
+        """
+        vectors = np.asarray(vectors, dtype=np.float64)
+        angleaxes = np.asarray(angleaxes, dtype=np.float64)
+        angles = np.linalg.norm(angleaxes, axis=1)
+        d = angleaxes / np.where(angles == 0, 1, angles)[:, None]
+
+        ddt = np.einsum("ni,nj->nij", d, d)
+        skew = np.zeros((len(d), 3, 3))
+        skew[:, 0, 1], skew[:, 0, 2] = d[:, 2], -d[:, 1]
+        skew[:, 1, 0], skew[:, 1, 2] = -d[:, 2], d[:, 0]
+        skew[:, 2, 0], skew[:, 2, 1] = d[:, 1], -d[:, 0]
+
+        cos = np.cos(angles)[:, None, None]
+        sin = np.sin(angles)[:, None, None]
+        matrices = ddt + cos * (np.eye(3) - ddt) + sin * skew
+        return np.einsum("ni,nij->nj", vectors, matrices)
+
+    def opticalCenters(self, rotations, translations):
+        """
+        Vectorized opticalCenter.
+
+        :param rotations: (N, 3) array of the shots rotations.
+        :param translations: (N, 3) array of the shots translations.
+        :return: (N, 3) array of optical centers.
+        """
+        return np.negative(self.rotateAll(translations, np.negative(rotations)))
+
+    def getImagesOrientationVectors(self, rotations, translations):
+        """
+        Vectorized getImageOrientationVector.
+
+        :param rotations: (N, 3) array of the shots rotations.
+        :param translations: (N, 3) array of the shots translations.
+        :return: (N, 3) array of orientations.
+        """
+        translations = np.asarray(translations, dtype=np.float64)
+        vectors = np.column_stack((-translations[:, 0], -translations[:, 1], 2 - translations[:, 2]))
+        return self.rotateAll(vectors, np.negative(rotations))
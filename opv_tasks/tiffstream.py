@@ -0,0 +1,140 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Read the uncompressed TIFF rendered by hugin band by band, to encode it in JPEG with a bounded memory.
+
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# TIFF tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+PLANAR_CONFIGURATION = 284
+SAMPLE_FORMAT = 339
+
+# Chroma subsampling -> sampling factors of the luminance (cjpeg -sample, convert -sampling-factor)
+SAMPLING_FACTORS = {"4:4:4": "1x1", "4:2:2": "2x1", "4:2:0": "2x2"}
+
+TiffLayout = namedtuple("TiffLayout", ["width", "height", "bits", "samples", "rowsPerStrip", "offsets", "byteOrder"])
+
+
+class NotStreamableTiffException(Exception):
+    """Raised when a TIFF can't be read band by band (compressed, planar, floating point ...)."""
+
+
+def _values(value):
+    return tuple(value) if isinstance(value, tuple) else (value,)
+
+
+def readLayout(path):
+    """
+    Layout of an uncompressed chunky TIFF with unsigned 8 or 16 bits samples (first image of the file), only the tags are read.
+
+    :param path: TIFF path.
+    :return: A TiffLayout.
+    """
+    with Image.open(path) as im:
+        tags = im.tag_v2
+        bits = set(_values(tags.get(BITS_PER_SAMPLE, 1)))
+        if tags.get(COMPRESSION, 1) != 1:
+            raise NotStreamableTiffException("compressed TIFF (compression %s)" % tags.get(COMPRESSION))
+        if tags.get(PLANAR_CONFIGURATION, 1) != 1:
+            raise NotStreamableTiffException("planar TIFF")
+        if set(_values(tags.get(SAMPLE_FORMAT, 1))) != {1} or len(bits) != 1 or bits - {8, 16}:
+            raise NotStreamableTiffException("samples aren't unsigned 8 or 16 bits integers")
+
+        height = tags[IMAGE_LENGTH]
+        return TiffLayout(
+            width=tags[IMAGE_WIDTH],
+            height=height,
+            bits=bits.pop(),
+            samples=tags.get(SAMPLES_PER_PIXEL, 1),
+            rowsPerStrip=min(tags.get(ROWS_PER_STRIP, height), height),
+            offsets=_values(tags[STRIP_OFFSETS]),
+            byteOrder="<" if tags.prefix == b"II" else ">")
+
+
+def iterBands(path, layout, bandRows):
+    """
+    Read the pictures band by band, samples are converted to 8 bits and alpha is dropped.
+
+    :param path: TIFF path.
+    :param layout: Its TiffLayout.
+    :param bandRows: Minimum number of rows of a band (whole strips are read).
+    :return: Yield (rows, width, 3) or (rows, width, 1) uint8 arrays.
+    """
+    data = np.memmap(str(path), dtype=np.uint8, mode="r")
+    dtype = np.dtype(layout.byteOrder + ("u2" if layout.bits == 16 else "u1"))
+    channels = 3 if layout.samples >= 3 else 1
+    try:
+        band = []
+        for strip, offset in enumerate(layout.offsets):
+            rows = min(layout.rowsPerStrip, layout.height - strip * layout.rowsPerStrip)
+            if rows <= 0:
+                break
+            size = rows * layout.width * layout.samples * dtype.itemsize
+            pixels = data[offset:offset + size].view(dtype).reshape(rows, layout.width, layout.samples)[:, :, :channels]
+            if layout.bits == 16:
+                pixels = ((pixels.astype(np.uint32) + 128) // 257).astype(np.uint8)    # rounded like ImageMagick
+            band.append(np.array(pixels, dtype=np.uint8))
+            if sum(len(b) for b in band) >= bandRows:
+                yield np.concatenate(band)
+                band = []
+        if band:
+            yield np.concatenate(band)
+    finally:
+        del data
+
+
+def writePnm(tif_path, out, bandRows):
+    """
+    Convert an uncompressed TIFF into a binary PPM (or PGM) written band by band to a binary stream (cjpeg stdin).
+
+    :param tif_path: TIFF path.
+    :param out: Binary file object the PPM is written to.
+    :param bandRows: Rows converted at once.
+    """
+    layout = readLayout(tif_path)
+    magic = b"P6" if layout.samples >= 3 else b"P5"
+    out.write(magic + b"\n%d %d\n255\n" % (layout.width, layout.height))
+    for band in iterBands(tif_path, layout, bandRows):
+        out.write(band.tobytes())
+
+
+def encodeJpeg(tif_path, jpeg_path, quality, subsampling, bandRows):
+    """
+    Encode an uncompressed TIFF in JPEG in process. The memory used ISN'T bounded : the whole 8 bits picture is held
+    in memory (3 bytes by pixel), it's only the fallback used when cjpeg isn't installed.
+
+    :param tif_path: TIFF path.
+    :param jpeg_path: JPEG path.
+    :param quality: JPEG quality (1-100).
+    :param subsampling: Chroma subsampling ("4:4:4", "4:2:2" or "4:2:0").
+    :param bandRows: Rows converted at once.
+    """
+    layout = readLayout(tif_path)
+    picture = Image.new("RGB" if layout.samples >= 3 else "L", (layout.width, layout.height))
+    top = 0
+    for band in iterBands(tif_path, layout, bandRows):
+        picture.paste(Image.fromarray(band if band.shape[2] == 3 else band[:, :, 0]), (0, top))
+        top += len(band)
+    picture.save(jpeg_path, "JPEG", quality=quality, subsampling=subsampling)
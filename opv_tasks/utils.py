@@ -17,7 +17,12 @@
 # Description: Just a little workaround to launch cli command
 
 import sys
+import logging
+import importlib
 import subprocess
+from urllib.parse import urlparse
+
+from opv_tasks.task import TASKS, taskClassName
 
 
 def run_cli(cmd, args=[], stdout=sys.stdout, stderr=subprocess.STDOUT):
@@ -36,7 +41,32 @@ def run_cli(cmd, args=[], stdout=sys.stdout, stderr=subprocess.STDOUT):
     return ret.returncode
 
 
-def runTask(dm_c, db_c, task_name, inputData):
+def makeClients(db_rest, dir_manager):
+    """
+    Create the clients from their urls, sqlite:// and file:// urls select the local backend.
+
+    :param db_rest: API rest server url (http://opv_master:5000) or SQLite database (sqlite:///var/lib/opv/opv.db).
+    :param dir_manager: Directory manager url (http://opv_master:5005) or local directory (file:///var/lib/opv/directories).
+    :return: (directory manager client, db client)
+    """
+    if db_rest.startswith("sqlite://"):
+        from opv_tasks.localbackend import LocalRestClient
+        db_c = LocalRestClient(urlparse(db_rest).path or ":memory:")
+    else:
+        from opv_api_client import RestClient
+        db_c = RestClient(db_rest)
+
+    if dir_manager.startswith("file://"):
+        from opv_tasks.localbackend import LocalDirectoryManagerClient
+        dm_c = LocalDirectoryManagerClient(urlparse(dir_manager).path)
+    else:
+        from opv_directorymanagerclient import DirectoryManagerClient, Protocol
+        dm_c = DirectoryManagerClient(api_base=dir_manager, default_protocol=Protocol.FTP)
+
+    return dm_c, db_c
+
+
+def runTask(dm_c, db_c, task_name, inputData, journal=None, cache=None):
     """
     Run task.
     Return a TaskReturn.
@@ -45,22 +75,27 @@ def runTask(dm_c, db_c, task_name, inputData):
     if not Task:
         raise Exception('Task %s not found' % task_name)
 
-    task = Task(client_requestor=db_c, opv_directorymanager_client=dm_c)
+    task = Task(client_requestor=db_c, opv_directorymanager_client=dm_c, journal=journal, cache=cache)
     return task.run(options=inputData)
 
 
 def find_task(taskName):
-    """Find the task with taskName."""
+    """Find the task with taskName, only the module of this task is imported."""
+    if taskName not in TASKS:
+        return None  # Task not found
+
     try:
-        moduleTask = __import__("opv_tasks.task.{}task".format(taskName))
-        task = getattr(moduleTask, "{}Task".format(taskName.title()))
-        return task
+        moduleTask = importlib.import_module(TASKS[taskName])
+        return getattr(moduleTask, taskClassName(taskName))
     except (ImportError, AttributeError) as e:
+        logging.getLogger(__name__).warning("Task %s is unavailable : %s" % (taskName, e))
         return None  # Task not found
 
 
 def generateHelp(taskName):
     Task = find_task(taskName)
+    if Task is None:
+        return "    " + taskName + ' ' * (16 - len(taskName)) + "Unavailable, missing dependencies."
     lines = Task.__doc__.split("\n")
     lines = [l for l in lines if not l.isspace() and '' != l]
     baseLeadingSpaces = len(lines[0]) - len(lines[0].lstrip(' '))
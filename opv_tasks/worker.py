@@ -0,0 +1,207 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: Resident worker taking task requests from a spool directory.
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import signal
+import socket
+import logging
+
+from path import Path
+
+from opv_tasks.utils import runTask
+from opv_tasks.task import TaskReturn, TaskStatusCode
+
+INCOMING_DIR = "incoming"   # Requests waiting for a worker
+RUNNING_DIR = "running"     # Requests claimed by the workers, in running/<worker id>/ while running/<worker id>.lock is held
+DONE_DIR = "done"           # TaskReturn of the processed requests
+
+
+def submit(spoolDir, taskName, inputData):
+    """
+    Add a task request to a spool directory.
+
+    :param spoolDir: The spool directory.
+    :param taskName: Name of the task to run.
+    :param inputData: Task input data.
+    :return: The request id, the TaskReturn will be written in spoolDir/done/<request id>.json
+    """
+    incoming = Path(spoolDir) / INCOMING_DIR
+    incoming.makedirs_p()
+
+    requestId = "{}-{}".format(int(time.time() * 1000), uuid.uuid4().hex)
+    tmpFile = incoming / ".{}.tmp".format(requestId)
+    with open(tmpFile, "w") as f:
+        json.dump({"task-name": taskName, "input-data": inputData}, f)
+    os.rename(tmpFile, incoming / "{}.json".format(requestId))  # atomic, workers never see partial requests
+
+    return requestId
+
+
+class Worker:
+    """
+    Stay resident and run the tasks requested in a spool directory, the clients and imported tasks are kept warm.
+    Many workers can share the same spool directory, a request is claimed with an atomic rename.
+    Each worker holds a lock file (flock) and moves the requests it claims in it's own running directory : when a worker
+    dies (even killed) it's lock is released and the requests it was running are put back in incoming by the next
+    worker started on the spool (see recover).
+    """
+
+    def __init__(self, dm_c, db_c, spoolDir, pollInterval=0.5, journal=None, cache=None):
+        """
+        Create a worker.
+
+        :param dm_c: The directory manager client.
+        :param db_c: The db client.
+        :param spoolDir: The spool directory.
+        :param pollInterval: Time to wait between two scans of an empty spool (in seconds).
+        :param journal: Optional Journal given to the tasks, to resume pipelines.
+        :param cache: Optional ResultCache given to the tasks.
+        """
+        self._dm_c = dm_c
+        self._db_c = db_c
+        self._journal = journal
+        self._cache = cache
+        self.pollInterval = pollInterval
+        self.logger = logging.getLogger("opv_task." + self.__class__.__name__)
+
+        self.spoolDir = Path(spoolDir)
+        self.incoming = self.spoolDir / INCOMING_DIR
+        self.running = self.spoolDir / RUNNING_DIR
+        self.done = self.spoolDir / DONE_DIR
+        for d in [self.incoming, self.running, self.done]:
+            d.makedirs_p()
+
+        self.workerId = "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.claimDir = self.running / self.workerId
+        self._lock = self._lockFile()
+
+        self.stopped = False
+
+    def _lockFile(self):
+        """Create and lock the lock file of the worker, it's only visible once locked so it's never taken for a dead worker's."""
+        tmpFile = self.running / ".{}.tmp".format(self.workerId)
+        fd = os.open(tmpFile, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self.claimDir.makedirs_p()
+        os.rename(tmpFile, self.running / "{}.lock".format(self.workerId))
+        return fd
+
+    def recover(self):
+        """
+        Put back in incoming the requests of the dead workers (their lock file isn't locked anymore).
+
+        :return: The number of requests recovered.
+        """
+        recovered = 0
+        for lockFile in self.running.files("*.lock"):
+            workerId = lockFile.namebase
+            if workerId == self.workerId:
+                continue
+            try:
+                fd = os.open(lockFile, os.O_RDWR)
+            except FileNotFoundError:
+                continue    # recovered by another worker
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue    # the worker is alive
+
+            try:
+                claimDir = self.running / workerId
+                if claimDir.isdir():
+                    for request in claimDir.files("*.json"):
+                        self.logger.warning("Request %s of the dead worker %s put back in incoming" % (request.basename(), workerId))
+                        os.rename(request, self.incoming / request.basename())
+                        recovered += 1
+                    claimDir.rmtree_p()
+                lockFile.remove_p()
+            finally:
+                os.close(fd)
+        return recovered
+
+    def claim(self):
+        """
+        Claim the oldest request.
+
+        :return: Path of the claimed request (in the running directory of the worker) or None if there is no request.
+        """
+        for request in sorted(self.incoming.files("*.json")):
+            claimed = self.claimDir / request.basename()
+            try:
+                os.rename(request, claimed)
+            except FileNotFoundError:
+                continue    # claimed by another worker
+            return claimed
+        return None
+
+    def process(self, request):
+        """
+        Run a claimed request and write it's TaskReturn in the done directory.
+
+        :param request: Path of the claimed request.
+        """
+        with open(request) as f:
+            data = json.load(f)
+
+        taskName = data["task-name"]
+        requestId = os.path.splitext(request.basename())[0]
+        self.logger.info("Running task %s (%s)" % (taskName, requestId))
+        try:
+            taskReturn = runTask(self._dm_c, self._db_c, taskName, data["input-data"], journal=self._journal, cache=self._cache)
+        except Exception as e:
+            self.logger.exception("Task %s crashed" % taskName)
+            taskReturn = TaskReturn(taskName=taskName, statusCode=TaskStatusCode.ERROR, inputData=data["input-data"], error=repr(e))
+
+        if not taskReturn.isSuccess():
+            self.logger.error("Task %s failed with following error : %s" % (taskName, taskReturn.error))
+
+        tmpFile = self.done / ".{}.tmp".format(requestId)
+        with open(tmpFile, "w") as f:
+            f.write(taskReturn.toJSON())
+        os.rename(tmpFile, self.done / request.basename())
+        request.remove()
+
+    def stop(self, *args):
+        """Stop the worker once the current request is processed."""
+        self.logger.info("Stopping worker")
+        self.stopped = True
+
+    def serve(self):
+        """Process requests until the worker is stopped (SIGTERM/SIGINT)."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.logger.info("Worker %s waiting for requests in %s" % (self.workerId, self.spoolDir))
+        self.recover()
+        while not self.stopped:
+            request = self.claim()
+            if request is None:
+                time.sleep(self.pollInterval)
+                continue
+            self.process(request)
+        self.close()
+
+    def close(self):
+        """Remove the running directory and the lock file of the worker, it must not be running a request."""
+        self.claimDir.rmtree_p()
+        (self.running / "{}.lock".format(self.workerId)).remove_p()
+        os.close(self._lock)
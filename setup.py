@@ -20,7 +20,7 @@ from setuptools import setup, find_packages
 setup(
     name='opv_tasks',
     version='0.0.1',
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     author="Christophe NOUCHET",
     author_email="team@openpathview.fr",
     description="Open Path View Tasks",
@@ -0,0 +1,77 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The result cache is keyed by content, gives back the stored files and evicts the least recently used entries.
+
+import os
+
+from path import Path
+
+from opv_tasks.cache import ResultCache
+
+
+def write(path, content):
+    path = Path(path)
+    path.dirname().makedirs_p()
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_key(tmpdir):
+    cache = ResultCache(tmpdir.join("cache"))
+    a = write(tmpdir.join("a", "project.pto"), b"p f2 w3000")
+    b = write(tmpdir.join("b", "other.pto"), b"p f2 w3000")
+    c = write(tmpdir.join("c.pto"), b"p f2 w4000")
+
+    assert cache.key("stitch", files=[a], options=[92]) == cache.key("stitch", files=[b], options=[92])
+    assert cache.key("stitch", files=[a], options=[92]) != cache.key("stitch", files=[c], options=[92])
+    assert cache.key("stitch", files=[a], options=[92]) != cache.key("stitch", files=[a], options=[90])
+    assert cache.key("stitch", files=[a]) != cache.key("tiling", files=[a])
+    assert cache.key("stitch", files=[a, c]) != cache.key("stitch", files=[c, a])
+
+
+def test_storeFetch(tmpdir):
+    cache = ResultCache(tmpdir.join("cache"))
+    panorama = write(tmpdir.join("result", "panorama.jpg"), b"jpeg")
+    write(tmpdir.join("result", "tiles", "0", "0.jpg"), b"tile")
+    key = cache.key("tiling", files=[panorama])
+
+    destination = Path(tmpdir.join("destination"))
+    assert not cache.fetch(key, destination)
+
+    cache.store(key, [panorama, tmpdir.join("result", "tiles")])
+    cache.store(key, [panorama])    # already stored, kept as is
+    assert cache.fetch(key, destination)
+    assert open(destination / "panorama.jpg", "rb").read() == b"jpeg"
+    assert open(destination / "tiles" / "0" / "0.jpg", "rb").read() == b"tile"
+    assert [d.basename() for d in Path(cache.directory).dirs()] == [key]
+
+
+def test_evict(tmpdir):
+    cache = ResultCache(tmpdir.join("cache"), maxSize=250)
+    keys = []
+    for i in range(3):
+        result = write(tmpdir.join(str(i), "panorama.jpg"), b"x" * 100)
+        keys.append(cache.key("stitch", options=[i]))
+        cache.store(keys[-1], [result])
+        os.utime(cache.directory / keys[-1], (i, i))    # stored in order
+
+    # the 2 newest fit
+    assert sorted(d.basename() for d in cache.directory.dirs()) == sorted(keys[1:])
+
+    assert cache.fetch(keys[1], tmpdir.join("out"))     # used, newer than keys[2]
+    cache.store(cache.key("stitch", options=[3]), [tmpdir.join("0", "panorama.jpg")])
+    assert sorted(d.basename() for d in cache.directory.dirs()) == sorted([keys[1], cache.key("stitch", options=[3])])
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The commands output is logged by batches, timed out or failed commands are killed.
+
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from opv_tasks.commandrunner import CommandRunner
+
+
+class Records(logging.Handler):
+    """Collect the records of a logger, they are logged by the listener thread."""
+
+    def __init__(self, name):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.logger.addHandler(self)
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage(), time.monotonic()))
+
+    def wait(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.records) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.records
+
+
+@pytest.fixture
+def records(request):
+    records = Records("opv_test." + request.node.name)
+    yield records
+    records.logger.removeHandler(records)
+
+
+def test_batches(records):
+    runner = CommandRunner(batchLines=10)
+    assert runner.run(["sh", "-c", "seq 1 25; echo warning >&2"], records.logger) == 0
+
+    messages = records.wait(4)
+    assert sorted((level, message.count("\n") + 1) for level, message, _ in messages) == \
+        [(logging.INFO, 5), (logging.INFO, 10), (logging.INFO, 10), (logging.WARNING, 1)]
+    assert "\n".join(m for level, m, _ in messages if level == logging.INFO).split("\n") == [str(i) for i in range(1, 26)]
+
+
+def test_quietCommandIsLogged(records):
+    runner = CommandRunner(batchInterval=0.2)
+    start = time.monotonic()
+    assert runner.run(["sh", "-c", "echo started; sleep 1.5"], records.logger) == 0
+
+    level, message, loggedAt = records.wait(1)[0]
+    assert message == "started" and loggedAt - start < 1.0     # before the command ends
+
+
+def test_failureDumpsOutput(records):
+    records.logger.setLevel(logging.ERROR)
+    assert CommandRunner().run(["sh", "-c", "echo step 1; echo step 2; exit 3"], records.logger) == 3
+    assert records.wait(1)[0][:2] == (logging.ERROR, "sh failed with code 3, last output lines :\nstep 1\nstep 2")
+
+
+def test_timeout(records):
+    start = time.monotonic()
+    assert CommandRunner().run(["sh", "-c", "sleep 30 & sleep 30"], records.logger, timeout=0.3) < 0
+    assert time.monotonic() - start < 5    # the child of the command is killed too, its pipes are closed
+
+
+def test_onStartFailureKillsCommand(records):
+    pids = []
+
+    def onStart(pid):
+        pids.append(pid)
+        raise RuntimeError("no slot")
+
+    with pytest.raises(RuntimeError):
+        CommandRunner().run(["sleep", "30"], records.logger, onStart=onStart)
+    with pytest.raises(OSError):     # killed and reaped
+        os.kill(pids[0], 0)
+
+
+def test_feed(records):
+    def feed(pipe):
+        for _ in range(100):
+            pipe.write(b"x" * 100000)
+
+    assert CommandRunner().run(["wc", "-c"], records.logger, feed=feed) == 0
+    assert records.wait(1)[0][1].strip() == "10000000"
+
+    # the command stops reading, its return code is kept
+    assert CommandRunner().run(["sh", "-c", "exit 4"], records.logger, feed=feed) == 4
+
+
+def test_concurrentRuns(records):
+    runner = CommandRunner()
+    with ThreadPoolExecutor(8) as executor:
+        codes = list(executor.map(lambda i: runner.run(["sh", "-c", "echo %d; exit %d" % (i, i % 3)], records.logger), range(16)))
+    assert codes == [i % 3 for i in range(16)]
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The "in" queries are split in chunks and give the same ressources as a single query.
+
+import threading
+
+from opv_tasks.concurrency import fetchConcurrently, makeAllIn
+
+
+class Client:
+    """make_all over a list of tile ids, records the ids of each query."""
+
+    def __init__(self, count):
+        self.tiles = [{"id_tile": i, "id_malette": 1, "even": i % 2 == 0} for i in range(count)]
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def make_all(self, kind, filters=()):
+        with self._lock:
+            self.queries.append(filters[-1][1])
+        return [t for t in self.tiles if all(t[name] in values for name, values in filters)]
+
+
+def inFilter(name):
+    return lambda ids: (name, ids)
+
+
+def test_fetchConcurrently():
+    assert fetchConcurrently(lambda i: i * 2, range(50), maxWorkers=8) == list(range(0, 100, 2))
+    assert fetchConcurrently(lambda i: i * 2, [3], maxWorkers=8) == [6]
+
+
+def test_makeAllIn():
+    client = Client(30)
+    ids = list(range(25)) + [3, 4, 99]
+    tiles = makeAllIn(client, "Tile", inFilter("id_tile"), ids, filters=(("even", [True]),), chunkSize=4)
+
+    assert [t["id_tile"] for t in tiles] == list(range(0, 25, 2))
+    assert sorted(len(q) for q in client.queries) == [2] + [4] * 6
+    assert sorted(i for q in client.queries for i in q) == list(range(25)) + [99]
+
+
+def test_makeAllInWithoutIds():
+    client = Client(3)
+    assert makeAllIn(client, "Tile", inFilter("id_tile"), []) == []
+    assert client.queries == []
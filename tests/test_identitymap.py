@@ -0,0 +1,73 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The identity map fetches each ressource once, saved ressources are fetched again.
+
+from opv_tasks.identitymap import IdentityMapClient
+from opv_tasks.localbackend import LocalRestClient
+from opv_tasks.task.task import Task
+
+
+def lotClient():
+    client = LocalRestClient()
+    for i in range(3):
+        lot = client.make("Lot")
+        lot.pictures_path = "/lot%d" % i
+        lot.create()
+    client.requests.clear()
+    return client
+
+
+def test_make():
+    client = lotClient()
+    identityMap = IdentityMapClient(client)
+
+    lot = identityMap.make("Lot", 1, 1)
+    assert identityMap.make("Lot", 1, id_malette=1) is lot
+    assert identityMap.make("Lot", 2, 1) is not lot
+    assert lot.pictures_path == "/lot0" and identityMap.make("Lot", 1, 1).pictures_path == "/lot0"
+    assert client.requests["GET"] == 1
+    assert identityMap.make("Lot") is not identityMap.make("Lot")     # no id, never cached
+    assert identityMap.identityMap is identityMap and identityMap.requests is client.requests
+
+
+def test_invalidate():
+    client = lotClient()
+    identityMap = IdentityMapClient(client)
+    lot = identityMap.make("Lot", 1, 1)
+
+    identityMap.invalidate(lot)
+    assert identityMap.make("Lot", 1, 1) is not lot
+
+    other = client.make("Lot", 2, 1)
+    identityMap.register(other)
+    assert identityMap.make("Lot", 2, 1) is other
+    identityMap.clear()
+    assert identityMap.make("Lot", 2, 1) is not other
+
+
+def test_flush():
+    client = lotClient()
+    task = Task(client, None)
+    lot = task._identity_map.make("Lot", 1, 1)
+    lot.pictures_path = "/moved"
+    for _ in range(100):
+        task._save(lot)
+    task._save(task._identity_map.make("Lot", 2, 1))
+
+    task._flush()
+    assert client.requests["PUT"] == 2
+    fetched = task._identity_map.make("Lot", 1, 1)
+    assert fetched is not lot and fetched.pictures_path == "/moved"
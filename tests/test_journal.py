@@ -0,0 +1,73 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The journal gives back the completed stages of a pipeline, the scheduler skips them.
+
+from opv_tasks import scheduler
+from opv_tasks.journal import Journal
+from opv_tasks.scheduler import TaskScheduler, artifactsFromInput
+from opv_tasks.task import TaskReturn, TaskStatusCode
+
+
+def success(taskName, outputData):
+    return TaskReturn(taskName=taskName, outputData=outputData)
+
+
+def failure(taskName):
+    return TaskReturn(taskName=taskName, statusCode=TaskStatusCode.ERROR, error="failed")
+
+
+def test_key():
+    assert Journal.key({"id_lot": 1, "id_malette": 2}) == Journal.key({"id_malette": 2, "id_lot": 1})
+
+
+def test_completed(tmpdir):
+    journal = Journal(tmpdir.join("journal.jsonl"))
+    lot1, lot2 = Journal.key({"id_lot": 1, "id_malette": 1}), Journal.key({"id_lot": 2, "id_malette": 1})
+    assert journal.completed(lot1) == {}
+
+    journal.record(lot1, success("rotate", {"id_lot": 1, "id_malette": 1}))
+    journal.record(lot1, failure("cpfind"))
+    journal.record(lot2, success("cpfind", {"id_cp": 20, "id_malette": 1}))
+    journal.record(lot1, success("stitch", {"id_panorama": 10, "id_malette": 1}))
+    journal.record(lot1, failure("stitch"))  # the last record of a stage wins
+
+    completed = journal.completed(lot1)
+    assert set(completed) == {"rotate"}
+    assert completed["rotate"].outputData == {"id_lot": 1, "id_malette": 1}
+    assert set(Journal(tmpdir.join("journal.jsonl")).completed(lot2)) == {"cpfind"}
+
+
+def test_schedulerResume(tmpdir, monkeypatch):
+    tasks = {name: type(name, (), {"inputs": [i], "outputs": [o]})
+             for name, i, o in [("rotate", "lot", "rotated_lot"), ("cpfind", "rotated_lot", "cp"), ("stitch", "cp", "panorama")]}
+    runs = []
+
+    def runTask(dm_c, db_c, taskName, inputData, cache=None):
+        runs.append((taskName, inputData))
+        return success(taskName, {"id_" + taskName: 2, "id_malette": 1})
+
+    monkeypatch.setattr(scheduler, "find_task", tasks.get)
+    monkeypatch.setattr(scheduler, "runTask", runTask)
+
+    inputData = {"id_lot": 1, "id_malette": 1}
+    journal, key = Journal(tmpdir.join("journal.jsonl")), Journal.key(inputData)
+    journal.record(key, success("rotate", {"id_rotate": 1, "id_malette": 1}))
+    journal.record(key, success("cpfind", {"id_cpfind": 1, "id_malette": 1}))
+
+    taskReturns = TaskScheduler(None, object(), list(tasks), journal=journal, journalKey=key).run(artifactsFromInput(inputData))
+    assert runs == [("stitch", {"id_cpfind": 1, "id_malette": 1})]
+    assert set(taskReturns) == set(tasks)
+    assert set(journal.completed(key)) == set(tasks)
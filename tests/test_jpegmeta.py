@@ -0,0 +1,167 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The metadata written by jpegmeta are read back by PIL, the picture data is left untouched.
+
+import io
+import struct
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from opv_tasks import jpegmeta
+
+GPS_IFD_TAG = 0x8825
+MAKE_TAG = 0x010F
+MODEL_TAG = 0x0110
+EXIF_IFD_TAG = 0x8769
+DATETIME_ORIGINAL_TAG = 0x9003
+
+
+def jpegBytes(width=64, height=32):
+    """A small picture, not a flat color so the scan data is meaningful."""
+    pixels = (np.arange(width * height * 3).reshape(height, width, 3) * 7 % 256).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def exifWithThumbnail(thumbnail):
+    """
+    Exif payload (little endian) with Make and Model in IFD0, DateTimeOriginal in the Exif IFD and a JPEG
+    thumbnail in IFD1, written by hand.
+    """
+    make, model, date = b"OPV\x00", b"Camera model\x00", b"2017:01:01 10:00:00\x00"
+    ifd0 = 8
+    ifd0Size = 2 + 3 * 12 + 4
+    exifIfd = ifd0 + ifd0Size
+    exifIfdSize = 2 + 12 + 4
+    ifd1 = exifIfd + exifIfdSize
+    ifd1Size = 2 + 2 * 12 + 4
+    data = ifd1 + ifd1Size
+    modelOffset, dateOffset = data, data + len(model)
+    thumbnailOffset = dateOffset + len(date)
+
+    tiff = b"II*\x00" + struct.pack("<I", ifd0)
+    tiff += struct.pack("<H", 3)
+    tiff += struct.pack("<HHI4s", MAKE_TAG, 2, len(make), make)
+    tiff += struct.pack("<HHII", MODEL_TAG, 2, len(model), modelOffset)
+    tiff += struct.pack("<HHII", EXIF_IFD_TAG, 4, 1, exifIfd)
+    tiff += struct.pack("<I", ifd1)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", DATETIME_ORIGINAL_TAG, 2, len(date), dateOffset) + struct.pack("<I", 0)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", jpegmeta.THUMBNAIL_OFFSET_TAG, 4, 1, thumbnailOffset)
+    tiff += struct.pack("<HHII", jpegmeta.THUMBNAIL_LENGTH_TAG, 4, 1, len(thumbnail))
+    tiff += struct.pack("<I", 0)
+    tiff += model + date + thumbnail
+    return jpegmeta.EXIF_HEADER + tiff
+
+
+def toDecimal(dms):
+    return float(dms[0]) + float(dms[1]) / 60 + float(dms[2]) / 3600
+
+
+def scanData(path):
+    """Bytes of the picture data (from the start of scan segment)."""
+    with open(path, "rb") as f:
+        segments = list(jpegmeta.readSegments(f))
+        f.seek(segments[-1][1] - 4)
+        return f.read()
+
+
+@pytest.fixture
+def panorama(tmpdir):
+    path = str(tmpdir.join("panorama.jpg"))
+    with open(path, "wb") as f:
+        f.write(jpegBytes())
+    return path
+
+
+@pytest.mark.parametrize("value, expected", [
+    (151.2, ((151, 1), (12, 1), (0, 100000))),
+    (48.3904, ((48, 1), (23, 1), (2544000, 100000))),
+    (-4.999999999, ((5, 1), (0, 1), (0, 100000))),
+    (0.0, ((0, 1), (0, 1), (0, 100000)))
+])
+def test_toDegreesMinutesSeconds(value, expected):
+    assert jpegmeta.toDegreesMinutesSeconds(value) == expected
+
+
+def test_readSize(panorama):
+    assert jpegmeta.readSize(panorama) == Image.open(panorama).size
+
+
+def test_writePhotosphereMetadata(panorama):
+    pixels = np.asarray(Image.open(panorama))
+    jpegmeta.writePhotosphereMetadata(panorama, [-33.8568, 151.2153, 12.5])
+
+    image = Image.open(panorama)
+    gps = image._getexif()[GPS_IFD_TAG]
+    assert gps[1] == "S" and gps[3] == "E"
+    assert toDecimal(gps[2]) == pytest.approx(33.8568, abs=1e-7)
+    assert toDecimal(gps[4]) == pytest.approx(151.2153, abs=1e-7)
+    assert gps[5] in (0, b"\x00") and float(gps[6]) == pytest.approx(12.5)
+    assert (np.asarray(image) == pixels).all()
+
+    xmp = ET.fromstring(image.info["xmp"].split(b"?>", 1)[1].rsplit(b"<?xpacket", 1)[0])
+    description = xmp.find(".//{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description")
+    gpano = {name.split("}")[1]: value for name, value in description.attrib.items() if name.startswith("{" + jpegmeta.GPANO_NS)}
+    assert gpano == {"ProjectionType": "equirectangular", "CroppedAreaImageWidthPixels": "64", "CroppedAreaImageHeightPixels": "32",
+                     "CroppedAreaLeftPixels": "0", "CroppedAreaTopPixels": "0", "FullPanoWidthPixels": "64", "FullPanoHeightPixels": "32"}
+    assert jpegmeta.hasGPano(panorama)
+
+
+def test_writeMetadataKeepsPictureData(panorama):
+    before = scanData(panorama)
+    jpegmeta.writePhotosphereMetadata(panorama, [48.3904, -4.4861])
+    assert scanData(panorama) == before
+
+
+def test_writeMetadataKeepsExif(tmpdir):
+    thumbnail = jpegBytes(16, 8)
+    path = str(tmpdir.join("panorama.jpg"))
+    Image.open(io.BytesIO(jpegBytes())).save(path, "JPEG", exif=exifWithThumbnail(thumbnail))
+
+    jpegmeta.writePhotosphereMetadata(path, [48.3904, -4.4861, 30])
+
+    image = Image.open(path)
+    exif = image._getexif()
+    assert exif[MAKE_TAG] == "OPV" and exif[MODEL_TAG] == "Camera model"
+    assert exif[DATETIME_ORIGINAL_TAG] == "2017:01:01 10:00:00"
+    assert toDecimal(exif[GPS_IFD_TAG][2]) == pytest.approx(48.3904, abs=1e-7)
+
+    tiff = jpegmeta.readMetadata(path)[0][len(jpegmeta.EXIF_HEADER):]
+    order = "<" if tiff[:2] == b"II" else ">"
+    _, ifd1 = jpegmeta.readIfd(tiff, struct.unpack(order + "I", tiff[4:8])[0], order)
+    entries, _ = jpegmeta.readIfd(tiff, ifd1, order)
+    offset = jpegmeta._pointer(entries, jpegmeta.THUMBNAIL_OFFSET_TAG, order)
+    length = jpegmeta._pointer(entries, jpegmeta.THUMBNAIL_LENGTH_TAG, order)
+    assert tiff[offset:offset + length] == thumbnail
+
+
+def test_rewriteReplacesMetadata(panorama):
+    jpegmeta.writePhotosphereMetadata(panorama, [10.0, 20.0, 5])
+    exif, xmp = jpegmeta.readMetadata(panorama)
+    jpegmeta.writePhotosphereMetadata(panorama, [11.0, 21.0, 5])
+
+    newExif, newXmp = jpegmeta.readMetadata(panorama)
+    assert len(newExif) == len(exif) and newXmp == xmp
+    gps = Image.open(panorama)._getexif()[GPS_IFD_TAG]
+    assert toDecimal(gps[2]) == pytest.approx(11.0) and toDecimal(gps[4]) == pytest.approx(21.0)
+    with open(panorama, "rb") as f:
+        app1 = [f.read(length)[:6] for marker, _, length in jpegmeta.readSegments(f) if marker == jpegmeta.APP1]
+    assert len(app1) == 2
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The local backend stores the ressources and their relations, and applies the API filters.
+
+import pytest
+
+from opv_tasks.localbackend import LocalRestClient, LocalDirectoryManagerClient, RessourceNotFoundException, \
+    UnsupportedFilterException, distance, idKey
+
+
+class FilterObject:
+    """Filter of the API client, Filter("id_lot") == 1 gives an object with name, op and val."""
+
+    def __init__(self, name, op, val):
+        self.name, self.op, self.val = name, op, val
+
+
+def create(client, kind, **data):
+    ressource = client.make(kind)
+    for name, value in data.items():
+        setattr(ressource, name, value)
+    ressource.create()
+    return ressource
+
+
+@pytest.fixture
+def client():
+    return LocalRestClient()
+
+
+@pytest.fixture
+def campaign(client):
+    """A campaign with 3 lots along a line (about 111m between them), the last one without sensors."""
+    campaign = create(client, "Campaign", name="test")
+    for i in range(3):
+        sensors = create(client, "Sensors", gps_pos={"coordinates": [48.0 + i * 0.001, -4.0, 10]}) if i < 2 else None
+        lot = create(client, "Lot", campaign=campaign, sensors=sensors, pictures_path="/lot%d" % i)
+        create(client, "Cp", lot=lot, stichable=i != 1, search_algo_version="0.0.1", nb_cp=10 * i)
+    return campaign
+
+
+def test_idKey():
+    assert idKey("Lot") == "id_lot"
+    assert idKey("PathDetails") == "id_path_details"
+    assert idKey("TrackEdge") == "id_track_edge"
+
+
+def test_distance():
+    assert distance([48.0, -4.0], [48.0, -4.0]) == 0
+    assert distance([48.0, -4.0], [48.001, -4.0]) == pytest.approx(111.2, abs=0.1)
+
+
+def test_createGetSave(client):
+    lot = create(client, "Lot", pictures_path="/data/lot")
+    assert lot.id == {"id_lot": 1, "id_malette": LocalRestClient.DEFAULT_MALETTE}
+    assert create(client, "Lot").id_lot == 2
+
+    same = client.make("Lot", lot.id_lot, lot.id_malette)
+    assert same.pictures_path == "/data/lot" and same == lot and hash(same) == hash(lot)
+    same.pictures_path = "/data/moved"
+    same.save()
+    assert lot.get().pictures_path == "/data/moved"
+    assert client.requests["POST"] == 2 and client.requests["PUT"] == 1
+
+    with pytest.raises(RessourceNotFoundException):
+        client.make("Lot", 42, 1).get()
+
+
+def test_relations(client, campaign):
+    lots = campaign.lots
+    assert len(lots) == 3
+    lot = lots[0]
+    assert lot.campaign == campaign
+    assert lot.sensors.gps_pos["coordinates"] == [48.0, -4.0, 10]
+    assert lot.id_campaign == campaign.id_campaign and lot.id_campaign_malette == campaign.id_malette
+    cp = lot.cps[0]
+    assert cp.lot == lot and cp.id_lot == lot.id_lot
+
+
+def test_filters(client, campaign):
+    def ids(kind, filters):
+        return [r[idKey(kind)] for r in client.make_all(kind, filters=filters)]
+
+    assert ids("Cp", ()) == [1, 2, 3]
+    assert ids("Cp", {"name": "stichable", "op": "==", "val": True}) == [1, 3]
+    assert ids("Cp", [FilterObject("stichable", "==", True), FilterObject("nb_cp", ">=", 10)]) == [3]
+    assert ids("Cp", {"name": "id_lot", "op": "in", "val": [1, 2]}) == [1, 2]
+    assert ids("Cp", {"name": "nb_cp", "op": "!=", "val": 10}) == [1, 3]
+    assert ids("Lot", FilterObject("id_campaign", "==", campaign.id_campaign)) == [1, 2, 3]
+    assert ids("Lot", FilterObject("id_sensors", "<", 2)) == [1]
+
+
+def test_withinFilter(client, campaign):
+    def within(sensors, maxDistance):
+        return [s.id_sensors for s in client.make_all("Sensors", filters={"name": "within", "val": ([sensors, 1], maxDistance)})]
+
+    assert within(1, 50) == [1]
+    assert within(1, 120) == [1, 2]
+    assert within(2, 120) == [1, 2]
+    with pytest.raises(RessourceNotFoundException):
+        within(42, 120)
+
+
+def test_unsupportedFilters(client, campaign):
+    with pytest.raises(UnsupportedFilterException):
+        client.make_all("Cp", filters={"name": "nb_cp", "op": "like", "val": "1%"})
+    with pytest.raises(UnsupportedFilterException):
+        client.make_all("Cp", filters={"name": "within", "val": 12})
+    with pytest.raises(UnsupportedFilterException):
+        client.make_all("Cp", filters=[object()])
+
+
+def test_panoramaSensors(client, campaign):
+    cp = client.make("Cp", 1, 1)
+    create(client, "Panorama", cp=cp, equirectangular_path="uuid", is_photosphere=False)
+    view = client.make_all("PanoramaSensors", filters=FilterObject("id_campaign", "==", campaign.id_campaign))
+    assert len(view) == 1
+    assert view[0].id_panorama == 1 and view[0].original_gps_pos["coordinates"] == [48.0, -4.0, 10]
+    assert (view[0].original_id_sensors, view[0].original_id_malette) == (1, 1)
+
+
+def test_persistence(tmpdir):
+    database = str(tmpdir.join("opv.db"))
+    create(LocalRestClient(database), "Lot", pictures_path="/data/lot")
+    assert LocalRestClient(database).make("Lot", 1, 1).pictures_path == "/data/lot"
+
+
+def test_directoryManager(tmpdir):
+    manager = LocalDirectoryManagerClient(tmpdir.join("directories"))
+    with manager.Open() as (uuid, path):
+        with open(path + "/panorama.jpg", "w") as f:
+            f.write("jpeg")
+    with manager.Open(uuid) as (sameUuid, samePath):
+        assert sameUuid == uuid and open(samePath + "/panorama.jpg").read() == "jpeg"
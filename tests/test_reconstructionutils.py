@@ -0,0 +1,55 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The vectorized shots computations (osfmsave) match the per shot ones.
+
+import numpy as np
+
+from opv_tasks.third_party.reconstructionUtils import ReconstructionUtils
+
+
+def shots():
+    """Random shots."""
+    rng = np.random.RandomState(42)
+    rotations = rng.uniform(-np.pi, np.pi, size=(50, 3))
+    translations = rng.uniform(-10, 10, size=(50, 3))
+    return rotations, translations
+
+
+def test_opticalCenters():
+    utils = ReconstructionUtils()
+    rotations, translations = shots()
+    expected = [utils.opticalCenter({"rotation": list(r), "translation": list(t)}) for r, t in zip(rotations, translations)]
+    np.testing.assert_allclose(utils.opticalCenters(rotations, translations), expected, rtol=0, atol=1e-12)
+
+
+def test_getImagesOrientationVectors():
+    utils = ReconstructionUtils()
+    rotations, translations = shots()
+    expected = [utils.getImageOrientationVector({"rotation": list(r), "translation": list(t)}) for r, t in zip(rotations, translations)]
+    np.testing.assert_allclose(utils.getImagesOrientationVectors(rotations, translations), expected, rtol=0, atol=1e-12)
+
+
+def test_rotateAll():
+    utils = ReconstructionUtils()
+    rotations, translations = shots()
+    expected = [utils.rotate(t, r) for r, t in zip(rotations, translations)]
+    np.testing.assert_allclose(utils.rotateAll(translations, rotations), expected, rtol=0, atol=1e-12)
+
+
+def test_rotateAllWithoutRotation():
+    # the per shot rotate gives nan there, the vectors are left as they are
+    vectors = np.array([[1.0, 2.0, 3.0], [-4.0, 5.0, 0.5]])
+    np.testing.assert_allclose(ReconstructionUtils().rotateAll(vectors, np.zeros((2, 3))), vectors)
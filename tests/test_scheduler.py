@@ -0,0 +1,141 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The scheduler runs the tasks in the order of their artifacts, each branch with its own identity map.
+
+import threading
+
+import pytest
+
+from opv_tasks import scheduler
+from opv_tasks.scheduler import TaskScheduler, artifactsFromInput
+from opv_tasks.identitymap import IdentityMapClient
+from opv_tasks.task import TaskReturn, TaskStatusCode
+
+
+def fakeTask(inputs, outputs):
+    return type("FakeTask", (), {"inputs": inputs, "outputs": outputs})
+
+
+# Same shape as the makeall pipeline : photosphere and tiling both use the panorama, tiling must wait for photosphere
+TASKS = {
+    "rotate": fakeTask(["lot"], ["rotated_lot"]),
+    "cpfind": fakeTask(["rotated_lot"], ["cp"]),
+    "stitch": fakeTask(["cp"], ["panorama"]),
+    "photosphere": fakeTask(["panorama"], ["photosphere"]),
+    "tiling": fakeTask(["photosphere"], ["tile"]),
+    "thumbnail": fakeTask(["panorama"], ["thumbnail"]),
+}
+
+
+class Runs:
+    """Fake runTask recording the runs, the failing tasks return an error."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.order = []
+        self.maps = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, dm_c, db_c, taskName, inputData, cache=None):
+        with self._lock:
+            self.order.append(taskName)
+            self.maps[taskName] = db_c
+        if taskName in self.failing:
+            return TaskReturn(taskName=taskName, statusCode=TaskStatusCode.ERROR, inputData=inputData, error="failed")
+        return TaskReturn(taskName=taskName, inputData=inputData, outputData={"id_" + taskName: 1, "id_malette": 1})
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    monkeypatch.setattr(scheduler, "find_task", TASKS.get)
+    runs = Runs()
+    monkeypatch.setattr(scheduler, "runTask", runs)
+    return runs
+
+
+def schedule(taskNames, maxWorkers=4):
+    return TaskScheduler(None, object(), taskNames, maxWorkers=maxWorkers)
+
+
+def test_artifactsFromInput():
+    assert artifactsFromInput({"id_lot": 1, "id_malette": 2}) == {"lot": {"id_lot": 1, "id_malette": 2}}
+    assert artifactsFromInput({"id_lot": 1}) == {}
+
+
+def test_order(runs):
+    taskReturns = schedule(list(TASKS)).run(artifactsFromInput({"id_lot": 1, "id_malette": 1}))
+
+    assert set(taskReturns) == set(TASKS)
+    assert all(r.isSuccess() for r in taskReturns.values())
+    position = {name: i for i, name in enumerate(runs.order)}
+    for name, Task in TASKS.items():
+        producers = [p for p, P in TASKS.items() if set(P.outputs) & set(Task.inputs)]
+        assert all(position[p] < position[name] for p in producers), name
+    assert taskReturns["tiling"].inputData == {"id_photosphere": 1, "id_malette": 1}
+
+
+def test_branchMaps(runs):
+    schedule(list(TASKS)).run(artifactsFromInput({"id_lot": 1, "id_malette": 1}))
+
+    maps = runs.maps
+    assert all(isinstance(m, IdentityMapClient) for m in maps.values())
+    # the chain shares a map, the second consumer of the panorama starts its own branch
+    assert maps["rotate"] is maps["cpfind"] is maps["stitch"]
+    assert (maps["photosphere"] is maps["stitch"]) != (maps["thumbnail"] is maps["stitch"])
+    assert maps["tiling"] is maps["photosphere"]
+    assert maps["photosphere"] is not maps["thumbnail"]
+
+
+def test_sequential(runs):
+    schedule(list(TASKS), maxWorkers=1).run(artifactsFromInput({"id_lot": 1, "id_malette": 1}))
+    assert runs.order[:3] == ["rotate", "cpfind", "stitch"] and len(runs.order) == len(TASKS)
+
+
+def test_failureSkipsConsumers(runs):
+    runs.failing = ["photosphere"]
+    taskReturns = schedule(list(TASKS)).run(artifactsFromInput({"id_lot": 1, "id_malette": 1}))
+
+    assert not taskReturns["photosphere"].isSuccess()
+    assert "tiling" not in taskReturns
+    assert taskReturns["thumbnail"].isSuccess()
+
+
+def test_recover(runs):
+    runs.failing = ["cpfind"]
+    recovered = []
+
+    def recover(taskName, taskReturn):
+        recovered.append(taskName)
+        return TaskReturn(taskName=taskName, outputData={"id_cp": 2, "id_malette": 1})
+
+    taskReturns = TaskScheduler(None, object(), ["rotate", "cpfind", "stitch"], recover=recover).run(
+        artifactsFromInput({"id_lot": 1, "id_malette": 1}))
+    assert recovered == ["cpfind"]
+    assert taskReturns["stitch"].inputData == {"id_cp": 2, "id_malette": 1}
+
+
+def test_undeclaredTask(monkeypatch):
+    monkeypatch.setattr(scheduler, "find_task", {"old": fakeTask(None, None)}.get)
+    with pytest.raises(Exception):
+        schedule(["old"])
+    with pytest.raises(Exception):
+        schedule(["unknown"])
+
+
+def test_sameArtifactProducers(monkeypatch):
+    monkeypatch.setattr(scheduler, "find_task", {"a": fakeTask(["lot"], ["cp"]), "b": fakeTask(["lot"], ["cp"])}.get)
+    with pytest.raises(Exception):
+        schedule(["a", "b"])
@@ -0,0 +1,98 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The stitchable cps index gives the same cps as a brute force search, built from the local backend.
+
+import random
+
+import pytest
+
+pytest.importorskip("opv_api_client")
+
+from opv_tasks.spatialindex import StitchableCpIndex, StitchableCpIndexes, campaignEntries, haversine
+from opv_tasks.localbackend import LocalRestClient
+
+
+def bruteForce(entries, lat, lon, maxDistance, excludeLot=None):
+    found = [(float(haversine(lat, lon, cpLat, cpLon)), cpKey) for cpKey, lotKey, cpLat, cpLon in entries if lotKey != excludeLot]
+    return sorted(r for r in found if r[0] <= maxDistance)
+
+
+def randomEntries(count):
+    rng = random.Random(4)
+    return [((i, 1), (i // 2, 1), 48.0 + rng.random() * 0.01, -4.0 + rng.random() * 0.01) for i in range(count)]
+
+
+@pytest.mark.parametrize("cellSize", [10, 50, 500])
+def test_nearest(cellSize):
+    entries = randomEntries(400)
+    index = StitchableCpIndex(cellSize=cellSize)
+    for entry in entries:
+        index.add(*entry)
+    assert len(index) == 400
+
+    for _, lotKey, lat, lon in entries[:20]:
+        for maxDistance in (20, 75, 300):
+            found = index.nearest(lat, lon, maxDistance, excludeLot=lotKey)
+            expected = bruteForce(entries, lat, lon, maxDistance, excludeLot=lotKey)
+            assert [key for _, key in found] == [key for _, key in expected]
+
+
+def test_addRemove():
+    index = StitchableCpIndex(cellSize=50)
+    assert index.nearest(48.0, -4.0, 100) == []
+
+    index.add((1, 1), (1, 1), 48.0, -4.0)
+    index.add((1, 1), (1, 1), 48.01, -4.0)     # moved
+    assert len(index) == 1 and index.nearest(48.0, -4.0, 100) == []
+    index.remove((1, 1))
+    index.remove((2, 1))
+    assert len(index) == 0 and index.nearest(48.01, -4.0, 100) == []
+
+
+def create(client, kind, **data):
+    ressource = client.make(kind)
+    for name, value in data.items():
+        setattr(ressource, name, value)
+    ressource.create()
+    return ressource
+
+
+def test_campaignEntries():
+    client = LocalRestClient()
+    campaign = create(client, "Campaign")
+    other = create(client, "Campaign")
+    positions = {}
+    for i in range(12):
+        sensors = create(client, "Sensors", gps_pos={"coordinates": [48.0 + i * 0.0005, -4.0, 0]}) if i % 4 else None
+        lot = create(client, "Lot", campaign=campaign if i < 10 else other, sensors=sensors)
+        cp = create(client, "Cp", lot=lot, stichable=i % 3 != 0)
+        if i % 4 and i % 3 and i < 10:
+            positions[(cp.id_cp, cp.id_malette)] = ((lot.id_lot, lot.id_malette), 48.0 + i * 0.0005, -4.0)
+
+    entries = campaignEntries(client, campaign)
+    assert {cpKey: (lotKey, lat, lon) for cpKey, lotKey, lat, lon in entries} == positions
+
+    indexes = StitchableCpIndexes(maxAge=60)
+    assert indexes.cached(campaign) is None
+    index = indexes.get(client, campaign)
+    assert len(index) == len(positions) and indexes.get(client, campaign) is index
+
+    # a cp no longer stitchable leaves the index
+    cpKey = next(iter(positions))
+    cp = client.make("Cp", *cpKey)
+    cp.stichable = False
+    indexes.updateCp(cp)
+    assert len(index) == len(positions) - 1
@@ -0,0 +1,142 @@
+# coding: utf-8
+
+# Copyright (C) 2017 Open Path View, Maison Du Libre
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Email: team@openpathview.fr
+# Description: The uncompressed TIFF rendered by hugin is read band by band into the same pixels as PIL/ImageMagick.
+
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from opv_tasks import tiffstream
+
+
+def writeTiff(path, pixels, rowsPerStrip, byteOrder="<"):
+    """
+    Write an uncompressed chunky TIFF by hand (PIL 4 can't write 16 bits RGB), like the hugin ones.
+
+    :param pixels: (height, width, samples) uint8 or uint16 array, a 4th sample is written as alpha.
+    """
+    height, width, samples = pixels.shape
+    bits = pixels.dtype.itemsize * 8
+    data = pixels.astype(pixels.dtype.newbyteorder(byteOrder)).tobytes()
+    stripSize = rowsPerStrip * width * samples * pixels.dtype.itemsize
+    strips = (height + rowsPerStrip - 1) // rowsPerStrip
+    offsets = [8 + i * stripSize for i in range(strips)]
+    counts = [min(stripSize, len(data) - i * stripSize) for i in range(strips)]
+    bitsOffset = 8 + len(data)
+    offsetsOffset = bitsOffset + 2 * samples
+    countsOffset = offsetsOffset + 4 * strips
+    ifdOffset = countsOffset + 4 * strips
+
+    # (tag, type, count, value or offset), type 3 is SHORT and 4 LONG
+    entries = [(tiffstream.IMAGE_WIDTH, 4, 1, width), (tiffstream.IMAGE_LENGTH, 4, 1, height),
+               (tiffstream.BITS_PER_SAMPLE, 3, samples, bitsOffset if samples > 1 else bits),
+               (tiffstream.COMPRESSION, 3, 1, 1), (262, 3, 1, 2 if samples >= 3 else 1),
+               (tiffstream.STRIP_OFFSETS, 4, strips, offsetsOffset if strips > 1 else offsets[0]),
+               (tiffstream.SAMPLES_PER_PIXEL, 3, 1, samples), (tiffstream.ROWS_PER_STRIP, 4, 1, rowsPerStrip),
+               (279, 4, strips, countsOffset if strips > 1 else counts[0]), (tiffstream.PLANAR_CONFIGURATION, 3, 1, 1)]
+    if samples == 4:
+        entries.append((338, 3, 1, 2))  # unassociated alpha
+    entries.sort()
+
+    out = (b"II*\x00" if byteOrder == "<" else b"MM\x00*") + struct.pack(byteOrder + "I", ifdOffset) + data
+    out += struct.pack(byteOrder + "%dH" % samples, *([bits] * samples))
+    out += struct.pack(byteOrder + "%dI" % strips, *offsets) + struct.pack(byteOrder + "%dI" % strips, *counts)
+    out += struct.pack(byteOrder + "H", len(entries))
+    for tag, kind, count, value in entries:
+        if kind == 3 and count == 1:
+            out += struct.pack(byteOrder + "HHIHH", tag, kind, count, value, 0)
+        else:
+            out += struct.pack(byteOrder + "HHII", tag, kind, count, value)
+    out += struct.pack(byteOrder + "I", 0)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def randomPixels(height, width, samples, dtype):
+    rng = np.random.RandomState(3)
+    return rng.randint(0, np.iinfo(dtype).max + 1, size=(height, width, samples)).astype(dtype)
+
+
+def to8Bits(pixels):
+    """Expected 8 bits RGB (or gray) pixels."""
+    pixels = pixels[:, :, :3] if pixels.shape[2] >= 3 else pixels[:, :, :1]
+    if pixels.dtype == np.uint16:
+        return ((pixels.astype(np.uint32) + 128) // 257).astype(np.uint8)
+    return pixels
+
+
+@pytest.mark.parametrize("byteOrder", ["<", ">"])
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("samples", [1, 3, 4])
+def test_iterBands(tmpdir, byteOrder, dtype, samples):
+    path = str(tmpdir.join("pano.tif"))
+    pixels = randomPixels(37, 23, samples, dtype)
+    writeTiff(path, pixels, rowsPerStrip=5, byteOrder=byteOrder)
+
+    layout = tiffstream.readLayout(path)
+    assert (layout.width, layout.height, layout.bits, layout.samples) == (23, 37, dtype().itemsize * 8, samples)
+    assert layout.rowsPerStrip == 5 and len(layout.offsets) == 8
+
+    bands = list(tiffstream.iterBands(path, layout, bandRows=12))
+    assert [len(band) for band in bands] == [15, 15, 7]   # whole strips
+    np.testing.assert_array_equal(np.concatenate(bands), to8Bits(pixels))
+
+
+def test_iterBandsMatchesPil(tmpdir):
+    path = str(tmpdir.join("pano.tif"))
+    pixels = randomPixels(20, 30, 3, np.uint8)
+    writeTiff(path, pixels, rowsPerStrip=3)
+    bands = tiffstream.iterBands(path, tiffstream.readLayout(path), bandRows=1)
+    np.testing.assert_array_equal(np.concatenate(list(bands)), np.asarray(Image.open(path)))
+
+
+@pytest.mark.parametrize("samples, mode", [(3, "RGB"), (4, "RGB"), (1, "L")])
+def test_writePnm(tmpdir, samples, mode):
+    path = str(tmpdir.join("pano.tif"))
+    pixels = randomPixels(17, 11, samples, np.uint16)
+    writeTiff(path, pixels, rowsPerStrip=4, byteOrder=">")
+
+    out = io.BytesIO()
+    tiffstream.writePnm(path, out, bandRows=4)
+    pnm = Image.open(io.BytesIO(out.getvalue()))
+    assert pnm.mode == mode and pnm.size == (11, 17)
+    expected = to8Bits(pixels)
+    np.testing.assert_array_equal(np.asarray(pnm), expected if samples != 1 else expected[:, :, 0])
+
+
+def test_encodeJpeg(tmpdir):
+    tif, jpeg = str(tmpdir.join("pano.tif")), str(tmpdir.join("pano.jpg"))
+    pixels = np.zeros((24, 40, 3), dtype=np.uint16)
+    pixels[:, :20] = (65535, 0, 0)
+    pixels[:, 20:] = (0, 0, 65535)
+    writeTiff(tif, pixels, rowsPerStrip=7)
+
+    tiffstream.encodeJpeg(tif, jpeg, quality=95, subsampling="4:4:4", bandRows=8)
+    image = Image.open(jpeg)
+    assert image.format == "JPEG" and image.size == (40, 24)
+    decoded = np.asarray(image).astype(int)
+    assert np.abs(decoded[:, :16] - (255, 0, 0)).max() < 8
+    assert np.abs(decoded[:, 24:] - (0, 0, 255)).max() < 8
+
+
+def test_compressedTiffIsNotStreamable(tmpdir):
+    path = str(tmpdir.join("pano.tif"))
+    Image.fromarray(randomPixels(8, 8, 3, np.uint8)).save(path, compression="tiff_lzw")
+    with pytest.raises(tiffstream.NotStreamableTiffException):
+        tiffstream.readLayout(path)